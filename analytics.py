@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+
+"""
+Loads the stats of many runs at once and compares the modes, with bootstrap confidence intervals.
+
+A run is the set of stats saved by Simulation.save_stats for one mode in one directory
+(cumulative_waiting_times_<mode>.csv, stopped_cars_<mode>.csv and queue_lengths_<mode>.csv), like ./data
+or the run directories of experiment_runner.py. The files of a mode can also carry a suffix, as the ones of
+each replication of BatchedSimulation (<mode>_<seed>) and of each intersection of NetworkSimulation
+(<mode>_r<row>c<col>): each suffix is a separate run. The files of all the runs are read and joined, each kind of
+stats is parsed as a single array, and the metrics of all the runs are computed together with NumPy.
+
+Runs of different modes are paired when they have the same suffix and are in the same directory or, as in
+experiment_runner.py, in directories whose names only differ by the mode prefix (same seed, spawn rate and
+spawning rules).
+
+Example:
+    python analytics.py data/experiments --baseline ft --resamples 10000
+"""
+
+import os
+import re
+import csv
+import glob
+import argparse
+import numpy as np
+
+MODES = ['ft', 'pi', 'vi', 'lt']
+# Mode and suffix (seed of a replication or position of an intersection, if any) of the stats of a run
+STATS_FILE = re.compile(rf"cumulative_waiting_times_({'|'.join(MODES)})(?:_(\w+))?\.csv$")
+
+# Metrics of each run, and if lower values are better (None when neither is)
+METRICS = {
+    'average_waiting_time': True,
+    'total_waiting_time': True,
+    'n_stopped_cars': True,
+    'mean_queue_length': True,
+    'max_queue_length': True,
+    'throughput': None,
+}
+PERCENTILES = [50, 90, 99]
+
+class Runs:
+    """
+    Stats of a set of runs, stored as flat arrays.
+
+    Attributes:
+    - directories: list of str with the directory of each run
+    - suffixes: list of str with the suffix of the stats files of each run (empty if they have none)
+    - modes: list of str with the modes found, in the order of MODES
+    - mode: np.ndarray with the index (in modes) of the mode of each run
+    - pairs: list of str with the keys used to pair the runs of different modes
+    - pair: np.ndarray with the index (in pairs) of the pair of each run
+    - cumulative_waiting_times: np.ndarray with the cumulative waiting times of all the runs, one after the other
+    - cumulative_offsets: np.ndarray with the index of the first cumulative waiting time of each run (and the total at the end)
+    - n_stopped_cars: np.ndarray with the number of cars that stopped in each run
+    - queue_lengths: np.ndarray with the queue lengths of all the runs, one after the other
+    - queue_offsets: np.ndarray with the index of the first queue length of each run (and the total at the end)
+    """
+    def __init__(self, runs:list):
+        mode_names = [mode for _, mode, _ in runs]
+        self.directories = [directory for directory, _, _ in runs]
+        self.suffixes = [suffix for _, _, suffix in runs]
+        self.modes = [mode for mode in MODES if mode in mode_names]
+        self.mode = np.array([self.modes.index(mode) for mode in mode_names], dtype=np.int64)
+        self.pairs, self.pair = np.unique([pair_key(directory, mode, suffix) for directory, mode, suffix in runs], return_inverse=True)
+        self.pairs = self.pairs.tolist()
+
+        self.cumulative_waiting_times, self.cumulative_offsets = _read_values([stats_path(run, 'cumulative_waiting_times') for run in runs])
+        self.n_stopped_cars, _ = _read_values([stats_path(run, 'stopped_cars') for run in runs], sep=b'')
+        self.queue_lengths, self.queue_offsets = _read_values([stats_path(run, 'queue_lengths') for run in runs])
+
+    def __len__(self) -> int:
+        return len(self.directories)
+
+    def metrics(self) -> dict:
+        """
+        Compute the metrics of every run.
+
+        Returns:
+        - dict with an np.ndarray of the values of each metric (see METRICS), one per run:
+          the total and the average waiting time per stopped car (seconds), the number of stopped cars,
+          the mean and maximum queue length, and the throughput (cars released from the queues per minute)
+        """
+        n_runs = len(self)
+        total_waiting_time = self.cumulative_waiting_times[self.cumulative_offsets[1:] - 1]
+        duration = np.diff(self.cumulative_offsets) - 1
+
+        # Run of each queue length, to reduce them all at once
+        n_queues = np.diff(self.queue_offsets)
+        queue_run = np.repeat(np.arange(n_runs), n_queues)
+        released = np.bincount(queue_run, weights=self.queue_lengths, minlength=n_runs)
+        max_queue_length = np.zeros(n_runs, dtype=np.int64)
+        np.maximum.at(max_queue_length, queue_run, self.queue_lengths)
+
+        return {
+            'average_waiting_time': np.divide(total_waiting_time, self.n_stopped_cars, out=np.zeros(n_runs), where=self.n_stopped_cars > 0),
+            'total_waiting_time': total_waiting_time.astype(np.float64),
+            'n_stopped_cars': self.n_stopped_cars.astype(np.float64),
+            'mean_queue_length': np.divide(released, n_queues, out=np.zeros(n_runs), where=n_queues > 0),
+            'max_queue_length': max_queue_length.astype(np.float64),
+            'throughput': np.divide(released * 60, duration, out=np.zeros(n_runs), where=duration > 0),
+        }
+
+def stats_path(run:tuple, stats:str) -> str:
+    """
+    Get the path of a stats file (cumulative_waiting_times, stopped_cars or queue_lengths) of a run (directory, mode, suffix).
+    """
+    directory, mode, suffix = run
+    return os.path.join(directory, f'{stats}_{mode}_{suffix}.csv' if suffix else f'{stats}_{mode}.csv')
+
+def pair_key(directory:str, mode:str, suffix:str = '') -> str:
+    """
+    Get the key that pairs the runs of different modes: the directory, without the mode prefix of its name,
+    and the suffix of the stats files.
+    """
+    parent, name = os.path.split(os.path.normpath(directory))
+    key = os.path.join(parent, name[len(mode) + 1:] if name.startswith(f'{mode}_') else name)
+    return f'{key}:{suffix}' if suffix else key
+
+def find_runs(roots:list) -> list:
+    """
+    Find the runs saved in the given directories and in their subdirectories.
+
+    Parameters:
+    - roots: list of str with the directories to search
+
+    Returns:
+    - list of (directory, mode, suffix) of the runs of the modes in MODES whose three stats files exist, sorted
+      (the suffix is empty for the files of Simulation.save_stats)
+    """
+    runs = set()
+    for root in roots:
+        for path in glob.glob(os.path.join(glob.escape(root), '**', 'cumulative_waiting_times_*.csv'), recursive=True):
+            directory, name = os.path.split(path)
+            match = STATS_FILE.match(name)
+            if match is None:
+                continue
+            run = (directory, match.group(1), match.group(2) or '')
+            if all(os.path.exists(stats_path(run, stats)) for stats in ['stopped_cars', 'queue_lengths']):
+                runs.add(run)
+    return sorted(runs)
+
+def load_runs(roots:list, modes:list = None) -> Runs:
+    """
+    Load all the runs saved in the given directories.
+
+    Parameters:
+    - roots: list of str with the directories to search (see find_runs)
+    - modes: list of str with the modes to load (all if None)
+
+    Returns:
+    - Runs with the stats of the runs
+    """
+    runs = [run for run in find_runs(roots) if modes is None or run[1] in modes]
+    assert runs, f"No runs found in {roots}"
+    return Runs(runs)
+
+def _read_values(paths:list, sep:bytes = b',') -> tuple:
+    """
+    Read the integers of many files written by Simulation.to_disk as a single array.
+
+    The contents are joined and parsed in one pass; the number of values of each file is the number of
+    separators (one after every value of a list), or one per file when sep is empty (a single value).
+
+    Returns:
+    - tuple with the np.ndarray of the values and the np.ndarray of the offset of the first value of each file (and the total at the end)
+    """
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+    counts = np.array([content.count(sep) for content in contents] if sep else [1] * len(contents), dtype=np.int64)
+    text = b' '.join(contents)
+    text = text.replace(sep, b' ') if sep else text
+    values = np.fromstring(text, dtype=np.int64, sep=' ') if counts.sum() else np.empty(0, dtype=np.int64)
+    assert len(values) == counts.sum(), "A stats file could not be parsed"
+    return values, np.concatenate(([0], np.cumsum(counts)))
+
+def grouped_percentiles(values:np.ndarray, groups:np.ndarray, n_groups:int, percentiles:list = PERCENTILES) -> np.ndarray:
+    """
+    Compute the percentiles of the values of each group at once (with linear interpolation, as np.percentile).
+
+    Parameters:
+    - values: np.ndarray with the values
+    - groups: np.ndarray with the group of each value
+    - n_groups: int representing the number of groups
+    - percentiles: list with the percentiles
+
+    Returns:
+    - np.ndarray of shape (n_groups, len(percentiles)), nan for the empty groups
+    """
+    order = np.lexsort((values, groups))
+    values = values[order].astype(np.float64)
+    sizes = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    positions = (sizes[:, None] - 1) * np.asarray(percentiles, dtype=np.float64) / 100
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(sizes[:, None] - 1, 0))
+    lower, upper = np.maximum(lower, 0), np.maximum(upper, 0)
+    padded = np.append(values, np.nan)
+    low = padded[np.where(sizes[:, None] > 0, starts[:, None] + lower, len(values))]
+    high = padded[np.where(sizes[:, None] > 0, starts[:, None] + upper, len(values))]
+    return low + (high - low) * (positions - np.floor(positions))
+
+def bootstrap_mean(values:np.ndarray, resamples:int = 10000, confidence:float = 0.95, rng:np.random.Generator = None, batch_size:int = 1 << 22) -> tuple:
+    """
+    Bootstrap confidence intervals of the means of the rows of values (the same resamples are used for every row).
+
+    The resamples are drawn as indices of the values, by batches of about batch_size indices,
+    so that the memory used does not grow with the number of resamples.
+
+    Parameters:
+    - values: np.ndarray with one row of values per metric (or a single row)
+    - resamples: int representing the number of bootstrap resamples
+    - confidence: float representing the confidence level of the intervals
+    - rng: np.random.Generator used to draw the resamples
+    - batch_size: int representing the maximum number of indices drawn at once
+
+    Returns:
+    - tuple with the np.ndarray of the lower and of the upper bounds of the intervals (nan if there are no values)
+    """
+    values = np.atleast_2d(values)
+    n = values.shape[1]
+    if n == 0:
+        return np.full(len(values), np.nan), np.full(len(values), np.nan)
+    rng = rng if rng is not None else np.random.default_rng()
+    per_batch = max(1, batch_size // n)
+    means = np.concatenate([
+        values[:, rng.integers(0, n, size=(min(per_batch, resamples - start), n))].mean(axis=2)
+        for start in range(0, resamples, per_batch)
+    ], axis=1)
+    alpha = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [alpha, 100 - alpha], axis=1)
+    return low, high
+
+def summarize(runs:Runs, resamples:int = 10000, confidence:float = 0.95, seed:int = 0) -> list:
+    """
+    Summarize the metrics of each mode.
+
+    Parameters:
+    - runs: Runs to summarize
+    - resamples: int representing the number of bootstrap resamples
+    - confidence: float representing the confidence level of the intervals
+    - seed: int used to seed the bootstrap
+
+    Returns:
+    - list of dict, one per mode, with the number of runs, the mean and its confidence interval for each metric,
+      the percentiles over the runs of the average waiting time, and the percentiles of all the queue lengths of the mode
+    """
+    rng = np.random.default_rng(seed)
+    metrics = runs.metrics()
+    n_modes = len(runs.modes)
+    n_runs = np.bincount(runs.mode, minlength=n_modes)
+
+    waiting_percentiles = grouped_percentiles(metrics['average_waiting_time'], runs.mode, n_modes)
+    queue_mode = np.repeat(runs.mode, np.diff(runs.queue_offsets))
+    queue_percentiles = grouped_percentiles(runs.queue_lengths, queue_mode, n_modes)
+
+    # One row per metric, one column per run
+    values = np.stack(list(metrics.values()))
+
+    summaries = []
+    for m, mode in enumerate(runs.modes):
+        summary = {'mode': mode, 'n_runs': int(n_runs[m])}
+        mode_values = values[:, runs.mode == m]
+        lows, highs = bootstrap_mean(mode_values, resamples, confidence, rng)
+        for name, mean, low, high in zip(metrics, mode_values.mean(axis=1), lows, highs):
+            summary[name], summary[f'{name}_low'], summary[f'{name}_high'] = float(mean), float(low), float(high)
+        for percentile, value in zip(PERCENTILES, waiting_percentiles[m]):
+            summary[f'average_waiting_time_p{percentile}'] = float(value)
+        for percentile, value in zip(PERCENTILES, queue_percentiles[m]):
+            summary[f'queue_length_p{percentile}'] = float(value)
+        summaries.append(summary)
+    return summaries
+
+def compare(runs:Runs, baseline:str = 'ft', resamples:int = 10000, confidence:float = 0.95, seed:int = 0) -> list:
+    """
+    Compare each mode with the baseline on the paired runs (same pair key), metric by metric.
+
+    Parameters:
+    - runs: Runs to compare
+    - baseline: str representing the mode compared against
+    - resamples: int representing the number of bootstrap resamples
+    - confidence: float representing the confidence level of the intervals
+    - seed: int used to seed the bootstrap
+
+    Returns:
+    - list of dict, one per mode and metric, with the number of pairs, the mean of the paired differences
+      (mode - baseline) and its confidence interval, and the share of the pairs where the mode is better
+      (nan for the throughput, that counts the cars released from the queues: fewer queues also means a lower throughput)
+    """
+    assert baseline in runs.modes, f"No runs of the baseline mode {baseline}"
+    rng = np.random.default_rng(seed)
+    values = np.stack(list(runs.metrics().values()))
+
+    # Run of each mode and pair (-1 where there is none)
+    table = np.full((len(runs.modes), len(runs.pairs)), -1, dtype=np.int64)
+    table[runs.mode, runs.pair] = np.arange(len(runs))
+    b = runs.modes.index(baseline)
+
+    comparisons = []
+    for m, mode in enumerate(runs.modes):
+        if m == b:
+            continue
+        paired = (table[m] >= 0) & (table[b] >= 0)
+        differences = values[:, table[m, paired]] - values[:, table[b, paired]]
+        lows, highs = bootstrap_mean(differences, resamples, confidence, rng)
+        for (name, lower_is_better), metric_differences, low, high in zip(METRICS.items(), differences, lows, highs):
+            better = metric_differences < 0 if lower_is_better else metric_differences > 0
+            comparisons.append({
+                'mode': mode,
+                'baseline': baseline,
+                'metric': name,
+                'n_pairs': int(paired.sum()),
+                'difference': float(metric_differences.mean()) if paired.any() else np.nan,
+                'difference_low': float(low),
+                'difference_high': float(high),
+                'share_better': float(better.mean()) if paired.any() and lower_is_better is not None else np.nan,
+            })
+    return comparisons
+
+def _write_csv(rows:list, path:str) -> None:
+    """
+    Write a list of dict as a CSV table.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the modes over the stats of many runs, with bootstrap confidence intervals.')
+    parser.add_argument('roots', nargs='*', default=['./data'], help='directories with the runs (searched recursively)')
+    parser.add_argument('--modes', nargs='+', default=None, help='modes to load (default: all)')
+    parser.add_argument('--baseline', default='ft', help='mode the other modes are compared with')
+    parser.add_argument('--resamples', type=int, default=10000, help='number of bootstrap resamples')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the intervals')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the bootstrap')
+    parser.add_argument('--output', default=None, help='directory where summary_by_mode.csv and paired_differences.csv are written')
+    args = parser.parse_args()
+
+    runs = load_runs(args.roots, args.modes)
+    summaries = summarize(runs, args.resamples, args.confidence, args.seed)
+    print(f"{len(runs)} runs, {len(runs.pairs)} pairs, {args.confidence:.0%} bootstrap intervals")
+    for summary in summaries:
+        print(f"{summary['mode']} ({summary['n_runs']} runs)")
+        for name in METRICS:
+            print(f"  {name:<22} {summary[name]:>10.2f}  [{summary[f'{name}_low']:.2f}, {summary[f'{name}_high']:.2f}]")
+        print(f"  {'average waiting p50/p90/p99':<22} " + ' / '.join(f"{summary[f'average_waiting_time_p{p}']:.2f}" for p in PERCENTILES))
+        print(f"  {'queue length p50/p90/p99':<22} " + ' / '.join(f"{summary[f'queue_length_p{p}']:.1f}" for p in PERCENTILES))
+
+    comparisons = compare(runs, args.baseline, args.resamples, args.confidence, args.seed) if args.baseline in runs.modes else []
+    for comparison in comparisons:
+        print(
+            f"{comparison['mode']} - {comparison['baseline']} {comparison['metric']:<22} ({comparison['n_pairs']} pairs) "
+            f"{comparison['difference']:>10.2f}  [{comparison['difference_low']:.2f}, {comparison['difference_high']:.2f}]  "
+            + (f"better in {comparison['share_better']:.0%}" if not np.isnan(comparison['share_better']) else '')
+        )
+
+    if args.output:
+        _write_csv(summaries, os.path.join(args.output, 'summary_by_mode.csv'))
+        _write_csv(comparisons, os.path.join(args.output, 'paired_differences.csv')) if comparisons else None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+Allocation benchmarks of the cars: memory per car, and cost of the spawns and exits at sustained high spawn rates.
+
+The spawns and exits are measured with the CarPool of CarManager enabled and disabled (max_size=0, every
+spawn allocates a new Car): the latency of add_car, the time of update_cars (where the exits happen) and the
+number of garbage collections triggered while the intersection is saturated.
+
+Example:
+    python -m benchmarks.allocation --output allocation.json
+"""
+
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from entities.car import Car, CarPool
+from entities.car_manager import CarManager
+from entities.environment import HeadlessWindow
+from entities.simulation import FPS, WINDOW_SIZE
+from benchmarks.throughput import _summarize, _step_stoplight, _warm_up
+from entities.stoplight import Stoplight
+
+SPAWN_TICKS = [3, 1]        # ticks between spawns (0.1 s and every tick)
+
+def bytes_per_car(n_cars:int = 10000, seed:int = 0) -> float:
+    """
+    Measure the memory allocated for each new car (including its attributes), with tracemalloc.
+
+    Parameters:
+    - n_cars: int representing the number of cars allocated
+    - seed: int used to seed the random generator
+
+    Returns:
+    - float representing the bytes per car
+    """
+    random.seed(seed)
+    window = HeadlessWindow(WINDOW_SIZE)
+    Car(window)     # shared geometry
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    cars = [Car(window) for _ in range(n_cars)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # The list holding the cars is not part of the cars
+    return (size - sys.getsizeof(cars)) / len(cars)
+
+def bench_spawn_exit(spawn_ticks:int, ticks:int, pooled:bool, seed:int = 0) -> dict:
+    """
+    Time the spawns and the updates (with the exits) of an intersection with a car spawning every spawn_ticks ticks.
+
+    Parameters:
+    - spawn_ticks: int representing the number of ticks between spawns
+    - ticks: int representing the number of ticks to measure
+    - pooled: bool representing if the cars that left the window are reused
+    - seed: int used to seed the random generator
+
+    Returns:
+    - dict with the add_car and update_cars results, and the garbage collections per 1000 ticks
+    """
+    random.seed(seed)
+    car_manager = CarManager(HeadlessWindow(WINDOW_SIZE), pool=CarPool() if pooled else CarPool(max_size=0))
+    stoplight = Stoplight()
+    start = _warm_up(car_manager, stoplight, spawn_ticks)
+
+    collections = [0]
+    def count_collections(phase, info):
+        collections[0] += phase == 'start'
+
+    spawn_latencies, update_latencies, peak_cars = [], [], 0
+    gc.callbacks.append(count_collections)
+    try:
+        for tick in range(start + 1, start + ticks + 1):
+            _step_stoplight(stoplight)
+            if tick % spawn_ticks == 0:
+                begin = time.perf_counter_ns()
+                car_manager.add_car()
+                spawn_latencies.append(time.perf_counter_ns() - begin)
+            peak_cars = max(peak_cars, len(car_manager.cars))
+
+            begin = time.perf_counter_ns()
+            car_manager.update_cars(stoplight)
+            update_latencies.append(time.perf_counter_ns() - begin)
+    finally:
+        gc.callbacks.remove(count_collections)
+
+    return {
+        'add_car': _summarize(spawn_latencies, peak_cars),
+        'update_cars': _summarize(update_latencies, peak_cars),
+        'gc_collections_per_1000_ticks': collections[0] * 1000 / ticks,
+        'reused': car_manager.pool.n_reused,
+        'allocated': car_manager.pool.n_allocated,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory and the spawn/exit cost of the cars.')
+    parser.add_argument('--ticks', type=int, default=6000, help='ticks measured by the spawn/exit benchmarks')
+    parser.add_argument('--spawn-ticks', nargs='+', type=int, default=SPAWN_TICKS, help='ticks between spawns')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    args = parser.parse_args()
+
+    results = {'bytes_per_car': bytes_per_car()}
+    print(f"Bytes per car: {results['bytes_per_car']:.0f}")
+
+    print(f"\n{'benchmark':<40} {'add_car p50 us':>15} {'add_car p99 us':>15} {'update mean us':>15} {'gc/1000 ticks':>14} {'cars':>6}")
+    for spawn_ticks in args.spawn_ticks:
+        for pooled in [False, True]:
+            name = f"spawn_exit[every={spawn_ticks / FPS:.3f}s,pool={'on' if pooled else 'off'}]"
+            result = results[name] = bench_spawn_exit(spawn_ticks, args.ticks, pooled)
+            print(f"{name:<40} {result['add_car']['p50_us']:>15.2f} {result['add_car']['p99_us']:>15.2f} {result['update_cars']['mean_us']:>15.1f} {result['gc_collections_per_1000_ticks']:>14.1f} {result['add_car']['peak_cars']:>6}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
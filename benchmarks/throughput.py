@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+"""
+Throughput benchmarks of the simulation core, run headless at several traffic densities.
+
+For each car spawn rate, the benchmarks time CarManager.update_cars (and the vectorized manager),
+Stoplight.update_stoplight and the TrafficMDP decisions (policy iteration and value iteration); at a
+realistic density (TICK_SPAWN_RATE), they also time whole ticks of both car managers with the observation
+read by the lt mode at every tick. They report ticks per second, per-tick latency percentiles and the peak number of cars. Each benchmark
+is repeated (the repeats of all the benchmarks are interleaved) and the best repeat is kept (highest
+throughput, lowest latencies), which filters out short bursts of noise from the other processes.
+
+The results are written to a JSON file, which can be compared against a stored baseline: the
+comparison fails (exit code 1) if a benchmark got slower than the baseline by more than the tolerance.
+The raw numbers are compared. On a machine whose speed drifts as a whole (frequency scaling, noisy
+neighbours), --normalize first scales the baseline by the median speed ratio of all the benchmarks: a
+benchmark then regresses when it got slower than the rest of the suite, so a change that slows down most
+of the benchmarks (e.g. in Car or CarManager, used by all of them) is no longer caught. The median speed
+ratio is always printed.
+The 95th percentile latency is noisier than the throughput, so it has its own, wider tolerance, and
+it is only compared when it grew by more than a few microseconds.
+
+Example:
+    python -m benchmarks.throughput --output bench.json --save-baseline benchmarks/baseline.json
+    python -m benchmarks.throughput --output bench.json --baseline benchmarks/baseline.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import numpy as np
+from entities.car_manager import CarManager
+from entities.vectorized_car_manager import VectorizedCarManager
+from entities.environment import HeadlessWindow
+from entities.stoplight import Stoplight
+from entities.simulation import FPS, WINDOW_SIZE
+from model.TrafficMDP import TrafficMDP
+from entities.colors import TrafficLightColor
+from entities.car_actions import CarActions
+
+SPAWN_RATES = [1.5, 0.5, 0.2, 0.1]      # seconds between spawns, from sparse to saturated traffic
+TICK_SPAWN_RATE = 0.5                   # seconds between spawns of the whole tick benchmarks (about 30 cars in the window)
+WARMUP_TICKS = 20 * FPS                 # ticks run before measuring, to fill the intersection
+PERCENTILES = [50, 95, 99]
+REPEATS = 5                             # runs of each benchmark, the best one is kept
+MIN_LATENCY_DELTA_US = 2.0              # smaller growths of the p95 latency are timer noise
+
+def _summarize(latencies_ns:list, peak_cars:int = 0) -> dict:
+    """
+    Summarize the latencies of a benchmark.
+
+    Parameters:
+    - latencies_ns: list of the latencies of each call, in nanoseconds
+    - peak_cars: int representing the peak number of cars during the benchmark
+
+    Returns:
+    - dict with the calls per second, the latency percentiles (in microseconds) and the peak number of cars
+    """
+    latencies = np.array(latencies_ns, dtype=np.float64) / 1000
+    result = {
+        'ticks_per_second': len(latencies) / (latencies.sum() / 1e6) if latencies.sum() else float('inf'),
+        'mean_us': float(latencies.mean()),
+        'peak_cars': peak_cars,
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        result[f'p{percentile}_us'] = float(value)
+    return result
+
+def _best(runs:list) -> dict:
+    """
+    Keep the best of several runs of a benchmark: the highest throughput and the lowest latencies.
+
+    Parameters:
+    - runs: list of dict with the results of each run
+
+    Returns:
+    - dict with the results of the benchmark
+    """
+    best = dict(runs[0])
+    best['ticks_per_second'] = max(run['ticks_per_second'] for run in runs)
+    for key in ['mean_us'] + [f'p{percentile}_us' for percentile in PERCENTILES]:
+        best[key] = min(run[key] for run in runs)
+    return best
+
+def _step_stoplight(stoplight:Stoplight) -> None:
+    """
+    Advance the stoplight by one tick with the fixed time policy.
+    """
+    stoplight.update_stoplight()
+    if stoplight.time_green // FPS >= 20:
+        stoplight.switch_yellow()
+
+def _warm_up(car_manager, stoplight:Stoplight, spawn_ticks:int) -> int:
+    """
+    Run the intersection with spawning for WARMUP_TICKS ticks.
+
+    Returns:
+    - int representing the tick reached
+    """
+    for tick in range(1, WARMUP_TICKS + 1):
+        _step_stoplight(stoplight)
+        if tick % spawn_ticks == 0:
+            car_manager.add_car()
+        car_manager.update_cars(stoplight)
+    return WARMUP_TICKS
+
+def _n_cars(car_manager) -> int:
+    return car_manager.n_cars if isinstance(car_manager, VectorizedCarManager) else len(car_manager.cars)
+
+def bench_car_manager(manager_class, spawn_rate:float, ticks:int, seed:int = 0) -> dict:
+    """
+    Time update_cars on an intersection with cars spawning every spawn_rate seconds.
+
+    Parameters:
+    - manager_class: CarManager or VectorizedCarManager
+    - spawn_rate: float representing the time between spawns, in seconds
+    - ticks: int representing the number of ticks to measure
+    - seed: int used to seed the random generator
+
+    Returns:
+    - dict with the results of the benchmark
+    """
+    random.seed(seed)
+    car_manager = manager_class(HeadlessWindow(WINDOW_SIZE))
+    stoplight = Stoplight()
+    spawn_ticks = max(1, round(spawn_rate * FPS))
+    start = _warm_up(car_manager, stoplight, spawn_ticks)
+
+    latencies, peak_cars = [], 0
+    for tick in range(start + 1, start + ticks + 1):
+        _step_stoplight(stoplight)
+        if tick % spawn_ticks == 0:
+            car_manager.add_car()
+        peak_cars = max(peak_cars, _n_cars(car_manager))
+
+        begin = time.perf_counter_ns()
+        car_manager.update_cars(stoplight)
+        latencies.append(time.perf_counter_ns() - begin)
+
+    return _summarize(latencies, peak_cars)
+
+def bench_tick(manager_class, spawn_rate:float, ticks:int, seed:int = 0) -> dict:
+    """
+    Time the car manager side of a tick of the lt mode: the observation read by the decision while a
+    direction is green (get_stats and get_max_waiting_time), then update_cars.
+
+    Parameters:
+    - manager_class: CarManager or VectorizedCarManager
+    - spawn_rate: float representing the time between spawns, in seconds
+    - ticks: int representing the number of ticks to measure
+    - seed: int used to seed the random generator
+
+    Returns:
+    - dict with the results of the benchmark
+    """
+    random.seed(seed)
+    car_manager = manager_class(HeadlessWindow(WINDOW_SIZE))
+    stoplight = Stoplight()
+    spawn_ticks = max(1, round(spawn_rate * FPS))
+    start = _warm_up(car_manager, stoplight, spawn_ticks)
+
+    latencies, peak_cars = [], 0
+    for tick in range(start + 1, start + ticks + 1):
+        _step_stoplight(stoplight)
+        if tick % spawn_ticks == 0:
+            car_manager.add_car()
+        peak_cars = max(peak_cars, _n_cars(car_manager))
+        red_directions = [CarActions.LEFT, CarActions.RIGHT] if stoplight.color_NS == TrafficLightColor.GREEN.value else [CarActions.UP, CarActions.DOWN]
+
+        begin = time.perf_counter_ns()
+        if TrafficLightColor.GREEN.value in (stoplight.color_NS, stoplight.color_EW):
+            car_manager.get_stats()
+            car_manager.get_max_waiting_time(red_directions)
+        car_manager.update_cars(stoplight)
+        latencies.append(time.perf_counter_ns() - begin)
+
+    return _summarize(latencies, peak_cars)
+
+def bench_stoplight(ticks:int, seed:int = 0) -> dict:
+    """
+    Time Stoplight.update_stoplight.
+
+    Parameters:
+    - ticks: int representing the number of ticks to measure
+    - seed: int used to seed the random generator
+
+    Returns:
+    - dict with the results of the benchmark
+    """
+    random.seed(seed)
+    stoplight = Stoplight()
+    latencies = []
+    for _ in range(ticks):
+        begin = time.perf_counter_ns()
+        stoplight.update_stoplight()
+        latencies.append(time.perf_counter_ns() - begin)
+        if stoplight.time_green // FPS >= 20:
+            stoplight.switch_yellow()
+    return _summarize(latencies)
+
+def bench_mdp(solver:str, spawn_rate:float, decisions:int, seed:int = 0) -> dict:
+    """
+    Time the TrafficMDP decisions taken once per second on an intersection with cars spawning every spawn_rate seconds.
+
+    Parameters:
+    - solver: str representing the algorithm ('pi' for policy iteration, 'vi' for value iteration)
+    - spawn_rate: float representing the time between spawns, in seconds
+    - decisions: int representing the number of decisions to measure
+    - seed: int used to seed the random generator
+
+    Returns:
+    - dict with the results of the benchmark (ticks are decisions here)
+    """
+    random.seed(seed)
+    car_manager = CarManager(HeadlessWindow(WINDOW_SIZE))
+    stoplight = Stoplight()
+    mdp = TrafficMDP()
+    spawn_ticks = max(1, round(spawn_rate * FPS))
+    tick = _warm_up(car_manager, stoplight, spawn_ticks)
+
+    latencies, peak_cars = [], 0
+    while len(latencies) < decisions:
+        tick += 1
+        _step_stoplight(stoplight)
+        if tick % spawn_ticks == 0:
+            car_manager.add_car()
+        car_manager.update_cars(stoplight)
+
+        if tick % FPS == 0:
+            state = 'NS' if stoplight.color_NS == TrafficLightColor.GREEN.value else 'EW'
+            stats = car_manager.get_stats()
+            peak_cars = max(peak_cars, len(car_manager.get_cars()))
+
+            begin = time.perf_counter_ns()
+            if solver == 'pi':
+                mdp.policy_iteration(stats)
+                mdp.get_action(state)
+            else:
+                mdp.value_iteration(stats, state)
+            latencies.append(time.perf_counter_ns() - begin)
+
+    return _summarize(latencies, peak_cars)
+
+def run_suite(ticks:int = 3000, decisions:int = 100, spawn_rates:list = SPAWN_RATES, repeats:int = REPEATS) -> dict:
+    """
+    Run all the benchmarks.
+
+    Parameters:
+    - ticks: int representing the number of ticks measured by the tick benchmarks
+    - decisions: int representing the number of decisions measured by the MDP benchmarks
+    - spawn_rates: list of float with the car spawn rates, in seconds
+    - repeats: int representing the number of runs of each benchmark (the best one is kept)
+
+    Returns:
+    - dict with the results of each benchmark, by name
+    """
+    benchmarks = {'stoplight.update_stoplight': (bench_stoplight, ticks)}
+    for spawn_rate in spawn_rates:
+        benchmarks[f'car_manager.update_cars[rate={spawn_rate}]'] = (bench_car_manager, CarManager, spawn_rate, ticks)
+        benchmarks[f'vectorized_car_manager.update_cars[rate={spawn_rate}]'] = (bench_car_manager, VectorizedCarManager, spawn_rate, ticks)
+        benchmarks[f'mdp.policy_iteration[rate={spawn_rate}]'] = (bench_mdp, 'pi', spawn_rate, decisions)
+        benchmarks[f'mdp.value_iteration[rate={spawn_rate}]'] = (bench_mdp, 'vi', spawn_rate, decisions)
+    benchmarks[f'car_manager.tick[rate={TICK_SPAWN_RATE}]'] = (bench_tick, CarManager, TICK_SPAWN_RATE, ticks)
+    benchmarks[f'vectorized_car_manager.tick[rate={TICK_SPAWN_RATE}]'] = (bench_tick, VectorizedCarManager, TICK_SPAWN_RATE, ticks)
+
+    # The repeats are interleaved, so that a slow phase of the machine does not hit all the runs of a benchmark
+    runs = {name: [] for name in benchmarks}
+    for repeat in range(repeats):
+        print(f"Repeat {repeat + 1}/{repeats}", file=sys.stderr)
+        for name, (bench, *args) in benchmarks.items():
+            runs[name].append(bench(*args))
+    return {name: _best(runs[name]) for name in benchmarks}
+
+def speed_ratio(results:dict, baseline:dict) -> float:
+    """
+    Get the median ratio of the throughput of the benchmarks to their throughput in the baseline.
+
+    Parameters:
+    - results: dict with the results of each benchmark, by name
+    - baseline: dict with the baseline results of each benchmark, by name
+
+    Returns:
+    - float representing the speed of the machine relative to the baseline (1.0 if no benchmark is in both)
+    """
+    ratios = [results[name]['ticks_per_second'] / baseline[name]['ticks_per_second'] for name in baseline.keys() & results.keys()]
+    return float(np.median(ratios)) if ratios else 1.0
+
+def compare(results:dict, baseline:dict, tolerance:float, latency_tolerance:float = 0.5, min_latency_delta_us:float = MIN_LATENCY_DELTA_US, normalize:bool = False) -> list:
+    """
+    Compare the results against a baseline.
+
+    A benchmark regresses if its throughput dropped by more than the tolerance, or if its 95th percentile
+    latency grew by more than the latency tolerance and by more than min_latency_delta_us.
+    Benchmarks that are not in both results are not compared.
+
+    Parameters:
+    - results: dict with the results of each benchmark, by name
+    - baseline: dict with the baseline results of each benchmark, by name
+    - tolerance: float representing the accepted relative drop of the throughput (e.g. 0.2 for 20%)
+    - latency_tolerance: float representing the accepted relative growth of the 95th percentile latency
+    - min_latency_delta_us: float representing the growth of the 95th percentile latency always accepted, in microseconds
+    - normalize: bool representing if the baseline is first scaled by the speed ratio of the suite (see speed_ratio)
+
+    Returns:
+    - list of str describing the regressions
+    """
+    speed = speed_ratio(results, baseline) if normalize else 1.0
+    scaled = f" (scaled by {speed:.2f})" if normalize else ''
+    regressions = []
+    for name in sorted(baseline.keys() & results.keys()):
+        reference, result = baseline[name], results[name]
+        expected_tps, expected_p95 = reference['ticks_per_second'] * speed, reference['p95_us'] / speed
+        if result['ticks_per_second'] < expected_tps * (1 - tolerance):
+            regressions.append(f"{name}: {result['ticks_per_second']:.0f} ticks/s, baseline {expected_tps:.0f} ticks/s{scaled}")
+        if result['p95_us'] > expected_p95 * (1 + latency_tolerance) and result['p95_us'] - expected_p95 > min_latency_delta_us:
+            regressions.append(f"{name}: p95 {result['p95_us']:.1f} us, baseline {expected_p95:.1f} us{scaled}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of the simulation core.')
+    parser.add_argument('--ticks', type=int, default=3000, help='ticks measured by the tick benchmarks')
+    parser.add_argument('--decisions', type=int, default=100, help='decisions measured by the MDP benchmarks')
+    parser.add_argument('--spawn-rates', nargs='+', type=float, default=SPAWN_RATES)
+    parser.add_argument('--output', default='bench.json', help='JSON file where the results are written')
+    parser.add_argument('--baseline', help='JSON file with the baseline to compare against')
+    parser.add_argument('--save-baseline', help='also write the results to this file, to be used as a baseline')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='runs of each benchmark, the best one is kept')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='accepted relative drop of the throughput against the baseline')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5, help='accepted relative growth of the p95 latency against the baseline')
+    parser.add_argument('--normalize', action='store_true', help='scale the baseline by the median speed ratio of the suite before comparing (hides slowdowns of most benchmarks)')
+    args = parser.parse_args()
+
+    results = run_suite(args.ticks, args.decisions, args.spawn_rates, args.repeats)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'ticks': args.ticks,
+            'decisions': args.decisions,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+
+    print(f"{'benchmark':<52} {'ticks/s':>12} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'cars':>6}")
+    for name, result in results.items():
+        print(f"{name:<52} {result['ticks_per_second']:>12.0f} {result['p50_us']:>10.1f} {result['p95_us']:>10.1f} {result['p99_us']:>10.1f} {result['peak_cars']:>6}")
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance, args.latency_tolerance, normalize=args.normalize)
+        skipped = sorted(baseline.keys() ^ results.keys())
+        print(f"\nSpeed against the baseline (median over the benchmarks): {speed_ratio(results, baseline):.2f}")
+        if skipped:
+            print(f"Not compared (not in both files): {', '.join(skipped)}")
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from entities.colors import TrafficLightColor
+from entities.stoplight import Stoplight
+from entities.intersection_stats import TICKS_PER_SECOND
+
+PERCENTILES = [50, 95, 99]
+
+class AsyncController:
+    """
+    Takes the decisions of the pi and vi controllers on a worker thread, so that a slow solve does not stall the ticks.
+
+    When a decision is due, a snapshot of the observation is submitted to the worker and the simulation keeps
+    ticking. The decision is applied at the first tick after the solve is over, or, if the deadline expires first,
+    the fallback action is applied instead and the late answer is dropped. No decision is submitted while the
+    worker is busy. The action of the pi policy is drawn when the decision is applied, on the simulation thread.
+
+    With a deadline of None the simulation waits for every answer at the tick it was submitted, which gives the
+    same results as the synchronous controller. Otherwise the results depend on how fast the solves run.
+
+    Attributes:
+    - mdp: TrafficMDP of the controller (only used by the worker while a solve is in progress)
+    - mode: str representing the mode of the controller ('pi' or 'vi')
+    - deadline: int representing the number of ticks to wait for a decision (None to always wait)
+    - fallback: str representing the action applied when the deadline expires ('maintain' or 'change')
+    - executor: ThreadPoolExecutor with the worker thread
+    - pending: tuple (future, tick, state) of the decision in progress (None if the worker is idle)
+    - expired: bool representing if the deadline of the pending decision has expired
+    - latencies_ns: list with the time from the submission to the answer of each decision, in nanoseconds
+    - latencies_ticks: list with the number of ticks from the submission to the application of each applied decision
+    - n_submitted: int representing the number of decisions submitted
+    - n_applied: int representing the number of decisions applied before their deadline
+    - n_missed: int representing the number of deadlines that expired (the fallback action was applied)
+    - n_late: int representing the number of answers that arrived after their deadline and were dropped
+    """
+    def __init__(self, mdp, mode:str, deadline:int = TICKS_PER_SECOND, fallback:str = 'maintain'):
+        assert mode in ['pi', 'vi'], "Only the pi and vi controllers run asynchronously"
+        assert fallback in mdp.actions, f"The fallback action must be one of {mdp.actions}"
+        self.mdp = mdp
+        self.mode = mode
+        self.deadline = deadline
+        self.fallback = fallback
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='controller')
+        self.pending = None
+        self.expired = False
+        self.latencies_ns = []
+        self.latencies_ticks = []
+        self.n_submitted = 0
+        self.n_applied = 0
+        self.n_missed = 0
+        self.n_late = 0
+
+    def _solve(self, stats, state:str, submitted_ns:int) -> tuple:
+        """
+        Solve the MDP on the worker thread.
+
+        Returns:
+        - tuple with the action of vi (None for pi, whose action is drawn when applied) and the latency in nanoseconds
+        """
+        if self.mode == 'pi':
+            self.mdp.policy_iteration(stats)
+            action = None
+        else:
+            action = self.mdp.value_iteration(stats, state)
+        return action, time.perf_counter_ns() - submitted_ns
+
+    def step(self, tick:int, stoplight, stats, new_second:bool) -> None:
+        """
+        Apply the decision that has arrived or whose deadline has expired, and submit a new one if it is due.
+
+        Parameters:
+        - tick: int representing the current tick
+        - stoplight: Stoplight controlled
+        - stats: IntersectionStats of the cars (a snapshot is submitted)
+        - new_second: bool representing if the current tick starts a new simulated second
+        """
+        if self.pending is not None:
+            future, submitted, state = self.pending
+            if future.done():
+                action, latency_ns = future.result()
+                self.latencies_ns.append(latency_ns)
+                self.pending = None
+                if self.expired:
+                    self.n_late += 1
+                else:
+                    self._apply(stoplight, state, action, tick - submitted)
+            elif not self.expired and tick - submitted >= self.deadline:
+                self.expired = True
+                self.n_missed += 1
+                stoplight.switch_yellow() if self.fallback == 'change' else None
+
+        # Same trigger as the synchronous controller: once per second after MIN_GREEN_DURATION seconds of green
+        if self.pending is None and stoplight.time_green // TICKS_PER_SECOND >= Stoplight.MIN_GREEN_DURATION and new_second:
+            state = 'NS' if stoplight.color_NS == TrafficLightColor.GREEN.value else 'EW'
+            future = self.executor.submit(self._solve, stats.copy(), state, time.perf_counter_ns())
+            self.pending = (future, tick, state)
+            self.expired = False
+            self.n_submitted += 1
+            # Let the worker take the interpreter lock now, instead of at the next switch interval
+            time.sleep(0)
+            if self.deadline is None:
+                action, latency_ns = future.result()
+                self.latencies_ns.append(latency_ns)
+                self.pending = None
+                self._apply(stoplight, state, action, 0)
+
+    def _apply(self, stoplight, state:str, action:str, latency_ticks:int) -> None:
+        """
+        Apply a decision that arrived in time.
+        """
+        action = action if action is not None else self.mdp.get_action(state)
+        stoplight.switch_yellow() if action == 'change' else None
+        self.latencies_ticks.append(latency_ticks)
+        self.n_applied += 1
+
+    def close(self) -> None:
+        """
+        Wait for the solve in progress (if any) and stop the worker thread.
+        """
+        self.executor.shutdown(wait=True)
+
+    def summary(self) -> dict:
+        """
+        Summarize the decisions of the run.
+
+        Returns:
+        - dict with the number of decisions submitted, applied, missed and late, the percentiles of the
+          latencies (ms) and the mean and maximum number of ticks before a decision was applied
+        """
+        summary = {
+            'submitted': self.n_submitted,
+            'applied': self.n_applied,
+            'missed': self.n_missed,
+            'late': self.n_late,
+            'deadline_ticks': self.deadline,
+            'fallback': self.fallback,
+        }
+        if self.latencies_ns:
+            latencies_ms = np.array(self.latencies_ns, dtype=np.float64) / 1e6
+            summary['latency_mean_ms'] = float(latencies_ms.mean())
+            for percentile, value in zip(PERCENTILES, np.percentile(latencies_ms, PERCENTILES)):
+                summary[f'latency_p{percentile}_ms'] = float(value)
+        if self.latencies_ticks:
+            summary['latency_mean_ticks'] = float(np.mean(self.latencies_ticks))
+            summary['latency_max_ticks'] = int(max(self.latencies_ticks))
+        return summary
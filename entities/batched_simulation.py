@@ -0,0 +1,268 @@
+import os
+import random
+import numpy as np
+from entities.simulation import Simulation, FPS, WINDOW_SIZE
+from entities.environment import HeadlessWindow
+from entities.stoplight import Stoplight
+from entities.vectorized_car_manager import VectorizedCarManager, DIRECTIONS, replay_queues
+from model.TrafficMDP import TrafficMDP
+
+# Stoplight colors are stored as codes in the batched stoplights
+GREEN, YELLOW, RED = range(3)
+
+class BatchedStoplights:
+    """
+    K independent stoplights stored in arrays, following the same rules as Stoplight.
+
+    Attributes:
+    - color_NS: array with the color code of the north-south direction of each stoplight
+    - color_EW: array with the color code of the east-west direction of each stoplight
+    - time_yellow: array with the time that each stoplight has been yellow
+    - time_green: array with the time that each stoplight has been green
+    """
+    def __init__(self, rngs:list):
+        # Random color for the north-south direction, drawn like in Stoplight, and the opposite for east-west
+        ns_green = np.array([rng.choice([True, False]) for rng in rngs], dtype=bool)
+        self.color_NS = np.where(ns_green, GREEN, RED).astype(np.int8)
+        self.color_EW = np.where(ns_green, RED, GREEN).astype(np.int8)
+
+        self.time_yellow = np.zeros(len(rngs), dtype=np.int32)
+        self.time_green = np.zeros(len(rngs), dtype=np.int32)
+
+    def switch_yellow(self, mask:np.ndarray):
+        """
+        Switch the stoplights that are green to yellow.
+
+        Parameters:
+        - mask: array with True for the stoplights to switch
+        """
+        ns = mask & (self.color_NS == GREEN)
+        ew = mask & ~ns & (self.color_EW == GREEN)
+        self.color_NS[ns] = YELLOW
+        self.color_EW[ew] = YELLOW
+        self.time_green[ns | ew] = 0
+
+    def update_stoplights(self):
+        """
+        Update the time that the stoplights have been green and/or yellow.
+
+        Update the color of the yellow stoplights when the yellow light duration is reached.
+        """
+        self.time_green[(self.color_NS == GREEN) | (self.color_EW == GREEN)] += 1
+        self.time_yellow[(self.color_NS == YELLOW) | (self.color_EW == YELLOW)] += 1
+
+        done = self.time_yellow >= Stoplight.YELLOW_DURATION
+        ns = done & (self.color_NS == YELLOW)
+        ew = done & ~ns & (self.color_EW == YELLOW)
+        self.color_NS[ns], self.color_EW[ns] = RED, GREEN
+        self.color_EW[ew], self.color_NS[ew] = RED, GREEN
+        self.time_yellow[done] = 0
+
+class BatchedCarManager(VectorizedCarManager):
+    """
+    Manages the cars of K independent intersections in the same arrays.
+
+    Each car stores the index of its intersection (env), and cars of different intersections never
+    interact. Statistics are kept per intersection.
+
+    Attributes:
+    - rngs: list of random.Random, one per intersection
+    - env: array with the intersection index of the cars
+    - cumulative_waiting_time: array with the total waiting time of each intersection, in ticks
+    - n_stopped_cars: array with the number of cars that have stopped at each intersection
+    - queue_lenghts: array with the number of cars stopped in each direction of each intersection
+    - queues: list with the list of queue lengths of each intersection
+    """
+    def __init__(self, window, rngs:list, capacity:int = 1024):
+        super().__init__(window, capacity=capacity)
+        self.rngs = rngs
+        self.n_envs = len(rngs)
+
+        self.cumulative_waiting_time = np.zeros(self.n_envs, dtype=np.int64)
+        self.n_stopped_cars = np.zeros(self.n_envs, dtype=np.int64)
+        self.queue_lenghts = np.zeros(self.n_envs * len(DIRECTIONS), dtype=np.int64)
+        self.queues = [[] for _ in range(self.n_envs)]
+
+    def _fields(self) -> dict:
+        fields = super()._fields()
+        fields['env'] = (np.int32, ())
+        return fields
+
+    def add_car(self, direction:list = None) -> None:
+        """
+        Add one car to each intersection, drawing its attributes from the intersection's random generator.
+
+        Parameters:
+        - direction: list of directions that the cars can take
+        """
+        while self.n_cars + self.n_envs > len(self.x):
+            self._allocate(2 * len(self.x))
+
+        directions = direction if direction else DIRECTIONS
+        rows = slice(self.n_cars, self.n_cars + self.n_envs)
+        draws = [
+            (DIRECTIONS.index(rng.choice(directions)), rng.choice([False, True]), (rng.randint(1, 255), rng.randint(1, 255), rng.randint(1, 255)))
+            for rng in self.rngs
+        ]
+        car_direction = np.array([d for d, _, _ in draws], dtype=np.int8)
+        coordinates = np.array(self._spawn_coordinates, dtype=np.int32)[car_direction]
+
+        self.x[rows], self.y[rows] = coordinates[:, 0], coordinates[:, 1]
+        self.direction[rows] = car_direction
+        self.stopped[rows] = False
+        self.turn_right[rows] = [turn_right for _, turn_right, _ in draws]
+        self.waiting_time[rows] = 0
+        self.color[rows] = [color for _, _, color in draws]
+        self.env[rows] = np.arange(self.n_envs)
+        # Each intersection gets one car per spawn, so the spawn order is the same in all of them
+        self.id[rows] = self.n_spawned
+        self.n_spawned += 1
+        self.n_cars += self.n_envs
+
+    def get_cars(self, env:int) -> list:
+        """
+        Build the Car objects for the cars of one intersection.
+
+        Parameters:
+        - env: int representing the index of the intersection
+
+        Returns:
+        - list: list of Car objects, in spawn order
+        """
+        return [self._build_car(i) for i in np.flatnonzero(self.env[:self.n_cars] == env)]
+
+    def get_stats(self, env:int):
+        """
+        Get the per-direction aggregates of the cars of one intersection.
+
+        Parameters:
+        - env: int representing the index of the intersection
+
+        Returns:
+        - IntersectionStats of the cars of the intersection
+        """
+        return self._stats(self.env[:self.n_cars] == env)
+
+    def get_n_stopped_cars(self) -> np.ndarray:
+        return self.n_stopped_cars
+
+    def _green(self, stoplights:BatchedStoplights, vertical:np.ndarray) -> np.ndarray:
+        env = self.env[:self.n_cars]
+        return np.where(vertical, stoplights.color_NS[env] == GREEN, stoplights.color_EW[env] == GREEN)
+
+    def _lanes(self, direction:np.ndarray) -> np.ndarray:
+        return self.env[:self.n_cars] * len(DIRECTIONS) + direction
+
+    def _add_waiting(self, stopped:np.ndarray) -> None:
+        self.cumulative_waiting_time += np.bincount(self.env[:self.n_cars][stopped], minlength=self.n_envs)
+
+    def _add_stops(self, stop_now:np.ndarray) -> None:
+        self.n_stopped_cars += np.bincount(self.env[:self.n_cars][stop_now], minlength=self.n_envs)
+
+    def _update_queues(self, direction:np.ndarray, stop_now:np.ndarray, released:np.ndarray) -> None:
+        release_index, lengths = replay_queues(self._lanes(direction), stop_now, released, self.queue_lenghts)
+        for env, length in zip(self.env[release_index], lengths):
+            self.queues[env].append(int(length))
+
+class BatchedSimulation(Simulation):
+    """
+    Runs K independent replications of the simulation in lockstep, headless.
+
+    Every replication has its own stoplight, cars and random generator (seeded like Simulation.run,
+    so replication k gives the same results as a headless Simulation.run with seed seeds[k]).
+    Cars and stoplights of all the replications are advanced with one vectorized call per tick;
+    only the MDP decisions of the 'pi' and 'vi' modes are taken one replication at a time.
+
+    Attributes:
+    - seeds: list of int with the seed of each replication
+    """
+    def __init__(self, spawning_rules:list, seeds:list, car_spawn_rate:float = 1) -> None:
+        super().__init__(spawning_rules, car_spawn_rate=car_spawn_rate)
+        self.seeds = list(seeds)
+
+    def run(self, mode:str, save_stats:bool = False, output_dir:str = './data') -> dict:
+        """
+        Run all the replications.
+
+        Parameters:
+        - mode: str representing the mode of the simulation (pi, vi, ft)
+        - save_stats: bool representing if the stats of each replication should be saved
+        - output_dir: str representing the directory where the stats are saved
+
+        Returns:
+        - dict with, for each replication, the 'cumulative_waiting_times' (array of shape (K, seconds)),
+          the 'n_stopped_cars' (array of shape (K,)) and the 'queues' (list of K lists of queue lengths)
+        """
+        assert mode in ['pi', 'vi', 'ft'], "Mode must be either 'pi', 'vi or 'ft'"
+
+        rngs = [random.Random(seed) for seed in self.seeds]
+        self.window = HeadlessWindow(WINDOW_SIZE)
+        self.stoplights = BatchedStoplights(rngs)
+        self.car_manager = BatchedCarManager(self.window, rngs)
+
+        if mode == 'pi' or mode == 'vi':
+            mdps = [TrafficMDP(rng=rng) for rng in rngs]
+
+        cumulative_waiting_times = [np.zeros(len(rngs), dtype=np.int64)]
+        total_ticks = self.simulation_duration * FPS
+        spawn_ticks = max(1, round(self.car_spawn_frequency * FPS))
+
+        for tick in range(total_ticks):
+            self.stoplights.update_stoplights()
+
+            total_seconds = tick // FPS
+            new_second = tick > 0 and tick % FPS == 0
+            interval = self.current_interval(total_seconds)
+
+            # Add a car to every replication every car_spawn_frequency seconds
+            if tick > 0 and tick % spawn_ticks == 0:
+                self.add_cars_based_on_interval(interval)
+
+            match mode:
+                case 'pi' | 'vi':
+                    # Once per second, take a decision for the replications that have been green for 15 seconds
+                    if new_second:
+                        for env in np.flatnonzero(self.stoplights.time_green // FPS >= Stoplight.MIN_GREEN_DURATION):
+                            state = 'NS' if self.stoplights.color_NS[env] == GREEN else 'EW'
+                            cars = self.car_manager.get_stats(env)
+                            if mode == 'pi':
+                                mdps[env].policy_iteration(cars)
+                                action = mdps[env].get_action(state)
+                            else:
+                                action = mdps[env].value_iteration(cars, state)
+                            if action == 'change':
+                                self.stoplights.switch_yellow(np.arange(len(rngs)) == env)
+                case 'ft':
+                    self.stoplights.switch_yellow(self.stoplights.time_green // FPS >= Stoplight.FIXED_GREEN_DURATION)
+
+            self.car_manager.update_cars(self.stoplights)
+
+            # Sample the cumulative waiting times every second
+            if new_second:
+                cumulative_waiting_times.append(self.car_manager.cumulative_waiting_time // FPS)
+
+        self.cumulative_waiting_times = np.stack(cumulative_waiting_times, axis=1)
+        self.n_stopped_cars = self.car_manager.get_n_stopped_cars().copy()
+        self.queues = self.car_manager.queues
+
+        self.save_stats(mode, output_dir) if save_stats else None
+
+        return {
+            'cumulative_waiting_times': self.cumulative_waiting_times,
+            'n_stopped_cars': self.n_stopped_cars,
+            'queues': self.queues,
+        }
+
+    def save_stats(self, mode:str, output_dir:str = './data'):
+        """
+        Save the stats of each replication to disk, suffixed with the replication's seed.
+
+        Parameters:
+        - mode: str representing the mode of the simulation
+        - output_dir: str representing the directory where the stats are saved
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        for k, seed in enumerate(self.seeds):
+            self.to_disk(self.cumulative_waiting_times[k].tolist(), os.path.join(output_dir, f'cumulative_waiting_times_{mode}_{seed}.csv'))
+            self.to_disk(int(self.n_stopped_cars[k]), os.path.join(output_dir, f'stopped_cars_{mode}_{seed}.csv'))
+            self.to_disk(self.queues[k], os.path.join(output_dir, f'queue_lengths_{mode}_{seed}.csv'))
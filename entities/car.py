@@ -1,13 +1,50 @@
 import random
 import pygame
 from entities.car_actions import CarActions
+from entities.text_cache import get_text_cache
+
+class WindowGeometry:
+    """
+    Geometry of a window, shared by all the cars drawn on it (one instance per window size).
+
+    Attributes:
+    - width: int representing the width of the window
+    - height: int representing the height of the window
+    """
+    __slots__ = ('width', 'height')
+    _instances = {}
+
+    def __init__(self, width:int, height:int):
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def of(cls, window):
+        """
+        Get the shared geometry of a window.
+
+        Parameters:
+        - window: pygame window
+
+        Returns:
+        - WindowGeometry of the window size
+        """
+        size = (window.get_width(), window.get_height())
+        geometry = cls._instances.get(size)
+        if geometry is None:
+            geometry = cls._instances[size] = cls(*size)
+        return geometry
 
 class Car:
     """
     Implements the car object.
 
+    Cars are slotted: the window and its geometry are shared references, and a car can be reused for a new
+    spawn with reset (see CarPool).
+
     Attributes:
     - window: pygame window
+    - geometry: WindowGeometry of the window, shared by all the cars
     - window_width: int representing the width of the window
     - window_height: int representing the height of the window
     - direction: CarActions representing the direction the car is facing
@@ -17,6 +54,7 @@ class Car:
     - turn_right: bool representing if the car is turning right
     - waiting_time: int representing the time the car has been waiting
     - color: tuple representing the color of the car
+    - id: int representing the spawn order of the car, assigned by the car manager (None if not assigned)
 
     Constants:
     - SPEED: int representing the speed of the car
@@ -27,26 +65,47 @@ class Car:
     WIDTH = 20
     LENGTH = 40
 
-    def __init__(self, window, direction:list = None):
+    __slots__ = ('window', 'geometry', 'direction', 'x', 'y', 'isStopped', 'turn_right', 'waiting_time', 'color', 'id')
+
+    def __init__(self, window, direction:list = None, rng:random.Random = None):
         self.window = window
-        self.window_width = self.window.get_width()
-        self.window_height = self.window.get_height()
+        self.geometry = WindowGeometry.of(window)
+        self.reset(direction, rng)
+
+    def reset(self, direction:list = None, rng:random.Random = None) -> None:
+        """
+        Draw the random attributes of a new car and place it at its spawn point.
+
+        Parameters:
+        - direction: list of directions that the car can take (all the directions if None)
+        - rng: random number generator used to draw the attributes (the random module if None)
+        """
+        rng = rng if rng is not None else random
 
         if direction:
-            self.direction = random.choice(direction)
+            self.direction = rng.choice(direction)
         else:
-            self.direction = random.choice([CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT])
+            self.direction = rng.choice([CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT])
 
         self.x, self.y = self._set_veichle_coordinates(self.direction)
 
         self.isStopped = False
 
-        self.turn_right = random.choice([False, True])
+        self.turn_right = rng.choice([False, True])
 
         self.waiting_time = 0
         
-        self.color = (random.randint(1, 255), random.randint(1, 255), random.randint(1, 255))
+        self.color = (rng.randint(1, 255), rng.randint(1, 255), rng.randint(1, 255))
+
+        self.id = None
 
+    @property
+    def window_width(self) -> int:
+        return self.geometry.width
+
+    @property
+    def window_height(self) -> int:
+        return self.geometry.height
 
     def get_direction(self) -> CarActions:
         return self.direction
@@ -70,7 +129,8 @@ class Car:
         return self.isStopped
     
     def is_out_of_window(self) -> bool:
-        return self.x < 0 or self.x > self.window_width or self.y < 0 or self.y > self.window_height
+        geometry = self.geometry
+        return self.x < 0 or self.x > geometry.width or self.y < 0 or self.y > geometry.height
 
     def _set_veichle_coordinates(self, direction:CarActions) -> tuple:
         """
@@ -79,17 +139,62 @@ class Car:
         Parameters:
             direction (CarActions): The direction the vehicle is facing.
 
+        Returns:
+            tuple: The x and y coordinates of the vehicle.
+        """
+        return Car.spawn_coordinates(direction, self.geometry.width, self.geometry.height)
+
+    @staticmethod
+    def spawn_coordinates(direction:CarActions, window_width:int, window_height:int) -> tuple:
+        """
+        Get the coordinates where a vehicle facing the given direction enters the window.
+
+        Parameters:
+            direction (CarActions): The direction the vehicle is facing.
+            window_width (int): The width of the window.
+            window_height (int): The height of the window.
+
         Returns:
             tuple: The x and y coordinates of the vehicle.
         """
         if direction == CarActions.UP:
-            return self.window_width // 2 + 5, self.window_height
+            return window_width // 2 + 5, window_height
         elif direction == CarActions.DOWN:
-            return self.window_width // 2 - 20 - 4, 0
+            return window_width // 2 - 20 - 4, 0
         elif direction == CarActions.LEFT:
-            return self.window_width, self.window_height // 2 - 20 - 4
+            return window_width, window_height // 2 - 20 - 4
         elif direction == CarActions.RIGHT:
-            return 0, self.window_height // 2 + 5
+            return 0, window_height // 2 + 5
+
+    @classmethod
+    def from_state(cls, window, direction:CarActions, x:int, y:int, isStopped:bool, turn_right:bool, waiting_time:int, color:tuple, id:int = None):
+        """
+        Build a car from an existing state, without drawing any random attribute.
+
+        Parameters:
+            window: pygame window
+            direction (CarActions): The direction the vehicle is facing.
+            x (int), y (int): The coordinates of the vehicle.
+            isStopped (bool): If the vehicle is stopped.
+            turn_right (bool): If the vehicle is turning right.
+            waiting_time (int): The time the vehicle has been waiting, in ticks.
+            color (tuple): The color of the vehicle.
+            id (int): The spawn order of the vehicle.
+
+        Returns:
+            Car: The car with the given state.
+        """
+        car = cls.__new__(cls)
+        car.window = window
+        car.geometry = WindowGeometry.of(window)
+        car.direction = direction
+        car.x, car.y = x, y
+        car.isStopped = isStopped
+        car.turn_right = turn_right
+        car.waiting_time = waiting_time
+        car.color = color
+        car.id = id
+        return car
 
     def move(self):
         """
@@ -109,14 +214,18 @@ class Car:
         elif self.direction == CarActions.RIGHT:
             self.x += Car.SPEED
 
-    def draw(self):
+    def draw(self) -> pygame.Rect:
         """
         Draw the car on the window.
+
+        Returns:
+        - pygame.Rect: bounding rectangle of the area drawn (car, turn signal and waiting time)
         """
-        pygame.draw.rect(self.window, self.color, self._generate_car_rect())
+        rect = pygame.draw.rect(self.window, self.color, self._generate_car_rect())
 
-        self._draw_turn_signal()
-        self._draw_waiting_time()
+        turn_signal_rect = self._draw_turn_signal()
+        waiting_time_rect = self._draw_waiting_time()
+        return rect.unionall([turn_signal_rect, waiting_time_rect]) if turn_signal_rect else rect.union(waiting_time_rect)
 
     def _generate_car_rect(self):
         """
@@ -133,13 +242,17 @@ class Car:
     def _draw_turn_signal(self):
         """
         Draws the turn signal blinker of the car.
+
+        Returns:
+        - pygame.Rect: bounding rectangle of the blinker, or None if it is not drawn
         """
         TURN_SIGNAL_BLINK_INTERVAL = 1000
         TURN_SIGNAL_COLOR = (255, 85, 0)
 
         if self.turn_right and pygame.time.get_ticks() // TURN_SIGNAL_BLINK_INTERVAL % 2 == 0:
             points = self._calculate_turn_signal_points()
-            pygame.draw.polygon(self.window, TURN_SIGNAL_COLOR, points) 
+            return pygame.draw.polygon(self.window, TURN_SIGNAL_COLOR, points)
+        return None
 
     def _calculate_turn_signal_points(self):
         """
@@ -160,11 +273,12 @@ class Car:
     def _draw_waiting_time(self):
         """
         Draws the waiting time of the car, displayed in the top-left corner of the car.
+
+        Returns:
+        - pygame.Rect: bounding rectangle of the text
         """
-        font = pygame.font.Font(None, 20)   # font size for waiting time
-        text = font.render(str(self.get_waiting_time() // 30), True, (255, 255, 255))
-        text = pygame.transform.rotate(text, 90)
-        self.window.blit(text, (self.x + 5, self.y + 5))
+        text = get_text_cache().render(str(self.get_waiting_time() // 30), 20, (255, 255, 255), rotation=90)
+        return self.window.blit(text, (self.x + 5, self.y + 5))
 
     def can_move(self, other_cars: list) -> bool:
         """
@@ -193,26 +307,77 @@ class Car:
         Turn the car right if the turn_right attribute is True, otherwise move straight.
         """
         if self.turn_right:
-            if self.direction == CarActions.UP and self.y <= self.window_height // 2:
+            geometry = self.geometry
+            if self.direction == CarActions.UP and self.y <= geometry.height // 2:
                 self.direction = CarActions.RIGHT
                 self.x += Car.LENGTH // 2
-                self.y = self.window_height // 2 + 5
+                self.y = geometry.height // 2 + 5
                 self.turn_right = False
 
-            elif self.direction == CarActions.DOWN and self.y + Car.LENGTH >= self.window_height // 2:
+            elif self.direction == CarActions.DOWN and self.y + Car.LENGTH >= geometry.height // 2:
                 self.direction = CarActions.LEFT
                 self.x -= Car.LENGTH // 2
-                self.y = self.window_height // 2 - 20 - 4
+                self.y = geometry.height // 2 - 20 - 4
                 self.turn_right = False
 
-            elif self.direction == CarActions.LEFT and self.x <= self.window_width // 2:
+            elif self.direction == CarActions.LEFT and self.x <= geometry.width // 2:
                 self.direction = CarActions.UP
-                self.x = self.window_width // 2 + 5
+                self.x = geometry.width // 2 + 5
                 self.y -= Car.LENGTH // 2
                 self.turn_right = False
 
-            elif self.direction == CarActions.RIGHT and self.x + Car.LENGTH >= self.window_width // 2:
+            elif self.direction == CarActions.RIGHT and self.x + Car.LENGTH >= geometry.width // 2:
                 self.direction = CarActions.DOWN
-                self.x = self.window_width // 2 - 20 - 4
+                self.x = geometry.width // 2 - 20 - 4
                 self.y += Car.LENGTH // 2
-                self.turn_right = False
\ No newline at end of file
+                self.turn_right = False
+
+class CarPool:
+    """
+    Free list of the cars that left the window, reused for the next spawns instead of allocating new cars.
+
+    Attributes:
+    - max_size: int representing the maximum number of free cars kept (0 disables the pool)
+    - free: list of the free cars
+    - n_allocated: int representing the number of cars allocated by the pool
+    - n_reused: int representing the number of spawns that reused a free car
+    """
+    def __init__(self, max_size:int = 1024):
+        assert max_size >= 0, "Pool size must be greater than or equal to 0"
+        self.max_size = max_size
+        self.free = []
+        self.n_allocated = 0
+        self.n_reused = 0
+
+    def acquire(self, window, direction:list = None, rng:random.Random = None) -> Car:
+        """
+        Get a new car, reusing a free car if there is one.
+
+        The random attributes are drawn in the same order as for a new Car, so a seeded run gives the same cars.
+
+        Parameters:
+        - window: pygame window
+        - direction: list of directions that the car can take
+        - rng: random number generator used to draw the attributes (the random module if None)
+
+        Returns:
+        - Car at its spawn point
+        """
+        if not self.free:
+            self.n_allocated += 1
+            return Car(window, direction, rng)
+
+        car = self.free.pop()
+        if car.window is not window:
+            car.window = window
+            car.geometry = WindowGeometry.of(window)
+        car.reset(direction, rng)
+        self.n_reused += 1
+        return car
+
+    def release(self, car:Car) -> None:
+        """
+        Give back a car that is no longer used (the caller must not keep references to it).
+        """
+        if len(self.free) < self.max_size:
+            self.free.append(car)
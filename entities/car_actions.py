@@ -11,3 +11,7 @@ class CarActions(Enum):
     LEFT = "left"
     RIGHT = "right"
 
+
+    # The members are singletons compared by identity: hash them by identity too, in C, instead of Enum's
+    # Python-level hash of the name (the directions key the lanes and the statistics, hashed many times per tick)
+    __hash__ = object.__hash__
@@ -1,7 +1,8 @@
-from entities.car import Car
+from entities.car import Car, CarPool
 from entities.stoplight import Stoplight
 from entities.car_actions import CarActions
 from entities.colors import TrafficLightColor
+from entities.intersection_stats import IntersectionStats, is_incoming
 
 class CarManager:
     """
@@ -9,16 +10,27 @@ class CarManager:
 
     Attributes:
     - window: pygame window
-    - cars: list of Car objects
+    - cars: list of Car objects, in spawn order
+    - lanes: dict with the cars travelling in each direction, in the order they entered the lane
+    - stopped: dict with the stopped cars of each direction, keyed by their coordinate along the lane
+    - stats: IntersectionStats with the per-direction aggregates of the cars, updated on every state transition
     - cumulative_waiting_time: int representing the total waiting time of all cars that have stopped at the intersection
     - n_stopped_cars: int representing the number of cars that have stopped at the intersection
     - queue_lenghts: dict with the number of cars stopped in each direction
     - queues: list of the queue lengths for each direction
+    - n_spawned: int representing the number of cars added so far (the id of the next car)
+    - pool: CarPool reusing the cars that left the window for the next spawns
+    - rng: random number generator used to draw the attributes of the new cars (the random module if None)
+    - changed: dict with the cars whose state changed by more than a straight move or a tick of waiting (spawned,
+      stopped, released, turned or exited) since it was last cleared, in the order they changed (None until track_changes)
     """
-    def __init__(self, window):
+    def __init__(self, window, pool:CarPool = None, rng = None):
             self.window = window
 
             self.cars = []
+            self.lanes = {direction: {} for direction in CarActions}
+            self.stopped = {direction: {} for direction in CarActions}
+            self.stats = IntersectionStats()
             
             self.cumulative_waiting_time = 0
             self.n_stopped_cars = 0
@@ -31,20 +43,65 @@ class CarManager:
 
             self.queues = []
 
-    def add_car(self, direction:list = None) -> None:
+            self.n_spawned = 0
+            self.pool = pool if pool is not None else CarPool()
+            self.rng = rng
+            self.changed = None
+
+    def add_car(self, direction:list = None, turn_right:bool = None) -> None:
         """
         Add a car to the simulation.
 
         Parameters:
         - direction: list of directions that the car can take
+        - turn_right: bool representing if the car turns right (drawn at random if None)
         """
-        self.cars.append(
-            Car(self.window, direction=direction) if direction else Car(self.window)
-        )
+        car = self.pool.acquire(self.window, direction, self.rng)
+        if turn_right is not None:
+            car.turn_right = turn_right
+        car.id = self.n_spawned
+        self.n_spawned += 1
+        self._insert(car)
+
+    def receive_car(self, car:Car) -> None:
+        """
+        Add a car that comes from another intersection, keeping its state and id.
+
+        Parameters:
+        - car: moving Car object, already placed in the window of this car manager
+        """
+        self._insert(car)
+
+    def track_changes(self) -> dict:
+        """
+        Start keeping the cars whose state changed by more than a straight move or a tick of waiting.
+
+        Returns:
+        - dict with the cars that changed, to be cleared by the caller once it has read them
+        """
+        if self.changed is None:
+            self.changed = {}
+        return self.changed
+
+    def _insert(self, car:Car) -> None:
+        self.cars.append(car)
+        if self.changed is not None:
+            self.changed[car] = None
+        self.lanes[car.get_direction()][car] = None
+        self.stats.n_incoming[car.get_direction()] += self._is_incoming(car)
 
     def get_cars(self) -> list:
         return self.cars
 
+    def get_stats(self) -> IntersectionStats:
+        """
+        Get the per-direction aggregates of the cars (kept up to date, so this takes constant time).
+
+        Returns:
+        - IntersectionStats of the cars in the window
+        """
+        return self.stats
+
     def get_n_stopped_cars(self) -> int:
         return self.n_stopped_cars
 
@@ -58,7 +115,33 @@ class CarManager:
         Returns:
         - list: list of Car objects that are stopped and are in the specified directions
         """
-        return [car for car in self.cars if car.direction in directions and car.is_stopped()]
+        return [car for direction in directions for cars in self.stopped[direction].values() for car in cars]
+
+    def get_max_waiting_time(self, directions:list) -> int:
+        """
+        Get the waiting time of the longest waiting stopped car in the specified directions.
+
+        The longest waiting time is kept up to date by the stats, so this does not look at the cars.
+
+        Parameters:
+        - directions: list of directions to filter the cars
+
+        Returns:
+        - int: waiting time in ticks (0 if no car is stopped)
+        """
+        return self.stats.max_waiting_time(directions)
+
+    def get_lane(self, direction:CarActions) -> list:
+        """
+        Get the cars travelling in the specified direction.
+
+        Parameters:
+        - direction: direction of the lane
+
+        Returns:
+        - list: list of Car objects in the lane, in the order they entered it
+        """
+        return list(self.lanes[direction])
 
     def update_cars(self, stoplight:Stoplight) -> None:
         """
@@ -67,9 +150,13 @@ class CarManager:
         Parameters:
         - stoplight: Stoplight object
         """
+        self.stats.tick()
         for car in self.cars:
             self.update_car(car, stoplight) 
 
+        # Drop the cars that left the window in a single pass
+        if len(self.cars) != sum(len(lane) for lane in self.lanes.values()):
+            self.cars = [car for car in self.cars if car in self.lanes[car.get_direction()]]
 
     def update_car(self, car, stoplight:Stoplight) -> None:
         """
@@ -79,11 +166,15 @@ class CarManager:
         - car: Car object
         - stoplight: Stoplight object
         """
+        direction_before = car.get_direction()
+        incoming_before = not car.is_stopped() and self._is_incoming(car)
+
         # Check if the car is stopped
         if car.is_stopped():
             # Increase the waiting time of the car
             car.increase_waiting_time()
             self.cumulative_waiting_time += 1
+            self.stats.add_waiting_tick(car)
 
             car_direction = car.get_direction()
 
@@ -92,6 +183,7 @@ class CarManager:
                 (car_direction in [CarActions.LEFT, CarActions.RIGHT] and stoplight.color_EW == TrafficLightColor.GREEN.value)):
                 
                 car.set_stopped(False)
+                self._remove_stopped(car)
                 
                 if self.queue_lenghts[car.get_direction()] != 0:
                     self.queues.append(self.queue_lenghts[car.get_direction()])
@@ -100,20 +192,104 @@ class CarManager:
                 car.move()
 
         # Check if the car is at the intersection and should stop or if the car cannot move
-        elif (self.is_at_intersection(car) and self.should_stop(car, stoplight)) or not car.can_move(self.cars):
+        elif (self.is_at_intersection(car) and self.should_stop(car, stoplight)) or self.is_blocked(car):
             car.set_stopped(True)
+            self._add_stopped(car)
             # Increase the counters for the stopped cars and the queue lengths
             self.n_stopped_cars += 1
             self.queue_lenghts[car.get_direction()] += 1
 
         # Move the car
         else:
+            car_direction = car.get_direction()
             car.turn_or_straight()
+
+            # Move the car to the lane it turned into
+            if car.get_direction() != car_direction:
+                del self.lanes[car_direction][car]
+                self.lanes[car.get_direction()][car] = None
+                if self.changed is not None:
+                    self.changed[car] = None
+
             car.move()
 
-        # Remove the car if it is out of the window
+        # Remove the car from its lane if it is out of the window (the cars list is compacted by update_cars)
         if car.is_out_of_window():
-            self.cars.remove(car)
+            del self.lanes[car.get_direction()][car]
+            self._on_exit(car)
+            if self.changed is not None:
+                self.changed[car] = None
+            incoming_after = False
+        else:
+            incoming_after = not car.is_stopped() and self._is_incoming(car)
+
+        # Update the incoming cars if the car stopped, was released, turned or crossed the middle of the intersection
+        if incoming_before != incoming_after or direction_before != car.get_direction():
+            self.stats.n_incoming[direction_before] -= incoming_before
+            self.stats.n_incoming[car.get_direction()] += incoming_after
+
+    def _on_exit(self, car:Car) -> None:
+        """
+        Handle a car that has just left the window.
+        """
+        # Not reused before the next spawn, after the compaction
+        self.pool.release(car)
+
+    def is_blocked(self, car:Car) -> bool:
+        """
+        Check if the car is right behind a stopped car of its lane.
+
+        This is the same rule as Car.can_move, but it only looks up the three positions
+        where a blocking car can be, instead of scanning all the cars.
+
+        Parameters:
+        - car: Car object
+
+        Returns:
+        - boolean: True if the car cannot move, False otherwise
+        """
+        stopped = self.stopped[car.get_direction()]
+        if not stopped:
+            return False
+
+        position = self._lane_position(car)
+        ahead = -1 if car.get_direction() in [CarActions.UP, CarActions.LEFT] else 1
+
+        return any(position + ahead * gap in stopped for gap in range(Car.LENGTH + 4, Car.LENGTH + 7))
+
+    def _lane_position(self, car:Car) -> int:
+        """
+        Get the coordinate of the car along its lane.
+        """
+        return car.y if car.get_direction() in [CarActions.UP, CarActions.DOWN] else car.x
+
+    def _add_stopped(self, car:Car) -> None:
+        """
+        Index a car that has just stopped by its position in the lane.
+        """
+        self.stopped[car.get_direction()].setdefault(self._lane_position(car), []).append(car)
+        self.stats.add_stopped(car)
+        if self.changed is not None:
+            self.changed[car] = None
+
+    def _remove_stopped(self, car:Car) -> None:
+        """
+        Remove a car that is moving again from the index of the stopped cars.
+        """
+        stopped = self.stopped[car.get_direction()]
+        position = self._lane_position(car)
+        stopped[position].remove(car)
+        if not stopped[position]:
+            del stopped[position]
+        self.stats.remove_stopped(car)
+        if self.changed is not None:
+            self.changed[car] = None
+
+    def _is_incoming(self, car:Car) -> bool:
+        """
+        Check if the car has not reached the middle of the intersection yet.
+        """
+        return is_incoming(car, self.window.get_width() // 2, self.window.get_height() // 2)
 
 
     def should_stop(self, car:Car, stoplight:Stoplight) -> bool:
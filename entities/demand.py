@@ -0,0 +1,270 @@
+import csv
+import math
+import itertools
+import numpy as np
+from entities.car import Car
+from entities.car_actions import CarActions
+from entities.intersection_stats import TICKS_PER_SECOND
+
+# Approaches are stored as indices into this list
+DIRECTIONS = [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT]
+
+# Directions of the cars spawned in each interval of the spawning rules
+INTERVAL_DIRECTIONS = {
+    'up_down': [CarActions.UP, CarActions.DOWN],
+    'left_right': [CarActions.LEFT, CarActions.RIGHT],
+    'all_directions': [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT],
+}
+
+# Minimum number of ticks between two arrivals of the same approach, so that a car never spawns on top of the previous one
+MIN_HEADWAY = -(-(Car.LENGTH + 6) // Car.SPEED)
+
+class Demand:
+    """
+    Arrival schedule of a run: the tick, the approach and the turn intent of every car, generated before the
+    cars are needed as arrays sorted by tick.
+
+    The schedule is a sequence of chunks covering consecutive spans of time. A chunk is only generated when the
+    simulation reaches it, so multi-hour demand profiles are never held in memory at once. Popping the arrivals
+    of a tick takes constant time, and no arrival is ever dropped: all the arrivals up to the tick are popped.
+
+    The arrivals are drawn from a NumPy generator of their own, so the schedule does not depend on the
+    random draws of the simulation. The generator is seeded again by restart, which Simulation.run calls at the
+    start of every run, so the same Demand gives the same arrivals to every run it is passed to.
+
+    Attributes:
+    - make_chunks: function returning an iterator of the chunks, each a tuple of arrays (ticks, approach indices, turn intents) sorted by tick
+    - chunks: iterator of the chunks of the current pass over the schedule
+    - ticks: list of the ticks of the arrivals of the current chunk
+    - directions: list of the approach indices of the arrivals of the current chunk (see DIRECTIONS)
+    - turn_right: list of the turn intents of the arrivals of the current chunk
+    - position: int representing the index of the next arrival in the current chunk
+    - next_tick: tick of the next arrival (math.inf when the schedule is over)
+    - n_arrivals: int representing the number of arrivals popped so far
+    """
+    def __init__(self, make_chunks):
+        self.make_chunks = make_chunks
+        self.restart()
+
+    def restart(self) -> None:
+        """
+        Go back to the start of the schedule, generating the same arrivals again.
+        """
+        self.chunks = iter(self.make_chunks())
+        self.n_arrivals = 0
+        self._next_chunk()
+
+    def _next_chunk(self) -> None:
+        """
+        Load the next non-empty chunk of the schedule.
+        """
+        for ticks, directions, turn_right in self.chunks:
+            if len(ticks):
+                self.ticks, self.directions, self.turn_right = ticks.tolist(), directions.tolist(), turn_right.tolist()
+                self.position = 0
+                self.next_tick = self.ticks[0]
+                return
+        self.ticks, self.directions, self.turn_right = [], [], []
+        self.position = 0
+        self.next_tick = math.inf
+
+    def pop_due(self, tick:int) -> list:
+        """
+        Pop the arrivals scheduled up to the given tick (included).
+
+        Parameters:
+        - tick: int representing the current tick
+
+        Returns:
+        - list of (CarActions, bool) with the approach and the turn intent of each arrival
+        """
+        arrivals = []
+        while tick >= self.next_tick:
+            i = self.position
+            arrivals.append((DIRECTIONS[self.directions[i]], self.turn_right[i]))
+            self.position += 1
+            if self.position == len(self.ticks):
+                self._next_chunk()
+            else:
+                self.next_tick = self.ticks[self.position]
+        self.n_arrivals += len(arrivals)
+        return arrivals
+
+    @classmethod
+    def from_spawning_rules(cls, spawning_rules:list, car_spawn_rate:float = 1, seed:int = None, turn_probability:float = 0.5, chunk_seconds:int = 600):
+        """
+        Deterministic arrivals: one car every car_spawn_rate seconds, at the same ticks as Simulation.run, with its
+        approach drawn among the directions of the interval (no car in the other intervals). With a spawn rate
+        below MIN_HEADWAY ticks, the cars of an approach are delayed to keep them apart.
+
+        Parameters:
+        - spawning_rules: list of tuples with the name and the duration of each interval, in seconds
+        - car_spawn_rate: float representing the time between two cars, in seconds
+        - seed: int used to seed the generator of the arrivals
+        - turn_probability: float representing the probability that a car turns right
+        - chunk_seconds: int representing the length of the chunks of the schedule, in seconds
+
+        Returns:
+        - Demand with the arrivals of the spawning rules
+        """
+        spawn_ticks = max(1, round(car_spawn_rate * TICKS_PER_SECOND))
+
+        seed = _fixed_seed(seed)
+
+        def pieces():
+            rng = np.random.default_rng(seed)
+            start = 0
+            for name, duration in spawning_rules:
+                allowed = np.array([DIRECTIONS.index(direction) for direction in INTERVAL_DIRECTIONS.get(name, [])], dtype=np.int8)
+                if not len(allowed):
+                    start += duration
+                    continue
+                for first, last in _windows(start, start + duration, chunk_seconds):
+                    ticks = np.arange(-(-max(1, first * TICKS_PER_SECOND) // spawn_ticks) * spawn_ticks, last * TICKS_PER_SECOND, spawn_ticks)
+                    directions = allowed[rng.integers(0, len(allowed), len(ticks))]
+                    yield first * TICKS_PER_SECOND, ticks, directions, rng.random(len(ticks)) < turn_probability
+                start += duration
+
+        return cls(lambda: _schedule(pieces()))
+
+    @classmethod
+    def poisson(cls, rates, duration:float, seed:int = None, turn_probability:float = 0.5, chunk_seconds:int = 600):
+        """
+        Poisson arrivals with a constant rate on each approach.
+
+        Parameters:
+        - rates: dict with the rate of each approach (CarActions or its value), in cars per second,
+                 or float with the total rate, split evenly between the four approaches
+        - duration: float representing the duration of the schedule, in seconds
+        - seed: int used to seed the generator of the arrivals
+        - turn_probability: float representing the probability that a car turns right
+        - chunk_seconds: int representing the length of the chunks of the schedule, in seconds
+
+        Returns:
+        - Demand with the Poisson arrivals
+        """
+        return cls.time_varying([(duration, rates)], seed, turn_probability, chunk_seconds)
+
+    @classmethod
+    def time_varying(cls, profile:list, seed:int = None, turn_probability:float = 0.5, chunk_seconds:int = 600):
+        """
+        Poisson arrivals with a rate that changes over time, constant within each period of the profile.
+
+        Parameters:
+        - profile: list of tuples with the duration of each period, in seconds, and its rates (see poisson)
+        - seed: int used to seed the generator of the arrivals
+        - turn_probability: float representing the probability that a car turns right
+        - chunk_seconds: int representing the length of the chunks of the schedule, in seconds
+
+        Returns:
+        - Demand with the arrivals of the profile
+        """
+        seed = _fixed_seed(seed)
+
+        def pieces():
+            rng = np.random.default_rng(seed)
+            start = 0
+            for duration, rates in profile:
+                rates = _approach_rates(rates)
+                for first, last in _windows(start, start + duration, chunk_seconds):
+                    counts = rng.poisson(rates * (last - first))
+                    times = rng.uniform(first, last, counts.sum())
+                    directions = np.repeat(np.arange(len(DIRECTIONS), dtype=np.int8), counts)
+                    yield math.floor(first * TICKS_PER_SECOND), np.floor(times * TICKS_PER_SECOND).astype(np.int64), directions, rng.random(len(times)) < turn_probability
+                start += duration
+
+        return cls(lambda: _schedule(pieces()))
+
+    @classmethod
+    def from_counts(cls, path:str, seed:int = None, turn_probability:float = 0.5):
+        """
+        Arrivals of a traffic counts CSV file, read row by row as the simulation goes.
+
+        The file has the columns start, end (in seconds), direction (up, down, left or right) and count, with the
+        rows sorted by start. The cars of a row arrive at uniformly random times between its start and its end.
+
+        Parameters:
+        - path: str representing the path of the CSV file
+        - seed: int used to seed the generator of the arrivals
+        - turn_probability: float representing the probability that a car turns right
+
+        Returns:
+        - Demand with the arrivals of the counts
+        """
+        seed = _fixed_seed(seed)
+
+        def pieces():
+            rng = np.random.default_rng(seed)
+            with open(path, newline='') as f:
+                rows = ((float(row['start']), float(row['end']), DIRECTIONS.index(CarActions(row['direction'].strip().lower())), int(row['count'])) for row in csv.DictReader(f))
+                previous = -math.inf
+                for start, group in itertools.groupby(rows, key=lambda row: row[0]):
+                    assert start >= previous, "The rows of the counts must be sorted by start"
+                    previous = start
+                    group = list(group)
+                    times = np.concatenate([rng.uniform(first, last, count) for first, last, _, count in group])
+                    directions = np.repeat(np.array([direction for _, _, direction, _ in group], dtype=np.int8), [count for _, _, _, count in group])
+                    yield math.floor(start * TICKS_PER_SECOND), np.floor(times * TICKS_PER_SECOND).astype(np.int64), directions, rng.random(len(times)) < turn_probability
+
+        return cls(lambda: _schedule(pieces()))
+
+def _fixed_seed(seed:int = None) -> int:
+    """
+    Draw a seed once if none is given, so that restarting the schedule gives the same arrivals.
+    """
+    return seed if seed is not None else np.random.SeedSequence().entropy
+
+def _windows(start:float, end:float, chunk_seconds:int):
+    """
+    Split a span of time into windows of at most chunk_seconds seconds.
+    """
+    while start < end:
+        yield start, min(start + chunk_seconds, end)
+        start += chunk_seconds
+
+def _approach_rates(rates) -> np.ndarray:
+    """
+    Get the rate of each approach, in the order of DIRECTIONS.
+    """
+    if isinstance(rates, dict):
+        rates = {CarActions(direction): rate for direction, rate in rates.items()}
+        return np.array([rates.get(direction, 0) for direction in DIRECTIONS], dtype=float)
+    return np.full(len(DIRECTIONS), rates / len(DIRECTIONS))
+
+def _schedule(pieces, headway:int = MIN_HEADWAY):
+    """
+    Turn pieces of arrivals into the chunks of a schedule, sorted by tick, with at least headway ticks
+    between two arrivals of the same approach.
+
+    Parameters:
+    - pieces: iterator of (start tick, ticks, approach indices, turn intents), with non-decreasing start ticks
+              and no arrival of a piece before its start tick
+    - headway: int representing the minimum number of ticks between two arrivals of the same approach
+
+    Returns:
+    - iterator of the chunks (ticks, approach indices, turn intents)
+    """
+    ticks, directions, turn_right = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), np.empty(0, dtype=bool)
+    last = np.full(len(DIRECTIONS), -headway, dtype=np.int64)
+    end = (math.inf, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), np.empty(0, dtype=bool))
+
+    for start, *arrays in itertools.chain(pieces, [end]):
+        # The arrivals before the start of this piece can no longer be moved by a new arrival
+        order = np.lexsort((directions, ticks))
+        ticks, directions, turn_right = ticks[order], directions[order], turn_right[order]
+        for d in range(len(DIRECTIONS)):
+            same = np.flatnonzero(directions == d)
+            # Each arrival is at least headway ticks after the previous one: s_i = max(t_i, s_(i-1) + headway)
+            steps = np.arange(len(same)) * headway
+            ticks[same] = steps + np.maximum.accumulate(np.maximum(ticks[same] - steps, last[d] + headway))
+        order = np.lexsort((directions, ticks))
+        ticks, directions, turn_right = ticks[order], directions[order], turn_right[order]
+
+        done = ticks < start
+        if done.any():
+            for d in range(len(DIRECTIONS)):
+                same = done & (directions == d)
+                last[d] = ticks[same].max() if same.any() else last[d]
+            yield ticks[done], directions[done], turn_right[done]
+
+        ticks, directions, turn_right = [np.concatenate((kept[~done], new)) for kept, new in zip((ticks, directions, turn_right), arrays)]
@@ -1,5 +1,6 @@
 import pygame
 import os
+from entities.text_cache import get_text_cache
 
 # Colors
 WHITE = (255, 255, 255)
@@ -8,6 +9,32 @@ GRAY = (128, 128, 128)
 AMBIENT_IMAGES_PATH = './assets/img/'
 AUDIO_PATH = './assets/audio/street_sound_effect.mp3'
 
+MODE_NAMES = {'ft': 'fixed time', 'pi': 'policy iteration', 'vi': 'value iteration', 'lt': 'lookup table'}
+
+class HeadlessWindow:
+    """
+    Stands in for the pygame window when the simulation runs without a display.
+
+    Only the size of the window is needed by the simulation logic (spawn coordinates, intersection
+    and exit checks), so no surface is allocated and nothing can be drawn on it.
+
+    Attributes:
+    - width: int representing the width of the window
+    - height: int representing the height of the window
+    """
+    def __init__(self, window_size:tuple):
+        assert window_size[0] > 0 and window_size[1] > 0, "Window size must be greater than 0"
+        self.width, self.height = window_size
+
+    def get_width(self) -> int:
+        return self.width
+
+    def get_height(self) -> int:
+        return self.height
+
+    def get_size(self) -> tuple:
+        return self.width, self.height
+
 class Environment:
     """
     Defines the environment of the simulation, which includes the images and the drawing of the environment.
@@ -17,6 +44,9 @@ class Environment:
     - window_width: int representing the width of the window
     - window_height: int representing the height of the window
     - ambient_images: list of pygame images representing the images of the environment
+    - background: pygame surface with the static scene (images, roads, lanes and crosswalks), rendered once per window size
+    - info_panel: pygame surface with the information panel, rendered again only when its text changes
+    - dirty_rects: bool representing if only the areas drawn in the last two frames are pushed to the display
     - audio: bool representing if the audio is enabled
     
     Constants:
@@ -27,7 +57,7 @@ class Environment:
     - AssertionError: If the window size is not greater than 0
     - AssertionError: If the name is not a valid string
     """
-    def __init__(self, window_size:int, name:str, audio:bool = False):
+    def __init__(self, window_size:int, name:str, audio:bool = False, dirty_rects:bool = False):
         
         assert window_size[0] > 0 and window_size[1] > 0, "Window size must be greater than 0"
         assert name, "Name for the simulation must be a valid string"
@@ -35,20 +65,52 @@ class Environment:
         self.window = None
         self._pygame_init(window_size, name, audio=audio)
 
-        self.ambient_images = self._resize_images(
-            self._load_pygame_images(
-                [os.path.join(AMBIENT_IMAGES_PATH, image) for image in os.listdir(AMBIENT_IMAGES_PATH)]
-            )
+        self._loaded_images = self._load_pygame_images(
+            [os.path.join(AMBIENT_IMAGES_PATH, image) for image in os.listdir(AMBIENT_IMAGES_PATH)]
         )
+        self.ambient_images = self._resize_images(self._loaded_images)
 
         self.window_width = self.window.get_width()
         self.window_height = self.window.get_height()
 
+        self.background = None
+        self.info_panel = None
+        self._info_panel_lines = None
+
+        # Areas drawn over the background in the previous and in the current frame
+        self.dirty_rects = dirty_rects
+        self._previous_rects = []
+        self._current_rects = []
+        self._full_update = True
+
     def close(self):
+        get_text_cache().clear()
         pygame.quit()
     
     def update(self):
-        pygame.display.update()
+        """
+        Push the frame to the display.
+
+        In dirty rectangles mode, only the areas drawn in the previous frame (now showing the background again)
+        and in the current frame are updated, except for the first frame after the background was rendered.
+        """
+        if self.dirty_rects and not self._full_update:
+            # The static elements (stoplight, info panel) are drawn at the same place in both frames
+            pygame.display.update([pygame.Rect(rect) for rect in {tuple(rect) for rect in self._previous_rects + self._current_rects}])
+        else:
+            pygame.display.update()
+            self._full_update = False
+
+        self._previous_rects, self._current_rects = self._current_rects, []
+
+    def add_dirty_rects(self, rects:list):
+        """
+        Register areas drawn over the background in the current frame.
+
+        Parameters:
+        - rects: list of pygame.Rect
+        """
+        self._current_rects.extend(rects)
 
     def get_window(self):
         return self.window
@@ -98,56 +160,87 @@ class Environment:
     def draw(self):
         """
         Draw the environment.
+
+        The static scene is rendered once into the background surface, which is blitted in a single call
+        and rebuilt only when the size of the window changes. In dirty rectangles mode, the background is
+        only restored under the areas drawn in the previous frame.
         """
-        self._blit_images()
-        self._draw_lines()
+        if self.background is None or self.background.get_size() != self.window.get_size():
+            self._render_background()
+            self._full_update = True
+
+        if self.dirty_rects and not self._full_update:
+            for rect in self._previous_rects:
+                self.window.blit(self.background, rect, rect)
+        else:
+            self.window.blit(self.background, (0, 0))
 
-    def _blit_images(self):
+    def _render_background(self):
+        """
+        Render the static scene into an off-screen surface, in the pixel format of the window.
+        """
+        self.window_width = self.window.get_width()
+        self.window_height = self.window.get_height()
+        self.ambient_images = self._resize_images(self._loaded_images)
+
+        self.background = pygame.Surface(self.window.get_size()).convert(self.window)
+        self._blit_images(self.background)
+        self._draw_lines(self.background)
+
+    def _blit_images(self, surface:pygame.Surface):
         """
         Blit the images of the environment.
+
+        Parameters:
+        - surface: pygame surface to draw on
         """
-        self.window.blit(self.ambient_images[0], (0, 0))
-        self.window.blit(self.ambient_images[1], (self.window_width // 2 + 30, 0))
-        self.window.blit(self.ambient_images[2], (self.window_width // 2 + 30, self.window_height // 2 + 30))
-        self.window.blit(self.ambient_images[3], (0, self.window_height // 2 + 30))
+        surface.blit(self.ambient_images[0], (0, 0))
+        surface.blit(self.ambient_images[1], (self.window_width // 2 + 30, 0))
+        surface.blit(self.ambient_images[2], (self.window_width // 2 + 30, self.window_height // 2 + 30))
+        surface.blit(self.ambient_images[3], (0, self.window_height // 2 + 30))
 
-    def _draw_lines(self):
+    def _draw_lines(self, surface:pygame.Surface):
         """
         Draw the lines of the environment.
+
+        Parameters:
+        - surface: pygame surface to draw on
         """
         # Draw intersection
-        pygame.draw.line(self.window, GRAY, (0, self.window_height // 2), (self.window_width, self.window_height // 2), 60)
-        pygame.draw.line(self.window, GRAY, (self.window_width // 2, 0), (self.window_width // 2, self.window_height), 60)
+        pygame.draw.line(surface, GRAY, (0, self.window_height // 2), (self.window_width, self.window_height // 2), 60)
+        pygame.draw.line(surface, GRAY, (self.window_width // 2, 0), (self.window_width // 2, self.window_height), 60)
         # Draw lanes
         for offset in [-28, 28]:
-            pygame.draw.line(self.window, WHITE, (0, self.window_height // 2 + offset), (self.window_width, self.window_height // 2 + offset), 1)
-            pygame.draw.line(self.window, WHITE, (self.window_width // 2 + offset, 0), (self.window_width // 2 + offset, self.window_height), 1)
-        pygame.draw.line(self.window, WHITE, (0, self.window_height // 2), (self.window_width, self.window_height // 2), 4)
-        pygame.draw.line(self.window, WHITE, (self.window_width // 2, 0), (self.window_width // 2, self.window_height), 4)
+            pygame.draw.line(surface, WHITE, (0, self.window_height // 2 + offset), (self.window_width, self.window_height // 2 + offset), 1)
+            pygame.draw.line(surface, WHITE, (self.window_width // 2 + offset, 0), (self.window_width // 2 + offset, self.window_height), 1)
+        pygame.draw.line(surface, WHITE, (0, self.window_height // 2), (self.window_width, self.window_height // 2), 4)
+        pygame.draw.line(surface, WHITE, (self.window_width // 2, 0), (self.window_width // 2, self.window_height), 4)
         # Draw crosswalks
         crosswalk_offsets = [-23, -17, -12, -6, 6, 12, 17, 23]
         for offset in crosswalk_offsets:
-            pygame.draw.line(self.window, WHITE, (self.window_width // 2 + offset, self.window_height // 2 - 200), (self.window_width // 2 + offset, self.window_height // 2 - 180), 2)
-            pygame.draw.line(self.window, WHITE, (self.window_width // 2 + offset, self.window_height // 2 + 200), (self.window_width // 2 + offset, self.window_height // 2 + 220), 2)
-            pygame.draw.line(self.window, WHITE, (self.window_width // 2 - 200, self.window_height // 2 + offset), (self.window_width // 2 - 180, self.window_height // 2 + offset), 2)
-            pygame.draw.line(self.window, WHITE, (self.window_width // 2 + 180, self.window_height // 2 + offset), (self.window_width // 2 + 200, self.window_height // 2 + offset), 2)
+            pygame.draw.line(surface, WHITE, (self.window_width // 2 + offset, self.window_height // 2 - 200), (self.window_width // 2 + offset, self.window_height // 2 - 180), 2)
+            pygame.draw.line(surface, WHITE, (self.window_width // 2 + offset, self.window_height // 2 + 200), (self.window_width // 2 + offset, self.window_height // 2 + 220), 2)
+            pygame.draw.line(surface, WHITE, (self.window_width // 2 - 200, self.window_height // 2 + offset), (self.window_width // 2 - 180, self.window_height // 2 + offset), 2)
+            pygame.draw.line(surface, WHITE, (self.window_width // 2 + 180, self.window_height // 2 + offset), (self.window_width // 2 + 200, self.window_height // 2 + offset), 2)
         # Cover intersection
-        pygame.draw.rect(self.window, GRAY, (self.window_width // 2 - 29, self.window_height // 2 - 29, 60, 60))
+        pygame.draw.rect(surface, GRAY, (self.window_width // 2 - 29, self.window_height // 2 - 29, 60, 60))
 
     def draw_cars(self, car_manager):
         """
         Draw the cars on the window.
 
         Parameters:
-        - car_manager: car_manager object
+        - car_manager: car_manager object, or list of Car objects
         """
-        [car.draw() for car in car_manager.get_cars()]
+        cars = car_manager if isinstance(car_manager, list) else car_manager.get_cars()
+        self.add_dirty_rects([car.draw() for car in cars])
 
     def draw_info_panel(self,
             total_seconds:int, 
             interval:str, 
             cumulative_waiting_time:int, 
-            mode:str):
+            mode:str,
+            playback:str = None):
         """
         Draw the information panel on the window.
 
@@ -156,27 +249,45 @@ class Environment:
         - interval: str representing the interval of the simulation.
         - cumulative_waiting_time: int representing the cumulative waiting time of the cars.
         - mode: str representing the mode of the simulation
+        - playback: str representing the state of the replay (None when the simulation is running)
         """ 
-        font = pygame.font.SysFont(None, 24)
+        lines = [
+            f"Elapsed Time: {total_seconds} sec",
+            f"Spawning rule: {interval}",
+            f"Running mode: {MODE_NAMES.get(mode, mode)}",
+            f"Cumulative Waitings: {cumulative_waiting_time} sec",
+        ]
+        if playback:
+            lines.append(f"Replay: {playback}")
+
+        # Render the panel again only if its text changed (at most once per simulated second)
+        if lines != self._info_panel_lines:
+            self.info_panel = self._render_info_panel(lines)
+            self._info_panel_lines = lines
+
+        # Blit the panel surface onto the window
+        self.add_dirty_rects([self.window.blit(self.info_panel, (10, 10))])
+
+    def _render_info_panel(self, lines:list) -> pygame.Surface:
+        """
+        Render the information panel.
+
+        Parameters:
+        - lines: list of str with the lines of text of the panel
+
+        Returns:
+        - pygame surface with the panel
+        """
         panel_color = (30, 30, 30)
         text_color = (255, 255, 255)
 
         # Create a surface for the panel
         panel_surface = pygame.Surface((300, 160))
         panel_surface.fill(panel_color)
-        
-        # Render the text
-        elapsed_time_text = font.render(f"Elapsed Time: {total_seconds} sec", True, text_color)
-        interval_text = font.render(f"Spawning rule: {interval}", True, text_color)
-        cumulative_waiting_time_text = font.render(f"Cumulative Waitings: {cumulative_waiting_time} sec", True, text_color)
-        mode_text = font.render(f"Running mode: {'fixed time' if mode == 'ft' else 'policy iteration' if mode == 'pi' else 'value iteration'}", True, text_color)
 
         # Blit the text onto the panel surface
-        panel_surface.blit(elapsed_time_text, (10, 10))
-        panel_surface.blit(interval_text, (10, 40))
-        panel_surface.blit(mode_text, (10, 70))
-        panel_surface.blit(cumulative_waiting_time_text, (10, 100))
-        
-        # Blit the panel surface onto the window
-        self.window.blit(panel_surface, (10, 10))
+        text_cache = get_text_cache()
+        for i, line in enumerate(lines):
+            panel_surface.blit(text_cache.render(line, 24, text_color, system=True), (10, 10 + 30 * i))
 
+        return panel_surface.convert(self.window)
@@ -0,0 +1,358 @@
+import bisect
+import heapq
+import random
+from itertools import count
+from entities.simulation import Simulation, FPS, WINDOW_SIZE
+from entities.environment import HeadlessWindow
+from entities.car import Car
+from entities.car_manager import CarManager
+from entities.stoplight import Stoplight
+from entities.stoplight_manager import StoplightManager
+from entities.car_actions import CarActions
+from entities.colors import TrafficLightColor
+from entities.demand import INTERVAL_DIRECTIONS
+from model.TrafficMDP import TrafficMDP
+from model.lookup_policy import LookupTablePolicy, DEFAULT_LOOKUP_TABLE
+
+# Coordinate of a car along its lane, and the sign of its movement along that coordinate
+LANE_AXIS = {
+    CarActions.UP: ('y', -1),
+    CarActions.DOWN: ('y', 1),
+    CarActions.LEFT: ('x', -1),
+    CarActions.RIGHT: ('x', 1),
+}
+
+# Events that are not attached to a car
+SPAWN, SIGNAL, DECISION = 'spawn', 'signal', 'decision'
+
+class EventSimulation(Simulation):
+    """
+    Runs the simulation headless with a next-event engine, giving the same results as a headless Simulation.run.
+
+    Between two events every car moves straight at Car.SPEED or waits at a red light, and the stoplight only counts
+    its green or yellow time, so these ticks are applied at once. An event is a tick where something else can happen:
+    a car reaches the stop line, the tail of a queue, its turning point, the middle of the intersection or the edge
+    of the window, a stopped car gets a green light, a car spawns, the yellow light ends or the controller can switch
+    the stoplight. Events are kept in a priority queue; event ticks are run exactly like a tick of Simulation.run, so
+    the random draws, the MDP decisions and the statistics are the same.
+
+    The fewer the cars, the fewer the events: the idle intervals of the spawning rules cost almost nothing.
+
+    Attributes:
+    - n_event_ticks: int representing the number of ticks of the last run that were events
+    """
+    def run(self, mode:str, save_stats:bool = False, seed:int = None, output_dir:str = './data', mdp_solver:str = 'loop', lookup_table:str = DEFAULT_LOOKUP_TABLE):
+        """
+        Run the simulation.
+
+        Parameters:
+        - mode: str representing the mode of the simulation (pi, vi, ft, lt)
+        - save_stats: bool representing if the stats should be saved
+        - seed: int used to seed the random generator, so that the run can be reproduced
+        - output_dir: str representing the directory where the stats are saved
+        - mdp_solver: str representing the solver of the MDP in the pi and vi modes ('loop' or 'matrix')
+        - lookup_table: str representing the path of the policy used by the lt mode (see model.offline_policy)
+        """
+        assert mode in ['pi', 'vi', 'ft', 'lt'], "Mode must be either 'pi', 'vi', 'ft' or 'lt'"
+
+        if seed is not None:
+            random.seed(seed)
+
+        self.cumulative_waiting_times = [0]
+        self.n_stopped_cars = 0
+
+        self.environment = None
+        self.window = HeadlessWindow(WINDOW_SIZE)
+        self.car_manager = CarManager(self.window)
+        self.stoplight_manager = StoplightManager()
+
+        self.mode = mode
+        self.mdp = TrafficMDP(solver=mdp_solver) if mode in ['pi', 'vi'] else None
+        self.lookup_policy = LookupTablePolicy.load(lookup_table) if mode == 'lt' else None
+
+        self.total_ticks = self.simulation_duration * FPS
+        self.spawn_ticks = max(1, round(self.car_spawn_frequency * FPS))
+
+        # Priority queue of (tick, sequence number, car or event name); an entry is outdated if it is not the latest of its key
+        self.events = []
+        self.scheduled = {}
+        self.sequence = count()
+        self.n_event_ticks = 0
+
+        tick = 0
+        self._run_tick(tick, [])
+
+        while True:
+            due = self._pop_due()
+            next_tick = self.total_ticks if due is None else min(due[0], self.total_ticks)
+
+            # Apply the ticks between the two events at once
+            self._advance(tick + 1, next_tick - tick - 1)
+            if next_tick >= self.total_ticks:
+                break
+
+            tick = next_tick
+            self._run_tick(tick, due[1])
+
+        self.save_stats(mode, output_dir) if save_stats else None
+
+    def _run_tick(self, tick:int, due:list) -> None:
+        """
+        Run an event tick like Simulation.run does, then schedule the next events of what it changed.
+
+        Parameters:
+        - tick: int representing the tick to run
+        - due: list of the cars whose event is at this tick
+        """
+        stoplight = self.stoplight_manager.stoplight
+        car_manager = self.car_manager
+        colors = (stoplight.color_NS, stoplight.color_EW)
+        stopped = {direction: set(car_manager.stopped[direction]) for direction in CarActions}
+        n_spawned = car_manager.n_spawned
+
+        self.stoplight_manager.update_stoplight()
+
+        new_second = tick > 0 and tick % FPS == 0
+        interval = self.current_interval(tick // FPS)
+
+        if tick > 0 and tick % self.spawn_ticks == 0:
+            self.add_cars_based_on_interval(interval)
+
+        self.take_decision(self.mode, new_second, self.mdp, self.lookup_policy)
+
+        car_manager.update_cars(stoplight)
+
+        if new_second:
+            self.cumulative_waiting_times.append(car_manager.cumulative_waiting_time // FPS)
+
+        self.n_stopped_cars = car_manager.get_n_stopped_cars()
+        self.n_event_ticks += 1
+
+        # A car's next event depends on its own state, on the stoplight and on the stopped cars of its lane
+        if colors != (stoplight.color_NS, stoplight.color_EW):
+            changed = car_manager.cars
+        else:
+            changed = [car for direction in CarActions if stopped[direction] != car_manager.stopped[direction].keys() for car in car_manager.lanes[direction]]
+            changed += due + car_manager.cars[len(car_manager.cars) - (car_manager.n_spawned - n_spawned):]
+
+        for car in due:
+            if car not in car_manager.lanes[car.get_direction()]:
+                del self.scheduled[car]
+        for car in changed:
+            if car in car_manager.lanes[car.get_direction()]:
+                self._schedule(car, self._next_car_event(car, tick))
+
+        self._schedule(SPAWN, self._next_spawn(tick + 1))
+        self._schedule(SIGNAL, self._next_signal(tick))
+        self._schedule(DECISION, self._next_decision(tick))
+
+    def _schedule(self, key, tick:int) -> None:
+        """
+        Schedule the next event of a car or of an event name, replacing the one scheduled before (None for no event).
+        """
+        if tick is None:
+            self.scheduled.pop(key, None)
+            return
+        entry = (tick, next(self.sequence), key)
+        self.scheduled[key] = entry
+        heapq.heappush(self.events, entry)
+
+    def _pop_due(self):
+        """
+        Pop the events of the earliest tick.
+
+        Returns:
+        - tuple with the tick and the list of the cars whose event is at that tick, or None if nothing is scheduled
+        """
+        self._drop_outdated()
+        if not self.events:
+            return None
+
+        tick, cars = self.events[0][0], []
+        while self.events and self.events[0][0] == tick:
+            entry = heapq.heappop(self.events)
+            if self.scheduled.get(entry[2]) is entry and isinstance(entry[2], Car):
+                cars.append(entry[2])
+            self._drop_outdated()
+        return tick, cars
+
+    def _drop_outdated(self) -> None:
+        while self.events and self.scheduled.get(self.events[0][2]) is not self.events[0]:
+            heapq.heappop(self.events)
+
+    def _advance(self, tick:int, n_ticks:int) -> None:
+        """
+        Apply n_ticks ticks without events: the cars that move go straight, the stopped cars wait
+        and the stoplight counts its green or yellow time.
+
+        Parameters:
+        - tick: int representing the first tick to apply
+        - n_ticks: int representing the number of ticks to apply
+        """
+        if n_ticks <= 0:
+            return
+
+        stoplight = self.stoplight_manager.stoplight
+        car_manager = self.car_manager
+        if TrafficLightColor.GREEN.value in (stoplight.color_NS, stoplight.color_EW):
+            stoplight.time_green += n_ticks
+        if TrafficLightColor.YELLOW.value in (stoplight.color_NS, stoplight.color_EW):
+            stoplight.time_yellow += n_ticks
+
+        # Sample the cumulative waiting times of the seconds that start in these ticks
+        n_stopped = sum(car_manager.stats.n_stopped.values())
+        first_second = max(1, -(-tick // FPS))
+        for second in range(first_second, (tick + n_ticks - 1) // FPS + 1):
+            waiting_time = car_manager.cumulative_waiting_time + (second * FPS - tick + 1) * n_stopped
+            self.cumulative_waiting_times.append(waiting_time // FPS)
+        car_manager.cumulative_waiting_time += n_ticks * n_stopped
+
+        stats = car_manager.stats
+        stats.tick(n_ticks)
+        distance = n_ticks * Car.SPEED
+        for car in car_manager.cars:
+            if car.isStopped:
+                stats.waiting_ticks[car.direction] += n_ticks
+                stats.waiting_seconds[car.direction] += (car.waiting_time + n_ticks) // FPS - car.waiting_time // FPS
+                car.waiting_time += n_ticks
+            else:
+                axis, sign = LANE_AXIS[car.direction]
+                setattr(car, axis, getattr(car, axis) + sign * distance)
+
+    def _next_car_event(self, car:Car, tick:int):
+        """
+        Get the next tick where the update of a car is not a straight move or a tick of waiting,
+        if the stoplight and the stopped cars of its lane do not change.
+
+        Parameters:
+        - car: Car object
+        - tick: int representing the current tick
+
+        Returns:
+        - int representing the tick of the event, or None if the car waits until the stoplight changes
+        """
+        stoplight = self.stoplight_manager.stoplight
+        vertical = car.direction in [CarActions.UP, CarActions.DOWN]
+        green = (stoplight.color_NS if vertical else stoplight.color_EW) == TrafficLightColor.GREEN.value
+
+        if car.isStopped:
+            return tick + 1 if green else None
+
+        # The lane coordinate is turned into a distance that grows by Car.SPEED at every tick
+        axis, sign = LANE_AXIS[car.direction]
+        size = car.geometry.height if vertical else car.geometry.width
+        mid = size // 2
+        position = sign * getattr(car, axis)
+
+        # Ranges of the lane coordinate (at the start of a tick) where the update is an event
+        incoming = position < sign * mid
+        if sign < 0:
+            ranges = [(mid + 50, mid + 53), (None, 3)]
+            ranges += [(None, mid + 4)] if incoming else []
+            ranges += [(s + Car.LENGTH + 4, s + Car.LENGTH + 6) for s in self.car_manager.stopped[car.direction]]
+            ranges += [(None, mid)] if car.turn_right else []
+        else:
+            ranges = [(mid - Car.LENGTH - 53, mid - Car.LENGTH - 50), (size - 3, None)]
+            ranges += [(mid - 4, None)] if incoming else []
+            ranges += [(s - Car.LENGTH - 6, s - Car.LENGTH - 4) for s in self.car_manager.stopped[car.direction]]
+            ranges += [(mid - Car.LENGTH, None)] if car.turn_right else []
+        if green:
+            # The stop line only matters on yellow and red
+            ranges = ranges[1:]
+
+        steps = [_first_step(position, *_along(low, high, sign)) for low, high in ranges]
+        steps = [step for step in steps if step is not None]
+        return tick + 1 + min(steps) if steps else None
+
+    def _next_spawn(self, tick:int):
+        """
+        Get the first spawn tick from the given tick whose interval adds cars.
+
+        Parameters:
+        - tick: int representing the first tick to look at
+
+        Returns:
+        - int representing the tick of the spawn, or None if no car is added before the end of the run
+        """
+        spawn_tick = max(self.spawn_ticks, -(-tick // self.spawn_ticks) * self.spawn_ticks)
+        while spawn_tick < self.total_ticks:
+            interval = self.current_interval(spawn_tick // FPS)
+            if INTERVAL_DIRECTIONS.get(interval):
+                return spawn_tick
+            # Jump to the first spawn of the next interval
+            end = self.interval_ends[bisect.bisect_right(self.interval_ends, spawn_tick // FPS)] * FPS
+            spawn_tick = -(-end // self.spawn_ticks) * self.spawn_ticks
+        return None
+
+    def _next_signal(self, tick:int):
+        """
+        Get the tick where the yellow light turns red and the other direction turns green.
+        """
+        stoplight = self.stoplight_manager.stoplight
+        if TrafficLightColor.YELLOW.value not in (stoplight.color_NS, stoplight.color_EW):
+            return None
+        return tick + max(1, Stoplight.YELLOW_DURATION - stoplight.time_yellow)
+
+    def _next_decision(self, tick:int):
+        """
+        Get the next tick where the controller can switch the stoplight to yellow.
+        """
+        stoplight = self.stoplight_manager.stoplight
+        if TrafficLightColor.GREEN.value not in (stoplight.color_NS, stoplight.color_EW):
+            return None
+        time_green = stoplight.time_green
+
+        match self.mode:
+            case 'ft':
+                return tick + max(1, Stoplight.FIXED_GREEN_DURATION * FPS - time_green)
+            case 'pi' | 'vi':
+                # Once per second, after 15 seconds of green
+                first = tick + max(1, Stoplight.MIN_GREEN_DURATION * FPS - time_green)
+                return max(FPS, -(-first // FPS) * FPS)
+            case 'lt':
+                # The decision only changes when the stopped cars (an event) or the seconds of its inputs change
+                state = 'NS' if stoplight.color_NS == TrafficLightColor.GREEN.value else 'EW'
+                red_directions = [CarActions.LEFT, CarActions.RIGHT] if state == 'NS' else [CarActions.UP, CarActions.DOWN]
+                stats = self.car_manager.get_stats()
+                max_waiting_time = self.car_manager.get_max_waiting_time(red_directions)
+                action = self.lookup_policy.get_action(
+                    state,
+                    [stats.n_stopped[direction] for direction in [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT]],
+                    (time_green + 1) // FPS,
+                    max_waiting_time // FPS
+                )
+                if action == 'change':
+                    return tick + 1
+                steps = [FPS * ((time_green + 1) // FPS + 1) - time_green]
+                if self.car_manager.get_stopped_cars(red_directions):
+                    steps.append(FPS * (max_waiting_time // FPS + 1) - max_waiting_time + 1)
+                return tick + min(steps)
+
+def _along(low, high, sign:int) -> tuple:
+    """
+    Turn a range of a lane coordinate into a range of the distance along the lane (sign times the coordinate).
+    """
+    if sign > 0:
+        return low, high
+    return (-high if high is not None else None), (-low if low is not None else None)
+
+def _first_step(position:int, low, high):
+    """
+    Get the number of ticks before a car, moving Car.SPEED forward at every tick, is in a range of positions.
+
+    Parameters:
+    - position: int representing the current position of the car
+    - low: int representing the lowest position of the range (None if unbounded)
+    - high: int representing the highest position of the range (None if unbounded)
+
+    Returns:
+    - int representing the number of ticks, or None if the car never stops in the range
+    """
+    if high is not None and position > high:
+        return None
+    if low is None or position >= low:
+        return 0
+    step = -(-(low - position) // Car.SPEED)
+    if high is not None and position + step * Car.SPEED > high:
+        return None
+    return step
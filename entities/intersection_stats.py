@@ -0,0 +1,158 @@
+import heapq
+from entities.car_actions import CarActions
+
+TICKS_PER_SECOND = 30   # same as the simulation FPS
+
+DIRECTIONS = tuple(CarActions)
+ZEROS = dict.fromkeys(DIRECTIONS, 0)
+
+class IntersectionStats:
+    """
+    Per-approach aggregates of the cars at the intersection, used as the observation of the stoplight controllers.
+
+    CarManager keeps one up to date on every state transition of its cars (spawn, stop, release,
+    turn, exit), so reading it takes constant time whatever the number of cars.
+
+    Attributes (dicts keyed by direction):
+    - n_stopped: number of stopped cars
+    - waiting_ticks: sum of the waiting times of the stopped cars, in ticks
+    - waiting_seconds: sum of the waiting times of the stopped cars, each rounded down to whole seconds
+    - n_incoming: number of moving cars that have not reached the middle of the intersection yet
+
+    Other attributes:
+    - clock: int representing the number of ticks of waiting counted for every stopped car (see tick)
+
+    The longest waiting time of the stopped cars of each direction is also kept (see max_waiting_time). Every
+    stopped car waits one more tick per tick, so the waiting time of a stopped car minus the clock does not
+    change while it is stopped: the stopped cars are kept in a heap per direction keyed by this difference,
+    with lazy removal.
+    """
+    def __init__(self):
+        # Copying a dict reuses the hashes of its keys (hashing the directions is a Python call)
+        self.n_stopped = ZEROS.copy()
+        self.waiting_ticks = ZEROS.copy()
+        self.waiting_seconds = ZEROS.copy()
+        self.n_incoming = ZEROS.copy()
+        self.clock = 0
+        self._waiting_heaps = {direction: [] for direction in DIRECTIONS}
+        self._waiting_keys = {direction: {} for direction in DIRECTIONS}
+
+    @classmethod
+    def from_cars(cls, cars:list, window_width:int, window_height:int):
+        """
+        Compute the aggregates from a list of cars, in a single pass.
+
+        Parameters:
+        - cars: list of Car objects
+        - window_width: int representing the width of the window
+        - window_height: int representing the height of the window
+
+        Returns:
+        - IntersectionStats with the aggregates of the cars
+        """
+        stats = cls()
+        for car in cars:
+            if car.is_stopped():
+                stats.add_stopped(car)
+            elif is_incoming(car, window_width // 2, window_height // 2):
+                stats.n_incoming[car.direction] += 1
+        return stats
+
+    def copy(self):
+        """
+        Take a snapshot of the aggregates, that is not changed by the following updates.
+
+        Returns:
+        - IntersectionStats with the same aggregates
+        """
+        stats = IntersectionStats.__new__(IntersectionStats)
+        stats.n_stopped = dict(self.n_stopped)
+        stats.waiting_ticks = dict(self.waiting_ticks)
+        stats.waiting_seconds = dict(self.waiting_seconds)
+        stats.n_incoming = dict(self.n_incoming)
+        stats.clock = self.clock
+        stats._waiting_heaps = {direction: list(heap) for direction, heap in self._waiting_heaps.items()}
+        stats._waiting_keys = {direction: dict(keys) for direction, keys in self._waiting_keys.items()}
+        return stats
+
+    def tick(self, n_ticks:int = 1) -> None:
+        """
+        Advance the clock before the stopped cars wait n_ticks more ticks (each of them must then be counted
+        with add_waiting_tick, or have its waiting time increased by n_ticks).
+        """
+        self.clock += n_ticks
+
+    def max_waiting_time(self, directions:list) -> int:
+        """
+        Get the waiting time of the longest waiting stopped car in the specified directions, in constant time
+        (amortized over the cars that were removed).
+
+        Parameters:
+        - directions: list of directions to filter the cars
+
+        Returns:
+        - int: waiting time in ticks (0 if no car is stopped)
+        """
+        max_waiting_time = 0
+        for direction in directions:
+            heap, keys = self._waiting_heaps[direction], self._waiting_keys[direction]
+            while heap and -heap[0] not in keys:
+                heapq.heappop(heap)
+            max_waiting_time = max(max_waiting_time, -heap[0] + self.clock) if heap else max_waiting_time
+        return max_waiting_time
+
+    def add_stopped(self, car) -> None:
+        """
+        Count a car that has just stopped (it may have waited before, its waiting time is not reset).
+        """
+        self.n_stopped[car.direction] += 1
+        self.waiting_ticks[car.direction] += car.waiting_time
+        self.waiting_seconds[car.direction] += car.waiting_time // TICKS_PER_SECOND
+
+        key, keys, heap = car.waiting_time - self.clock, self._waiting_keys[car.direction], self._waiting_heaps[car.direction]
+        keys[key] = keys.get(key, 0) + 1
+        heapq.heappush(heap, -key)
+        # Drop the removed keys that are not on top of the heap once they are the majority
+        if len(heap) > 2 * self.n_stopped[car.direction] + 64:
+            heap[:] = [-key for key, count in keys.items() for _ in range(count)]
+            heapq.heapify(heap)
+
+    def remove_stopped(self, car) -> None:
+        """
+        Remove a car that is moving again.
+        """
+        self.n_stopped[car.direction] -= 1
+        self.waiting_ticks[car.direction] -= car.waiting_time
+        self.waiting_seconds[car.direction] -= car.waiting_time // TICKS_PER_SECOND
+
+        key, keys = car.waiting_time - self.clock, self._waiting_keys[car.direction]
+        keys[key] -= 1
+        if not keys[key]:
+            del keys[key]
+
+    def add_waiting_tick(self, car) -> None:
+        """
+        Count one more tick of waiting for a stopped car, after its waiting time has been increased.
+        """
+        self.waiting_ticks[car.direction] += 1
+        if car.waiting_time % TICKS_PER_SECOND == 0:
+            self.waiting_seconds[car.direction] += 1
+
+def is_incoming(car, mid_x:int, mid_y:int) -> bool:
+    """
+    Check if the car has not reached the middle of the intersection yet.
+
+    Parameters:
+    - car: Car object
+    - mid_x: int representing the x coordinate of the middle of the intersection
+    - mid_y: int representing the y coordinate of the middle of the intersection
+
+    Returns:
+    - boolean: True if the car is before the middle of the intersection, False otherwise
+    """
+    return (
+        (car.direction == CarActions.UP and car.y > mid_y) or
+        (car.direction == CarActions.DOWN and car.y < mid_y) or
+        (car.direction == CarActions.LEFT and car.x > mid_x) or
+        (car.direction == CarActions.RIGHT and car.x < mid_x)
+    )
@@ -0,0 +1,353 @@
+import os
+import random
+import multiprocessing
+import numpy as np
+from entities.simulation import Simulation, FPS, WINDOW_SIZE
+from entities.environment import HeadlessWindow
+from entities.car import Car
+from entities.car_manager import CarManager
+from entities.stoplight import Stoplight
+from entities.stoplight_manager import StoplightManager
+from entities.car_actions import CarActions
+from entities.colors import TrafficLightColor
+from entities.demand import INTERVAL_DIRECTIONS
+from model.TrafficMDP import TrafficMDP
+
+# Offset (row, column) of the intersection reached by a car leaving the window in each direction
+NEIGHBOURS = {
+    CarActions.UP: (-1, 0),
+    CarActions.DOWN: (1, 0),
+    CarActions.LEFT: (0, -1),
+    CarActions.RIGHT: (0, 1),
+}
+
+class NetworkCarManager(CarManager):
+    """
+    Manages the cars of one intersection of a network: the cars that leave the window are kept
+    to be handed off to the next intersection instead of being released.
+
+    Attributes:
+    - exited: list of the cars that left the window during the last update
+    """
+    def __init__(self, window, rng:random.Random = None):
+        super().__init__(window, rng=rng)
+        self.exited = []
+
+    def _on_exit(self, car:Car) -> None:
+        self.exited.append(car)
+
+class Intersection:
+    """
+    One intersection of a network, with its own stoplight, controller, cars and random generator.
+
+    The intersection owns a cell of the grid: its window is the road around it, up to the middle of the
+    road segments that link it to its neighbours. A car leaving the window enters the window of the
+    neighbour at the opposite edge, keeping its id and color.
+
+    Attributes:
+    - index: int representing the index of the intersection in the network (row * cols + col)
+    - row, col: int representing the position of the intersection in the grid
+    - mode: str representing the controller of the stoplight (ft, pi, vi)
+    - entries: list of the directions of the cars that can enter the network at this intersection
+    - rng: random.Random used for the cars, the stoplight and the MDP of the intersection
+    - cumulative_waiting_times: list of the total waiting time of the cars, in seconds, sampled every second
+    - n_exited: int representing the number of cars that left the network at this intersection
+    """
+    def __init__(self, index:int, rows:int, cols:int, mode:str, seed:int = None, mdp_solver:str = 'loop', cell_size:tuple = WINDOW_SIZE):
+        self.index = index
+        self.rows, self.cols = rows, cols
+        self.row, self.col = divmod(index, cols)
+        self.mode = mode
+        self.entries = [direction for direction, (d_row, d_col) in NEIGHBOURS.items() if not self._in_grid(self.row - d_row, self.col - d_col)]
+
+        # Each intersection draws from its own generator, so the results do not depend on the partition of the network
+        self.rng = random.Random(None if seed is None else f'{seed}:{index}')
+        self.window = HeadlessWindow(cell_size)
+        self.stoplight_manager = StoplightManager(Stoplight(self.rng))
+        self.car_manager = NetworkCarManager(self.window, self.rng)
+        self.mdp = TrafficMDP(rng=self.rng, solver=mdp_solver) if mode in ['pi', 'vi'] else None
+
+        self.cumulative_waiting_times = [0]
+        self.n_exited = 0
+
+    def _in_grid(self, row:int, col:int) -> bool:
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def receive(self, state:tuple) -> None:
+        """
+        Add a car handed off by a neighbour.
+
+        Parameters:
+        - state: tuple with the direction, the coordinates in this window, the color and the id of the car
+        """
+        direction, x, y, color, id = state
+        # The turn is drawn again at every intersection, and the waiting time counts the wait at this one
+        car = Car.from_state(self.window, direction, x, y, False, self.rng.choice([False, True]), 0, color, id)
+        self.car_manager.receive_car(car)
+
+    def step(self, tick:int, interval:str, spawn:bool) -> list:
+        """
+        Run one tick of the intersection.
+
+        Parameters:
+        - tick: int representing the current tick
+        - interval: str representing the current interval of the spawning rules
+        - spawn: bool representing if the cars of the interval should be spawned at this tick
+
+        Returns:
+        - list of (index of the neighbour, index of this intersection, state of the car) for the cars handed off to a neighbour
+        """
+        new_second = tick > 0 and tick % FPS == 0
+
+        self.stoplight_manager.update_stoplight()
+
+        if spawn:
+            directions = [direction for direction in INTERVAL_DIRECTIONS.get(interval, []) if direction in self.entries]
+            if directions:
+                self.car_manager.add_car(direction=directions)
+                # Ids are unique in the whole network
+                car = self.car_manager.cars[-1]
+                car.id = car.id * self.rows * self.cols + self.index
+
+        self.take_decision(new_second)
+
+        self.car_manager.update_cars(self.stoplight_manager.stoplight)
+
+        handoffs = []
+        width, height = self.window.get_size()
+        for car in self.car_manager.exited:
+            d_row, d_col = NEIGHBOURS[car.direction]
+            if not self._in_grid(self.row + d_row, self.col + d_col):
+                self.n_exited += 1
+                self.car_manager.pool.release(car)
+                continue
+            # Coordinates of the car in the window of the neighbour
+            x, y = car.x - d_col * width, car.y - d_row * height
+            handoffs.append(((self.row + d_row) * self.cols + self.col + d_col, self.index, (car.direction, x, y, car.color, car.id)))
+        self.car_manager.exited = []
+
+        if new_second:
+            self.cumulative_waiting_times.append(self.car_manager.cumulative_waiting_time // FPS)
+
+        return handoffs
+
+    def take_decision(self, new_second:bool) -> None:
+        """
+        Take the decision of the stoplight controller for the current tick, like Simulation.take_decision.
+        """
+        stoplight = self.stoplight_manager.stoplight
+        match self.mode:
+            case 'pi' | 'vi':
+                # Once per second, after 15 seconds of green
+                if stoplight.time_green//FPS >= Stoplight.MIN_GREEN_DURATION and new_second:
+                    state = 'NS' if stoplight.color_NS == TrafficLightColor.GREEN.value else 'EW'
+                    if self.mode == 'pi':
+                        self.mdp.policy_iteration(self.car_manager.get_stats())
+                        action = self.mdp.get_action(state)
+                    else:
+                        action = self.mdp.value_iteration(self.car_manager.get_stats(), state)
+                    stoplight.switch_yellow() if action == 'change' else None
+            case 'ft':
+                stoplight.switch_yellow() if stoplight.time_green//FPS >= Stoplight.FIXED_GREEN_DURATION else None
+
+    def results(self) -> dict:
+        return {
+            'cumulative_waiting_times': self.cumulative_waiting_times,
+            'n_stopped_cars': self.car_manager.get_n_stopped_cars(),
+            'queues': self.car_manager.queues,
+            'n_spawned': self.car_manager.n_spawned,
+            'n_exited': self.n_exited,
+        }
+
+class Region:
+    """
+    Set of intersections of a network stepped together (in one process).
+
+    Cars handed off between two intersections of the region stay in the region; only the cars
+    that go to an intersection of another region are returned by step.
+
+    Attributes:
+    - intersections: dict with the Intersection objects of the region, by index
+    - pending: list of the hand-offs between intersections of the region, received at the next tick
+    """
+    def __init__(self, simulation, indices:list, seed:int = None, mdp_solver:str = 'loop'):
+        self.simulation = simulation
+        self.intersections = {
+            index: Intersection(index, simulation.rows, simulation.cols, simulation.modes[index], seed, mdp_solver, simulation.cell_size)
+            for index in indices
+        }
+        self.pending = []
+
+    def step(self, tick:int, incoming:list) -> list:
+        """
+        Run one tick of every intersection of the region.
+
+        Parameters:
+        - tick: int representing the current tick
+        - incoming: list of (index of the intersection, index of the neighbour, state of the car) handed off by the other regions at the last tick
+
+        Returns:
+        - list of (index of the intersection, index of the neighbour, state of the car) handed off to the other regions
+        """
+        # The cars are received in the order of the intersection they come from, whatever the partition
+        for index, _, state in sorted(self.pending + incoming, key=lambda handoff: handoff[:2]):
+            self.intersections[index].receive(state)
+        self.pending = []
+
+        interval = self.simulation.current_interval(tick // FPS)
+        spawn = tick > 0 and tick % self.simulation.spawn_ticks == 0
+
+        outgoing = []
+        for intersection in self.intersections.values():
+            for handoff in intersection.step(tick, interval, spawn):
+                (self.pending if handoff[0] in self.intersections else outgoing).append(handoff)
+        return outgoing
+
+    def results(self) -> dict:
+        return {index: intersection.results() for index, intersection in self.intersections.items()}
+
+def _run_region(connection, simulation, indices:list, seed:int, mdp_solver:str) -> None:
+    """
+    Step a region in a worker process, exchanging the handed off cars with the main process at every tick.
+    """
+    region = Region(simulation, indices, seed, mdp_solver)
+    for tick in range(simulation.total_ticks):
+        connection.send(region.step(tick, connection.recv()))
+    connection.send(region.results())
+    connection.close()
+
+class NetworkSimulation(Simulation):
+    """
+    Runs a grid of intersections linked by road segments, headless.
+
+    Every intersection has its own stoplight and controller (fixed time, policy iteration or value iteration).
+    Cars spawn at the edges of the grid following the spawning rules (each intersection on the edge spawns
+    the cars of the interval that enter the grid there), and are handed off between neighbouring intersections.
+
+    The grid can be split into regions of rows, each stepped by its own worker process: the regions only
+    exchange the cars that cross their borders, once per tick. Every intersection has its own random generator,
+    so the results are the same for any number of regions.
+
+    Attributes:
+    - rows: int representing the number of rows of the grid
+    - cols: int representing the number of columns of the grid
+    - modes: list of str with the mode of each intersection (pi, vi, ft), in row-major order
+    - cell_size: tuple with the size of the window of each intersection
+    """
+    def __init__(self, spawning_rules:list, rows:int, cols:int, car_spawn_rate:float = 1, modes = 'ft', cell_size:tuple = WINDOW_SIZE) -> None:
+        super().__init__(spawning_rules, car_spawn_rate=car_spawn_rate)
+        assert rows > 0 and cols > 0, "The grid must have at least one intersection"
+
+        self.rows, self.cols = rows, cols
+        self.modes = [modes] * (rows * cols) if isinstance(modes, str) else list(modes)
+        assert len(self.modes) == rows * cols, "There must be one mode per intersection"
+        assert all(mode in ['pi', 'vi', 'ft'] for mode in self.modes), "Mode must be either 'pi', 'vi' or 'ft'"
+        self.cell_size = cell_size
+
+        self.total_ticks = self.simulation_duration * FPS
+        self.spawn_ticks = max(1, round(self.car_spawn_frequency * FPS))
+
+    def partition(self, n_regions:int) -> list:
+        """
+        Split the grid into regions of consecutive rows.
+
+        Parameters:
+        - n_regions: int representing the number of regions (at most the number of rows)
+
+        Returns:
+        - list with the list of the intersection indices of each region
+        """
+        row_groups = np.array_split(np.arange(self.rows), min(n_regions, self.rows))
+        return [[row * self.cols + col for row in rows for col in range(self.cols)] for rows in row_groups]
+
+    def run(self, seed:int = None, n_regions:int = 1, mdp_solver:str = 'loop', save_stats:bool = False, output_dir:str = './data') -> dict:
+        """
+        Run the network.
+
+        Parameters:
+        - seed: int used to seed the random generators of the intersections, so that the run can be reproduced
+        - n_regions: int representing the number of regions stepped by separate worker processes (1 to run in this process)
+        - mdp_solver: str representing the solver of the MDP of the pi and vi intersections ('loop' or 'matrix')
+        - save_stats: bool representing if the stats of each intersection should be saved
+        - output_dir: str representing the directory where the stats are saved
+
+        Returns:
+        - dict with, for each intersection, the 'cumulative_waiting_times' (array of shape (intersections, seconds)),
+          the 'n_stopped_cars', the 'n_spawned' and 'n_exited' cars (arrays of shape (intersections,))
+          and the 'queues' (list of lists of queue lengths)
+        """
+        regions = self.partition(n_regions)
+
+        if len(regions) == 1:
+            region = Region(self, regions[0], seed, mdp_solver)
+            for tick in range(self.total_ticks):
+                region.step(tick, [])
+            results = region.results()
+        else:
+            results = self._run_parallel(regions, seed, mdp_solver)
+
+        results = [results[index] for index in range(self.rows * self.cols)]
+        self.cumulative_waiting_times = np.array([result['cumulative_waiting_times'] for result in results])
+        self.n_stopped_cars = np.array([result['n_stopped_cars'] for result in results])
+        self.queues = [result['queues'] for result in results]
+
+        self.save_network_stats(output_dir) if save_stats else None
+
+        return {
+            'cumulative_waiting_times': self.cumulative_waiting_times,
+            'n_stopped_cars': self.n_stopped_cars,
+            'queues': self.queues,
+            'n_spawned': np.array([result['n_spawned'] for result in results]),
+            'n_exited': np.array([result['n_exited'] for result in results]),
+        }
+
+    def _run_parallel(self, regions:list, seed:int, mdp_solver:str) -> dict:
+        """
+        Step each region in its own worker process, routing the cars that cross the borders of the regions.
+
+        Returns:
+        - dict with the results of each intersection, by index
+        """
+        region_of = {index: k for k, indices in enumerate(regions) for index in indices}
+        connections, processes = [], []
+        for indices in regions:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_region, args=(child, self, indices, seed, mdp_solver), daemon=True)
+            process.start()
+            child.close()
+            connections.append(parent)
+            processes.append(process)
+
+        try:
+            incoming = [[] for _ in regions]
+            for _ in range(self.total_ticks):
+                for connection, handoffs in zip(connections, incoming):
+                    connection.send(handoffs)
+                incoming = [[] for _ in regions]
+                for connection in connections:
+                    for handoff in connection.recv():
+                        incoming[region_of[handoff[0]]].append(handoff)
+
+            results = {}
+            for connection in connections:
+                results.update(connection.recv())
+        finally:
+            for process in processes:
+                process.join(timeout=1) if process.is_alive() else None
+                process.terminate() if process.is_alive() else None
+        return results
+
+    def save_network_stats(self, output_dir:str = './data'):
+        """
+        Save the stats of each intersection to disk, suffixed with its mode and its position in the grid.
+        Named apart from Simulation.save_stats, which saves the stats of one intersection in one mode.
+
+        Parameters:
+        - output_dir: str representing the directory where the stats are saved
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        for index, mode in enumerate(self.modes):
+            suffix = f'{mode}_r{index // self.cols}c{index % self.cols}'
+            self.to_disk(self.cumulative_waiting_times[index].tolist(), os.path.join(output_dir, f'cumulative_waiting_times_{suffix}.csv'))
+            self.to_disk(int(self.n_stopped_cars[index]), os.path.join(output_dir, f'stopped_cars_{suffix}.csv'))
+            self.to_disk(self.queues[index], os.path.join(output_dir, f'queue_lengths_{suffix}.csv'))
@@ -0,0 +1,121 @@
+import time
+import numpy as np
+
+# Phases of a tick of Simulation.run, in the order they run
+PHASES = ['stoplight', 'spawn', 'decision', 'cars', 'stats', 'recording', 'events', 'render', 'pacing']
+PERCENTILES = [50, 95, 99]
+
+class PhaseProfiler:
+    """
+    Times the phases of the ticks of a run, and counts the work of the MDP solver at each decision.
+
+    A phase is timed from the end of the previous one (start, then one lap per phase), so the cost of the
+    profiler is one clock read and one append per phase. Phases that are skipped at a tick are not recorded.
+
+    Attributes:
+    - mdp: TrafficMDP whose work is counted (None if the controller does not use one)
+    - latencies: dict with the list of the latencies of each phase, in nanoseconds
+    - sweeps: list with the number of solver sweeps of each decision
+    - rewards: list with the number of get_reward calls of each decision
+    - n_ticks: int representing the number of ticks timed
+    """
+    def __init__(self, mdp = None):
+        self.mdp = mdp
+        self.latencies = {phase: [] for phase in PHASES}
+        self.sweeps = []
+        self.rewards = []
+        self.n_ticks = 0
+        self._last = None
+        self._counts = (mdp.n_sweeps, mdp.n_rewards) if mdp is not None else (0, 0)
+
+    def start(self) -> None:
+        """
+        Start timing a tick.
+        """
+        self.n_ticks += 1
+        self._last = time.perf_counter_ns()
+
+    def lap(self, phase:str, waited_ns:int = 0) -> None:
+        """
+        Record the time spent in a phase, since the start of the tick or the end of the previous phase.
+
+        Parameters:
+        - phase: str representing the phase (see PHASES)
+        - waited_ns: int representing the time of the phase spent waiting for the next frame, recorded as 'pacing'
+        """
+        now = time.perf_counter_ns()
+        self.latencies[phase].append(now - self._last - waited_ns)
+        if waited_ns:
+            self.latencies['pacing'].append(waited_ns)
+        self._last = now
+
+    def decision(self) -> None:
+        """
+        Record the decision phase, with the solver sweeps and the get_reward calls it made (if it called the solver).
+        """
+        self.lap('decision')
+        if self.mdp is None:
+            return
+        n_sweeps, n_rewards = self.mdp.n_sweeps, self.mdp.n_rewards
+        if (n_sweeps, n_rewards) != self._counts:
+            self.sweeps.append(n_sweeps - self._counts[0])
+            self.rewards.append(n_rewards - self._counts[1])
+            self._counts = (n_sweeps, n_rewards)
+
+    def summary(self) -> dict:
+        """
+        Summarize the run.
+
+        Returns:
+        - dict with, for each phase that ran, the number of calls, the total time (ms), its share of the timed total,
+          the mean and the percentile latencies (us); and for the decisions that called the solver, the number
+          of decisions, the total and the percentiles of the sweeps and of the get_reward calls
+        """
+        total = sum(sum(latencies) for latencies in self.latencies.values())
+        phases = {}
+        for phase, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies_us = np.array(latencies, dtype=np.float64) / 1000
+            phases[phase] = {
+                'calls': len(latencies),
+                'total_ms': float(latencies_us.sum() / 1000),
+                'share': float(latencies_us.sum() * 1000 / total) if total else 0.0,
+                'mean_us': float(latencies_us.mean()),
+                **{f'p{percentile}_us': float(value) for percentile, value in zip(PERCENTILES, np.percentile(latencies_us, PERCENTILES))},
+            }
+
+        summary = {'ticks': self.n_ticks, 'total_ms': total / 1e6, 'phases': phases}
+        if self.sweeps:
+            summary['solver'] = {'decisions': len(self.sweeps)}
+            for name, counts in [('sweeps', self.sweeps), ('rewards', self.rewards)]:
+                summary['solver'][f'{name}_total'] = int(sum(counts))
+                for percentile, value in zip(PERCENTILES, np.percentile(counts, PERCENTILES)):
+                    summary['solver'][f'{name}_p{percentile}'] = float(value)
+        return summary
+
+def format_summary(summary:dict) -> str:
+    """
+    Format the summary of a PhaseProfiler as a table.
+
+    Parameters:
+    - summary: dict returned by PhaseProfiler.summary
+
+    Returns:
+    - str with one line per phase, and one line for the solver if it was called
+    """
+    lines = [f"Profile of {summary['ticks']} ticks, {summary['total_ms']:.1f} ms timed"]
+    lines.append(f"{'phase':<10} {'calls':>8} {'total ms':>10} {'share':>6} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+    for phase, stats in summary['phases'].items():
+        lines.append(
+            f"{phase:<10} {stats['calls']:>8} {stats['total_ms']:>10.1f} {stats['share']:>6.1%} {stats['mean_us']:>9.1f} "
+            f"{stats['p50_us']:>9.1f} {stats['p95_us']:>9.1f} {stats['p99_us']:>9.1f}"
+        )
+    if 'solver' in summary:
+        solver = summary['solver']
+        lines.append(
+            f"solver: {solver['decisions']} decisions, "
+            f"sweeps {solver['sweeps_total']} (p50 {solver['sweeps_p50']:.0f}, p99 {solver['sweeps_p99']:.0f}), "
+            f"get_reward {solver['rewards_total']} (p50 {solver['rewards_p50']:.0f}, p99 {solver['rewards_p99']:.0f})"
+        )
+    return '\n'.join(lines)
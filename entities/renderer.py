@@ -0,0 +1,173 @@
+import copy
+import time
+import queue
+import threading
+import pygame
+from entities.car import Car
+
+class Renderer:
+    """
+    Draws the frames of a visual run, at a cadence decoupled from the simulated ticks.
+
+    The simulation only reads the state it draws, so the results are the same for every cadence:
+    - every N ticks (render_every): a frame is drawn every N simulated ticks, and the run is paced at FPS frames
+      per real second (N = 1 is the real-time run).
+    - target FPS (render_fps): the simulation runs as fast as it can, and a frame of the current state is drawn
+      whenever 1 / render_fps real seconds have passed since the last one.
+    - render thread (threaded): the simulation is stepped on a worker thread (see run), which hands a copy of the
+      state taken at the cadence above to the calling thread; if it is still drawing, the older pending snapshot
+      is dropped. All the drawing and the window events stay on the calling thread, which must be the main
+      thread on the platforms that only allow drawing from it (e.g. macOS).
+
+    Attributes:
+    - environment: Environment object
+    - fps: int representing the simulated ticks per second, used to pace the runs drawn every N ticks
+    - render_every: int representing the number of simulated ticks between two frames
+    - render_fps: float representing the target frames per real second (None to draw every N ticks)
+    - threaded: bool representing if the simulation is stepped on a worker thread while the frames are drawn
+    - waited_ns: int representing the time the last call to render waited to pace the run, in nanoseconds
+    """
+    def __init__(self, environment, fps:int, render_every:int = 1, render_fps:float = None, threaded:bool = False):
+        assert render_every >= 1, "Frames must be drawn at least every tick"
+        assert render_fps is None or render_fps > 0, "Target FPS must be greater than 0"
+
+        self.environment = environment
+        self.fps = fps
+        self.render_every = render_every
+        self.render_fps = render_fps
+        self.threaded = threaded
+
+        self.clock = pygame.time.Clock()
+        self._last_frame = None
+        self.waited_ns = 0
+
+        if threaded:
+            self._snapshots = queue.Queue(maxsize=1)
+            self._quit = threading.Event()
+
+    def run(self, simulate) -> None:
+        """
+        Run the simulation loop. With a render thread, the loop runs on a worker thread while this thread draws
+        the snapshots it hands over and polls the window events, until the loop returns; otherwise it runs here.
+
+        Parameters:
+        - simulate: function running the simulation loop, which calls render, quit_requested and close
+        """
+        if not self.threaded:
+            simulate()
+            return
+
+        errors = []
+        def target():
+            try:
+                simulate()
+            except BaseException as error:
+                errors.append(error)
+
+        worker = threading.Thread(target=target, name='simulation', daemon=True)
+        worker.start()
+        while worker.is_alive() or not self._snapshots.empty():
+            if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                self._quit.set()
+            try:
+                self._draw(*self._snapshots.get(timeout=1 / self.fps))
+            except queue.Empty:
+                pass
+        worker.join()
+        self.environment.close()
+        if errors:
+            raise errors[0]
+
+    def should_render(self, tick:int) -> bool:
+        """
+        Check if a frame should be drawn at this tick.
+
+        Parameters:
+        - tick: int representing the simulated tick
+
+        Returns:
+        - boolean: True if a frame should be drawn, False otherwise
+        """
+        if self.render_fps is None:
+            return tick % self.render_every == 0
+
+        now = time.perf_counter()
+        if self._last_frame is None or now - self._last_frame >= 1 / self.render_fps:
+            self._last_frame = now
+            return True
+        return False
+
+    def quit_requested(self) -> bool:
+        """
+        Poll the window events (with a render thread, they are polled by the drawing thread).
+
+        Returns:
+        - boolean: True if the user closed the window, False otherwise
+        """
+        if self.threaded:
+            return self._quit.is_set()
+        return any(event.type == pygame.QUIT for event in pygame.event.get())
+
+    def render(self, stoplight_manager, car_manager, info:tuple) -> None:
+        """
+        Draw a frame of the current state, or hand a copy of it to the drawing thread.
+
+        Parameters:
+        - stoplight_manager: StoplightManager object
+        - car_manager: CarManager or VectorizedCarManager object
+        - info: tuple with the arguments of Environment.draw_info_panel
+        """
+        if self.render_fps is None:
+            # Limit the visual run to FPS frames per real second
+            start = time.perf_counter_ns()
+            self.clock.tick(self.fps)
+            self.waited_ns = time.perf_counter_ns() - start
+
+        if not self.threaded:
+            self._draw(stoplight_manager, car_manager.get_cars(), info)
+            return
+
+        snapshot = (self._copy_stoplight_manager(stoplight_manager), self._copy_cars(car_manager.get_cars()), info)
+        try:
+            self._snapshots.put_nowait(snapshot)
+        except queue.Full:
+            # The drawing thread is behind: replace the pending snapshot with the newer one
+            try:
+                self._snapshots.get_nowait()
+            except queue.Empty:
+                pass
+            self._snapshots.put_nowait(snapshot)
+
+    def close(self) -> None:
+        """
+        Close the window (with a render thread, run closes it after drawing the pending snapshot).
+        """
+        self.environment.close() if not self.threaded else None
+
+    def _draw(self, stoplight_manager, cars:list, info:tuple) -> None:
+        """
+        Draw a frame and push it to the display.
+        """
+        self.environment.draw()
+        self.environment.add_dirty_rects(stoplight_manager.draw_stoplight(self.environment.get_window()))
+        self.environment.draw_cars(cars)
+        self.environment.draw_info_panel(*info)
+        self.environment.update()
+
+    def _copy_stoplight_manager(self, stoplight_manager):
+        """
+        Copy the stoplight manager and its stoplight (without building a new Stoplight, which draws a random color).
+        """
+        stoplight_manager = copy.copy(stoplight_manager)
+        stoplight_manager.stoplight = copy.copy(stoplight_manager.stoplight)
+        return stoplight_manager
+
+    def _copy_cars(self, cars:list) -> list:
+        """
+        Copy the state of the cars, so that the simulation can keep updating them while they are drawn.
+        """
+        window = self.environment.get_window()
+        return [
+            Car.from_state(window, car.direction, car.x, car.y, car.isStopped, car.turn_right, car.waiting_time, car.color, car.id)
+            for car in cars
+        ]
@@ -0,0 +1,165 @@
+import os
+import glob
+import json
+import hashlib
+import functools
+import threading
+
+# Bump to invalidate all the entries when the format of the stored results changes
+CACHE_VERSION = 1
+# Packages whose source determines the results of a run
+SOURCE_PACKAGES = ['entities', 'model']
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """
+    Get the version tag of the simulation code: a hash of the source of SOURCE_PACKAGES, so that any change
+    of the code gives new keys.
+
+    Returns:
+    - str with the version tag
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256(f'{CACHE_VERSION}'.encode())
+    for package in SOURCE_PACKAGES:
+        for path in sorted(glob.glob(os.path.join(root, package, '*.py'))):
+            digest.update(os.path.relpath(path, root).replace(os.sep, '/').encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+class ResultCache:
+    """
+    On-disk cache of the results of the simulation runs, addressed by a hash of everything that determines them.
+
+    Each entry is a JSON file named after its key. Entries are written to a temporary file and renamed, so a
+    reader never sees a partial entry, and several processes can share the directory without a lock: two
+    processes storing the same key write the same result, and an entry removed by another process is a miss.
+    When the entries take more than max_bytes, the least recently used ones are removed (a hit refreshes the
+    modification time of its entry).
+
+    Attributes:
+    - directory: str representing the directory of the entries
+    - max_bytes: int representing the maximum total size of the entries
+    - version: str representing the version tag of the code included in the keys (see code_version)
+    - hits: int representing the number of lookups that found an entry
+    - misses: int representing the number of lookups that did not
+    """
+    def __init__(self, directory:str = './data/cache', max_bytes:int = 256 * 2**20, version:str = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version if version is not None else code_version()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, params:dict) -> str:
+        """
+        Get the key of a run.
+
+        Parameters:
+        - params: dict with the parameters that determine the results of the run (JSON serializable)
+
+        Returns:
+        - str with the hash of the parameters and of the version tag
+        """
+        content = json.dumps({**params, 'version': self.version}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key:str) -> dict:
+        """
+        Look up the result of a run.
+
+        Parameters:
+        - key: str representing the key of the run
+
+        Returns:
+        - dict with the result stored by put (None if there is no entry)
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)['result']
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key:str, result:dict, params:dict = None) -> None:
+        """
+        Store the result of a run, then remove the least recently used entries if the cache is over its size limit.
+
+        Parameters:
+        - key: str representing the key of the run
+        - result: dict with the result (JSON serializable)
+        - params: dict with the parameters of the run, stored with the result for reference
+        """
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'params': params, 'version': self.version, 'result': result}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def _entries(self) -> list:
+        """
+        List the entries as (modification time, size, path).
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache is within its size limit.
+
+        Returns:
+        - int representing the number of entries removed
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+
+    def invalidate(self, key:str = None) -> int:
+        """
+        Remove the entry of a run, or all the entries.
+
+        Parameters:
+        - key: str representing the key of the run (None to clear the cache)
+
+        Returns:
+        - int representing the number of entries removed
+        """
+        paths = [self._path(key)] if key is not None else [path for _, _, path in self._entries()]
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._entries())
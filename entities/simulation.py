@@ -1,11 +1,29 @@
-import pygame
-from entities.environment import Environment
+import os
+import json
+import bisect
+import hashlib
+import random
+from itertools import accumulate
+from entities.environment import Environment, HeadlessWindow
+from entities.renderer import Renderer
 from entities.car_manager import CarManager
+from entities.vectorized_car_manager import VectorizedCarManager
+from entities.stoplight import Stoplight
 from entities.stoplight_manager import StoplightManager
+from entities.telemetry import TelemetryWriter
+from entities.trajectory import TrajectoryRecorder
+from entities.demand import Demand, INTERVAL_DIRECTIONS
+from entities.profiler import PhaseProfiler, format_summary
+from entities.async_controller import AsyncController
+from entities.result_cache import ResultCache
 from model.TrafficMDP import TrafficMDP
+from model.lookup_policy import LookupTablePolicy, DEFAULT_LOOKUP_TABLE
 from entities.colors import TrafficLightColor
 from entities.car_actions import CarActions
 
+FPS = 30                    # simulated ticks per second
+WINDOW_SIZE = (1000, 1000)
+
 class Simulation:
     """
     Defines the simulation of the traffic light.
@@ -16,12 +34,14 @@ class Simulation:
     - audio: bool representing if the audio is enabled
     - simulation_duration: int representing the total duration of the simulation
     - intervals: list of tuples with the duration of each interval
+    - interval_ends: list with the second of the cycle at which each interval ends
     """
     def __init__(self, spawning_rules:list, car_spawn_rate:float = 1, audio:bool = False) -> None:
         self.car_spawn_frequency = car_spawn_rate
         self.car_spwan_policy = spawning_rules
         self.simulation_duration = self._get_total_time(spawning_rules)
         self.intervals = spawning_rules
+        self.interval_ends = list(accumulate(duration for _, duration in spawning_rules))
         self.audio = audio
 
         print(f"Simulation duration: {self.simulation_duration} seconds")
@@ -39,132 +59,395 @@ class Simulation:
         return (sum(duration for _, duration in spawn_policy))
     
 
-    def run(self, mode:str, save_stats:bool = False):
+    def run(
+        self,
+        mode:str,
+        save_stats:bool = False,
+        headless:bool = False,
+        seed:int = None,
+        vectorized:bool = False,
+        output_dir:str = './data',
+        mdp_solver:str = 'loop',
+        lookup_table:str = DEFAULT_LOOKUP_TABLE,
+        dirty_rects:bool = False,
+        render_every:int = 1,
+        render_fps:float = None,
+        render_thread:bool = False,
+        telemetry:bool = False,
+        trajectory:bool = False,
+        demand:Demand = None,
+        profile:bool = False,
+        async_decisions:bool = False,
+        decision_deadline:float = 1.0,
+        fallback_action:str = 'maintain',
+        cache:ResultCache = None,
+        refresh_cache:bool = False,
+    ):
         """
         Run the simulation.
 
+        Time is measured with a simulated clock counted in ticks (FPS ticks = 1 simulated second),
+        so spawning, stoplight updates, MDP decisions and stats sampling do not depend on the wall clock.
+        In headless mode no window is opened and the ticks run as fast as the CPU allows.
+
         Parameters:
-        - mode: str representing the mode of the simulation (pi, vi, ft)
+        - mode: str representing the mode of the simulation (pi, vi, ft, lt)
         - save_stats: bool representing if the stats should be saved
+        - headless: bool representing if the simulation should run without a window
+        - seed: int used to seed the random generator, so that the run can be reproduced
+        - vectorized: bool representing if the cars should be stored in NumPy arrays and updated with one vectorized step
+        - output_dir: str representing the directory where the stats are saved
+        - mdp_solver: str representing the solver of the MDP in the pi and vi modes ('loop' or 'matrix')
+        - lookup_table: str representing the path of the policy used by the lt mode (see model.offline_policy)
+        - dirty_rects: bool representing if only the changed areas of the window should be pushed to the display
+        - render_every: int representing the number of simulated ticks between two drawn frames (the run is paced at FPS frames per second)
+        - render_fps: float representing the target frames per real second, while the simulation runs as fast as it can (overrides render_every)
+        - render_thread: bool representing if the ticks should run on a worker thread, while the frames are drawn from a copy
+          of the state on the calling thread (which must be the main thread on macOS)
+        - telemetry: bool representing if the per-second stats and the events should be streamed to output_dir while the run is in progress (see entities.telemetry)
+        - trajectory: bool representing if the state of the stoplight and of every car should be recorded to output_dir at every tick (see entities.trajectory)
+        - demand: Demand with the arrival schedule of the cars, used instead of the spawning rules and car_spawn_rate (see entities.demand),
+                  restarted at the start of the run;
+                  the spawning rules still set the duration of the run
+        - profile: bool representing if the phases of every tick and the work of the MDP solver should be measured;
+                   the summary is printed at the end of the run, kept in self.profile and saved to output_dir with the stats
+        - async_decisions: bool representing if the pi and vi decisions should be solved on a worker thread while the ticks go on (see entities.async_controller);
+                           the decision metrics are printed at the end of the run, kept in self.decisions and saved to output_dir with the stats
+        - decision_deadline: float representing the simulated seconds to wait for an asynchronous decision before the fallback action (None to always wait)
+        - fallback_action: str representing the action applied when the deadline of a decision expires ('maintain' or 'change')
+        - cache: ResultCache where the stats of the run are looked up and stored (see entities.result_cache); only seeded runs
+                 without demand, telemetry, trajectory, profiling or asynchronous deadlines are cached, and a cached run opens no window
+        - refresh_cache: bool representing if the run should be simulated even when it is cached (its stats replace the cached ones)
+
+        The render settings only change what is shown: the results are the same for every setting.
         """
-        assert mode in ['pi', 'vi', 'ft'], "Mode must be either 'pi', 'vi or 'ft'"
+        assert mode in ['pi', 'vi', 'ft', 'lt'], "Mode must be either 'pi', 'vi', 'ft' or 'lt'"
+
+        # Look up the stats of the run if it is reproducible (the same parameters always give the same stats)
+        cached = cache is not None and seed is not None and demand is None and not (telemetry or trajectory or profile) and not (async_decisions and decision_deadline is not None)
+        if cached:
+            cache_params = self.cache_params(mode, seed, mdp_solver, lookup_table)
+            cache_key = cache.key(cache_params)
+            result = cache.get(cache_key) if not refresh_cache else None
+            if result is not None:
+                self.restore_result(result)
+                # Save the stats if the user wants to
+                self.save_stats(mode, output_dir) if save_stats else None
+                return
+
+        if seed is not None:
+            random.seed(seed)
+
+        # The same Demand can be passed to several runs
+        demand.restart() if demand is not None else None
 
         # Cumulative waiting times will measure the total waiting time of all cars that have stopped at the intersection
         self.cumulative_waiting_times = [0]
         # Stopped cars will store all the cars that have stopped at the intersection
         self.n_stopped_cars = 0
 
-        # Initialize the environment
-        self.environment = Environment(
-            window_size=(1000, 1000),
-            name=f'Simulation with {mode} mode',
-            audio=self.audio
-        )
-
-        self.window = self.environment.get_window()
+        # Initialize the environment (only the window size is needed when running headless)
+        if headless:
+            self.environment = None
+            self.window = HeadlessWindow(WINDOW_SIZE)
+        else:
+            self.environment = Environment(
+                window_size=WINDOW_SIZE,
+                name=f'Simulation with {mode} mode',
+                audio=self.audio,
+                dirty_rects=dirty_rects
+            )
+            self.window = self.environment.get_window()
+            renderer = Renderer(self.environment, FPS, render_every=render_every, render_fps=render_fps, threaded=render_thread)
 
-        self.car_manager = CarManager(self.window)
+        self.car_manager = VectorizedCarManager(self.window) if vectorized else CarManager(self.window)
         self.stoplight_manager = StoplightManager()
 
         if mode == 'pi' or mode == 'vi':
-            mdp = TrafficMDP() 
+            mdp = TrafficMDP(solver=mdp_solver)
+        elif mode == 'lt':
+            # The policy is solved offline, the decisions are table lookups
+            lookup_policy = LookupTablePolicy.load(lookup_table)
+
+        if telemetry:
+            telemetry_writer = TelemetryWriter(output_dir, mode, {
+                'seed': seed,
+                'car_spawn_rate': self.car_spawn_frequency,
+                'spawning_rules': self.car_spwan_policy,
+                'fps': FPS,
+                'vectorized': vectorized,
+            })
+        if trajectory:
+            trajectory_recorder = TrajectoryRecorder(output_dir, mode, {
+                'seed': seed,
+                'car_spawn_rate': self.car_spawn_frequency,
+                'spawning_rules': self.car_spwan_policy,
+                'fps': FPS,
+                'window_size': WINDOW_SIZE,
+            })
+
+        # Solve the decisions on a worker thread, with a deadline in ticks
+        controller = None
+        if async_decisions and mode in ['pi', 'vi']:
+            deadline = max(1, round(decision_deadline * FPS)) if decision_deadline is not None else None
+            controller = AsyncController(mdp, mode, deadline, fallback_action)
+        self.decisions = None
+
+        # Time the phases of the ticks (the checks below are the only cost when disabled)
+        profiler = PhaseProfiler(mdp if mode in ['pi', 'vi'] else None) if profile else None
+        self.profile = None
+
+        def simulate():
+            # Simulated clock: the run ends after 'simulation_duration' seconds worth of ticks
+            total_ticks = self.simulation_duration * FPS
+            spawn_ticks = max(1, round(self.car_spawn_frequency * FPS))
+            tick = 0
+
+            while True:
+                profiler.start() if profile else None
+
+                # Update the stoplight:
+                self.stoplight_manager.update_stoplight()
+
+                # Calculate the elapsed simulated time
+                total_seconds = tick // FPS
+                new_second = tick > 0 and tick % FPS == 0
+
+                # Determine which interval we are in (only used by the spawns without a demand and by the info panel)
+                interval = self.current_interval(total_seconds) if demand is None or not headless else None
+
+                # Stop the simulation after 'simulation_duration' seconds
+                if tick >= total_ticks: 
+                    renderer.close() if not headless else None
+                    telemetry_writer.close() if telemetry else None
+                    trajectory_recorder.close() if trajectory else None
+                    self.report_decisions(controller, mode, output_dir, save_stats) if controller else None
+                    self.report_profile(profiler, mode, output_dir, save_stats) if profile else None
+                    cache.put(cache_key, self.get_result(), cache_params) if cached else None
+                    # Save the stats if the user wants to
+                    self.save_stats(mode, output_dir) if save_stats else None
+                    return
 
-        prev_time = 0
-        clock = pygame.time.Clock()
-        total_seconds = 0
-        start_ticks = pygame.time.get_ticks()  # Get the start ticks
+                profiler.lap('stoplight') if profile else None
+        
+                # Add the cars of the arrival schedule, or a car every car_spawn_frequency seconds
+                if demand is not None:
+                    for direction, turn_right in demand.pop_due(tick):
+                        self.car_manager.add_car(direction=[direction], turn_right=turn_right)
+                elif tick > 0 and tick % spawn_ticks == 0:
+                    self.add_cars_based_on_interval(interval)
 
+                profiler.lap('spawn') if profile else None
 
-        while True:
-            clock.tick(30)
+                # Take the decision of the mode of the simulation (or apply the asynchronous one that has arrived)
+                if controller:
+                    controller.step(tick, self.stoplight_manager.stoplight, self.car_manager.get_stats(), new_second)
+                else:
+                    self.take_decision(mode, new_second, mdp if mode in ['pi', 'vi'] else None, lookup_policy if mode == 'lt' else None)
 
-            # Draw the environment:
-            self.environment.draw()
-            self.stoplight_manager.draw_stoplight(self.window)
+                profiler.decision() if profile else None
 
-            # Update the stoplight:
-            self.stoplight_manager.update_stoplight()
+                # Update the cars
+                self.car_manager.update_cars(self.stoplight_manager.stoplight)
 
-            # Check if the user wants to quit the game:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.environment.close()
-                    # Save the stats if the user wants to
-                    self.save_stats(mode) if save_stats else None
-                    return
+                profiler.lap('cars') if profile else None
 
-            # Calculate the elapsed time
-            current_ticks = pygame.time.get_ticks()
-            elapsed_ticks = current_ticks - start_ticks
-            total_seconds = round(elapsed_ticks / 1000, 1) # Round to 1 decimal place, so that it is possible to spawn cars every tenth of a second.
+                # Update the cumulative waiting times every second
+                if new_second:
+                    self.cumulative_waiting_times.append(self.car_manager.cumulative_waiting_time//FPS) 
 
-            # Determine which interval we are in
-            interval = self.determine_current_interval(int(total_seconds), self.intervals)
+                # Update the stopped cars
+                self.n_stopped_cars = self.car_manager.get_n_stopped_cars()   
 
-            # Stop the simulation after 'simulation_duration' seconds
-            if total_seconds >= self.simulation_duration: 
-                self.environment.close()
-                # Save the stats if the user wants to
-                self.save_stats(mode) if save_stats else None
-                return
-        
-            # Add a car every car_spawn_frequency seconds
-            if total_seconds % self.car_spawn_frequency == 0 and total_seconds != prev_time:
-                self.add_cars_based_on_interval(interval)
-
-            # Define the mode of the simulation
-            match mode:
-                # Case Policy Iteration
-                case 'pi':
-                    # If the stoplight has been green for 5 seconds, call the policy iteration algorithm
-                    if self.stoplight_manager.stoplight.time_green//30 >= 15 and int(total_seconds) != int(prev_time):
-                        # Define the state as NS if the stoplight ns is green, otherwise EW
-                        state = 'NS' if self.stoplight_manager.get_ns_color() == TrafficLightColor.GREEN.value else 'EW'
-                        # Get the action from the policy iteration algorithm
-                        mdp.policy_iteration(self.car_manager.get_cars())
-                        action = mdp.get_action(state)
-                        # Switch the stoplight to yellow if the action is 'change'
-                        self.stoplight_manager.stoplight.switch_yellow() if action == 'change' else None
-                # Case Value Iteration
-                case 'vi':
-                    # If the stoplight has been green for 5 seconds, call the value iteration algorithm
-                    if self.stoplight_manager.stoplight.time_green//30 >= 15 and int(total_seconds) != int(prev_time):
-                        # Define the state as NS if the stoplight ns is green, otherwise EW
-                        state = 'NS' if self.stoplight_manager.get_ns_color() == TrafficLightColor.GREEN.value else 'EW'
-                        # Get the action from the policy iteration algorithm
-                        action = mdp.value_iteration(self.car_manager.get_cars(), state)
-                        # Switch the stoplight to yellow if the action is 'change'
-                        self.stoplight_manager.stoplight.switch_yellow() if action == 'change' else None
-                # Case Fixed Time
-                case 'ft':
-                    # Switch the stoplight to yellow if the stoplight has been green for 7 seconds
-                    self.stoplight_manager.stoplight.switch_yellow() if self.stoplight_manager.stoplight.time_green//30 >= 20 else None
-                # Default case
-                case _:
-                    raise ValueError(f"Mode: {mode} not yet implemented")
-
-            # Update the cars
-            self.car_manager.update_cars(self.stoplight_manager.stoplight)
-
-            # Update the cumulative waiting times every second
-            if int(total_seconds) != int(prev_time):
-                self.cumulative_waiting_times.append(self.car_manager.cumulative_waiting_time//30) 
-
-            # Update the previous time (to check if a second has passed)
-            prev_time = total_seconds
-
-            # Update the stopped cars
-            self.n_stopped_cars = self.car_manager.get_n_stopped_cars()   
-
-            # Draw the cars and the info panel
-            self.environment.draw_cars(self.car_manager)
-            self.environment.draw_info_panel(
-                int(total_seconds), 
-                interval, 
-                self.cumulative_waiting_times[-1],
-                mode
-            )
-            self.environment.update()
+                profiler.lap('stats') if profile else None
+
+                # Stream the events of the tick, and the stats of the intersection every second
+                if telemetry:
+                    telemetry_writer.record_tick(tick, self.stoplight_manager.stoplight, self.car_manager)
+                    if tick == 0 or new_second:
+                        telemetry_writer.record_second(total_seconds, self.stoplight_manager.stoplight, self.car_manager, self.cumulative_waiting_times[-1])
+
+                # Record the state of the tick
+                trajectory_recorder.record(self.stoplight_manager.stoplight, self.car_manager) if trajectory else None
+
+                profiler.lap('recording') if profile and (telemetry or trajectory) else None
+
+                if not headless and renderer.should_render(tick):
+                    # Check if the user wants to quit the game:
+                    if renderer.quit_requested():
+                        renderer.close()
+                        telemetry_writer.close() if telemetry else None
+                        trajectory_recorder.close() if trajectory else None
+                        self.report_decisions(controller, mode, output_dir, save_stats) if controller else None
+                        self.report_profile(profiler, mode, output_dir, save_stats) if profile else None
+                        # Save the stats if the user wants to
+                        self.save_stats(mode, output_dir) if save_stats else None
+                        return
+
+                    profiler.lap('events') if profile else None
+
+                    # Draw the environment, the stoplight, the cars and the info panel
+                    renderer.render(self.stoplight_manager, self.car_manager, (total_seconds, interval, self.cumulative_waiting_times[-1], mode))
+
+                    profiler.lap('render', renderer.waited_ns) if profile else None
+
+                # Advance the simulated clock
+                tick += 1
+
+        # With a render thread, the ticks run on a worker thread and the frames are drawn on this one
+        renderer.run(simulate) if not headless else simulate()
+
+    def cache_params(self, mode:str, seed:int, mdp_solver:str, lookup_table:str) -> dict:
+        """
+        Get the parameters that determine the stats of a run, used as the key of the result cache.
+
+        Parameters:
+        - mode: str representing the mode of the simulation
+        - seed: int used to seed the random generator
+        - mdp_solver: str representing the solver of the MDP in the pi and vi modes
+        - lookup_table: str representing the path of the policy used by the lt mode
+
+        Returns:
+        - dict with the parameters (the controller parameters only for the modes that use them)
+        """
+        params = {
+            'mode': mode,
+            'seed': seed,
+            'car_spawn_rate': self.car_spawn_frequency,
+            'spawning_rules': [list(rule) for rule in self.car_spwan_policy],
+            'fps': FPS,
+            'window_size': list(WINDOW_SIZE),
+            'yellow_duration': Stoplight.YELLOW_DURATION,
+            'min_green_duration': Stoplight.MIN_GREEN_DURATION,
+            'fixed_green_duration': Stoplight.FIXED_GREEN_DURATION,
+        }
+        if mode in ['pi', 'vi']:
+            mdp = TrafficMDP(solver=mdp_solver)
+            params.update(mdp_solver=mdp_solver, discount_factor=mdp.discount_factor, theta=mdp.theta)
+        elif mode == 'lt':
+            with open(lookup_table, 'rb') as f:
+                params['lookup_table'] = hashlib.sha256(f.read()).hexdigest()
+        return params
+
+    def get_result(self) -> dict:
+        """
+        Get the stats of the last run, as stored in the result cache.
+
+        Returns:
+        - dict with the cumulative waiting times, the number of stopped cars and the queue lengths
+        """
+        return {
+            'cumulative_waiting_times': self.cumulative_waiting_times,
+            'n_stopped_cars': self.n_stopped_cars,
+            'queues': self.car_manager.queues,
+        }
+
+    def restore_result(self, result:dict) -> None:
+        """
+        Restore the stats of a cached run, as if it had just been simulated.
+
+        Parameters:
+        - result: dict returned by get_result
+        """
+        self.environment = None
+        self.window = HeadlessWindow(WINDOW_SIZE)
+        self.car_manager = CarManager(self.window)
+        self.car_manager.queues = result['queues']
+        self.car_manager.n_stopped_cars = result['n_stopped_cars']
+        self.cumulative_waiting_times = result['cumulative_waiting_times']
+        self.n_stopped_cars = result['n_stopped_cars']
+        self.profile = None
+        self.decisions = None
+
+    def report_profile(self, profiler:PhaseProfiler, mode:str, output_dir:str = './data', save:bool = False) -> None:
+        """
+        Print the summary of the profiled run, keep it in self.profile and save it if the stats are saved.
+
+        Parameters:
+        - profiler: PhaseProfiler of the run
+        - mode: str representing the mode of the simulation
+        - output_dir: str representing the directory where the stats are saved
+        - save: bool representing if the summary should be saved to output_dir
+        """
+        self.profile = profiler.summary()
+        print(format_summary(self.profile))
+        if save:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, f'profile_{mode}.json'), 'w') as f:
+                json.dump(self.profile, f, indent=2)
+
+    def report_decisions(self, controller:AsyncController, mode:str, output_dir:str = './data', save:bool = False) -> None:
+        """
+        Stop the worker of the asynchronous controller, print its decision metrics, keep them in self.decisions and save them if the stats are saved.
+
+        Parameters:
+        - controller: AsyncController of the run
+        - mode: str representing the mode of the simulation
+        - output_dir: str representing the directory where the stats are saved
+        - save: bool representing if the metrics should be saved to output_dir
+        """
+        controller.close()
+        self.decisions = controller.summary()
+        print(', '.join(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}' for key, value in self.decisions.items()))
+        if save:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, f'decisions_{mode}.json'), 'w') as f:
+                json.dump(self.decisions, f, indent=2)
+
+    def take_decision(self, mode:str, new_second:bool, mdp:TrafficMDP = None, lookup_policy:LookupTablePolicy = None) -> None:
+        """
+        Take the decision of the stoplight controller for the current tick, switching the stoplight to yellow if needed.
+
+        Parameters:
+        - mode: str representing the mode of the simulation (pi, vi, ft, lt)
+        - new_second: bool representing if the current tick starts a new simulated second
+        - mdp: TrafficMDP used by the pi and vi modes
+        - lookup_policy: LookupTablePolicy used by the lt mode
+        """
+        match mode:
+            # Case Policy Iteration
+            case 'pi':
+                # If the stoplight has been green for 15 seconds, call the policy iteration algorithm once per second
+                if self.stoplight_manager.stoplight.time_green//FPS >= Stoplight.MIN_GREEN_DURATION and new_second:
+                    # Define the state as NS if the stoplight ns is green, otherwise EW
+                    state = 'NS' if self.stoplight_manager.get_ns_color() == TrafficLightColor.GREEN.value else 'EW'
+                    # Get the action from the policy iteration algorithm
+                    mdp.policy_iteration(self.car_manager.get_stats())
+                    action = mdp.get_action(state)
+                    # Switch the stoplight to yellow if the action is 'change'
+                    self.stoplight_manager.stoplight.switch_yellow() if action == 'change' else None
+            # Case Value Iteration
+            case 'vi':
+                # If the stoplight has been green for 15 seconds, call the value iteration algorithm once per second
+                if self.stoplight_manager.stoplight.time_green//FPS >= Stoplight.MIN_GREEN_DURATION and new_second:
+                    # Define the state as NS if the stoplight ns is green, otherwise EW
+                    state = 'NS' if self.stoplight_manager.get_ns_color() == TrafficLightColor.GREEN.value else 'EW'
+                    # Get the action from the policy iteration algorithm
+                    action = mdp.value_iteration(self.car_manager.get_stats(), state)
+                    # Switch the stoplight to yellow if the action is 'change'
+                    self.stoplight_manager.stoplight.switch_yellow() if action == 'change' else None
+            # Case Lookup Table
+            case 'lt':
+                # While a direction is green, look up the action of the current discretized state at every tick
+                stoplight = self.stoplight_manager.stoplight
+                if TrafficLightColor.GREEN.value in (stoplight.color_NS, stoplight.color_EW):
+                    state = 'NS' if stoplight.color_NS == TrafficLightColor.GREEN.value else 'EW'
+                    red_directions = [CarActions.LEFT, CarActions.RIGHT] if state == 'NS' else [CarActions.UP, CarActions.DOWN]
+                    stats = self.car_manager.get_stats()
+                    action = lookup_policy.get_action(
+                        state,
+                        [stats.n_stopped[direction] for direction in [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT]],
+                        stoplight.time_green // FPS,
+                        self.car_manager.get_max_waiting_time(red_directions) // FPS
+                    )
+                    stoplight.switch_yellow() if action == 'change' else None
+            # Case Fixed Time
+            case 'ft':
+                # Switch the stoplight to yellow if the stoplight has been green for 20 seconds
+                self.stoplight_manager.stoplight.switch_yellow() if self.stoplight_manager.stoplight.time_green//FPS >= Stoplight.FIXED_GREEN_DURATION else None
+            # Default case
+            case _:
+                raise ValueError(f"Mode: {mode} not yet implemented")
 
     def calculate_intervals(self, total_time:int, proportions:list) -> list:
         """
@@ -181,7 +464,8 @@ class Simulation:
         intervals = [(name, int((proportion / total_proportion) * total_time)) for name, proportion in proportions]
         return intervals
 
-    def determine_current_interval(self, total_seconds:int, intervals:list):
+    @staticmethod
+    def determine_current_interval(total_seconds:int, intervals:list):
         """
         Determine the current interval based on the total seconds and the intervals defined.
 
@@ -203,6 +487,19 @@ class Simulation:
                 return interval
         return None
 
+    def current_interval(self, total_seconds:int) -> str:
+        """
+        Determine the current interval with a binary search on the precomputed interval ends
+        (same result as determine_current_interval).
+
+        Parameters:
+        - total_seconds: int representing the total seconds of the simulation
+
+        Returns:
+        - str: the name of the current interval
+        """
+        return self.intervals[bisect.bisect_right(self.interval_ends, total_seconds % self.interval_ends[-1])][0]
+
     def add_cars_based_on_interval(self, interval:str) -> None:
         """
         Add cars based on the interval defined.
@@ -213,14 +510,9 @@ class Simulation:
         Returns:
         - None
         """
-        if interval == 'up_down':
-            self.car_manager.add_car(direction=[CarActions.UP, CarActions.DOWN])
-        elif interval == 'left_right':
-            self.car_manager.add_car(direction=[CarActions.LEFT, CarActions.RIGHT])
-        elif interval == 'all_directions':
-            self.car_manager.add_car()
-        else:
-            return
+        directions = INTERVAL_DIRECTIONS.get(interval)
+        if directions:
+            self.car_manager.add_car(direction=directions)
 
     def to_disk(self, data, path:str):
         """
@@ -237,15 +529,17 @@ class Simulation:
             else:
                 f.write(str(data))
 
-    def save_stats(self, mode:str):
+    def save_stats(self, mode:str, output_dir:str = './data'):
         """
         Save the stats of the simulation to disk.
 
         Parameters:
         - mode: str representing the mode of the simulation
+        - output_dir: str representing the directory where the stats are saved
         """
-        self.to_disk(self.cumulative_waiting_times, f'./data/cumulative_waiting_times_{mode}.csv')
-        self.to_disk(self.n_stopped_cars, f'./data/stopped_cars_{mode}.csv')
-        self.to_disk(self.car_manager.queues, f'./data/queue_lengths_{mode}.csv')
+        os.makedirs(output_dir, exist_ok=True)
+        self.to_disk(self.cumulative_waiting_times, os.path.join(output_dir, f'cumulative_waiting_times_{mode}.csv'))
+        self.to_disk(self.n_stopped_cars, os.path.join(output_dir, f'stopped_cars_{mode}.csv'))
+        self.to_disk(self.car_manager.queues, os.path.join(output_dir, f'queue_lengths_{mode}.csv'))
         
 
@@ -15,18 +15,44 @@ class Stoplight:
 
     Constants:
     - YELLOW_DURATION: duration of the yellow light in ticks
+    - MIN_GREEN_DURATION: seconds of green before the pi and vi controllers take a decision
+    - FIXED_GREEN_DURATION: seconds of green of the fixed time controller
     """
     YELLOW_DURATION = 90  # ticks
+    MIN_GREEN_DURATION = 15  # seconds
+    FIXED_GREEN_DURATION = 20  # seconds
 
-    def __init__(self):
+    def __init__(self, rng:random.Random = None):
+        rng = rng if rng is not None else random
         # generate random color for north-south direction:
-        self.color_NS = TrafficLightColor.GREEN.value if random.choice([True, False]) else TrafficLightColor.RED.value
+        self.color_NS = TrafficLightColor.GREEN.value if rng.choice([True, False]) else TrafficLightColor.RED.value
         # set the opposite color for east-west direction:
         self.color_EW = TrafficLightColor.RED.value if self.color_NS == TrafficLightColor.GREEN.value else TrafficLightColor.GREEN.value
 
         self.time_yellow = 0
         self.time_green = 0
 
+    @classmethod
+    def from_state(cls, color_NS:tuple, color_EW:tuple, time_green:int = 0, time_yellow:int = 0):
+        """
+        Build a stoplight from an existing state, without drawing the random initial color.
+
+        Parameters:
+        - color_NS: color of the north-south direction
+        - color_EW: color of the east-west direction
+        - time_green: time that the stoplight has been green
+        - time_yellow: time that the stoplight has been yellow
+
+        Returns:
+        - Stoplight with the given state
+        """
+        stoplight = cls.__new__(cls)
+        stoplight.color_NS = color_NS
+        stoplight.color_EW = color_EW
+        stoplight.time_green = time_green
+        stoplight.time_yellow = time_yellow
+        return stoplight
+
     def get_ns_color(self):
         return self.color_NS
     
@@ -5,24 +5,32 @@ from entities.colors import TrafficLightColor
 class StoplightManager:
     """
     Manages the stoplight in the simulation.
+
+    Attributes:
+    - stoplight: Stoplight object (a new one with a random initial color if not given)
     """
-    def __init__(self):
-        self.stoplight = Stoplight()
+    def __init__(self, stoplight:Stoplight = None):
+        self.stoplight = stoplight if stoplight else Stoplight()
 
     def update_stoplight(self):
         self.stoplight.update_stoplight()
 
-    def draw_stoplight(self, window):
+    def draw_stoplight(self, window) -> list:
         """
         Draw the stoplight in the window.
 
         Parameters:
         - window (pygame.Surface): The window where the stoplight will be drawn.
+
+        Returns:
+        - list: bounding rectangles of the lines drawn
         """
-        pygame.draw.line(window, self.stoplight.color_NS, (window.get_width() // 2 - 27, window.get_height() // 2 - 32), (window.get_width() // 2 - 2, window.get_height() // 2 - 32), 5)
-        pygame.draw.line(window, self.stoplight.color_NS, (window.get_width() // 2 + 3, window.get_height() // 2 + 33), (window.get_width() // 2 + 27, window.get_height() // 2 + 33), 5)
-        pygame.draw.line(window, self.stoplight.color_EW, (window.get_width() // 2 - 32, window.get_height() // 2 + 3), (window.get_width() // 2 - 32, window.get_height() // 2 + 27), 5)
-        pygame.draw.line(window, self.stoplight.color_EW, (window.get_width() // 2 + 33, window.get_height() // 2 - 27), (window.get_width() // 2 + 33, window.get_height() // 2 - 2), 5)
+        return [
+            pygame.draw.line(window, self.stoplight.color_NS, (window.get_width() // 2 - 27, window.get_height() // 2 - 32), (window.get_width() // 2 - 2, window.get_height() // 2 - 32), 5),
+            pygame.draw.line(window, self.stoplight.color_NS, (window.get_width() // 2 + 3, window.get_height() // 2 + 33), (window.get_width() // 2 + 27, window.get_height() // 2 + 33), 5),
+            pygame.draw.line(window, self.stoplight.color_EW, (window.get_width() // 2 - 32, window.get_height() // 2 + 3), (window.get_width() // 2 - 32, window.get_height() // 2 + 27), 5),
+            pygame.draw.line(window, self.stoplight.color_EW, (window.get_width() // 2 + 33, window.get_height() // 2 - 27), (window.get_width() // 2 + 33, window.get_height() // 2 - 2), 5),
+        ]
 
     def get_ns_color(self) -> TrafficLightColor:
         return self.stoplight.get_ns_color()
@@ -0,0 +1,262 @@
+'''
+Binary telemetry streams, written while the simulation runs.
+
+Each stream is a file made of a header followed by fixed-size records:
+- 4 bytes: MAGIC
+- 4 bytes: little-endian uint32 with the length of the JSON header (padded with spaces to a multiple of 8 bytes)
+- the JSON header, with the numpy dtype of the records ('dtype') and the description of the run ('metadata')
+- the records, appended in chunks
+
+A stream can be loaded back with a single bulk read (see load_stream). If the run crashed, the stream holds
+every chunk written before the crash (a partially written record at the end is ignored). TelemetryWriter
+also writes its buffers every flush_every simulated seconds, so a crash loses at most that much of the run.
+'''
+
+import os
+import json
+import struct
+import numpy as np
+from entities.colors import TrafficLightColor
+from entities.car_actions import CarActions
+
+MAGIC = b'TLM1'
+
+# Color codes of the stoplight (same codes as BatchedStoplights)
+COLOR_CODES = {
+    TrafficLightColor.GREEN.value: 0,
+    TrafficLightColor.YELLOW.value: 1,
+    TrafficLightColor.RED.value: 2,
+}
+
+DIRECTIONS = [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT]
+
+# Sampled every simulated second (and at tick 0)
+SECOND_DTYPE = np.dtype([
+    ('second', '<i4'),
+    ('cumulative_waiting_time', '<i8'),     # seconds
+    ('n_stopped_cars', '<i8'),
+    ('n_cars', '<i4'),
+    ('queue_up', '<i2'),
+    ('queue_down', '<i2'),
+    ('queue_left', '<i2'),
+    ('queue_right', '<i2'),
+    ('color_NS', 'i1'),
+    ('color_EW', 'i1'),
+])
+
+# Kinds of events
+QUEUE_RELEASED, NS_COLOR_CHANGED, EW_COLOR_CHANGED = range(3)
+
+# Written when they happen: a queue was released (value = queue length) or a light changed (value = color code)
+EVENT_DTYPE = np.dtype([
+    ('tick', '<i8'),
+    ('kind', 'i1'),
+    ('value', '<i4'),
+])
+
+class StreamWriter:
+    """
+    Appends fixed-size records to a binary stream, buffered in chunks.
+
+    Attributes:
+    - path: str representing the path of the stream
+    - dtype: numpy dtype of the records
+    - chunk_size: int representing the number of records buffered before they are written
+    """
+    def __init__(self, path:str, dtype:np.dtype, metadata:dict, chunk_size:int = 1024):
+        assert chunk_size > 0, "Chunk size must be greater than 0"
+        self.path = path
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+
+        self._buffer = np.zeros(chunk_size, dtype=dtype)
+        self._n_buffered = 0
+
+        header = json.dumps({'dtype': dtype.descr, 'metadata': metadata}).encode()
+        header += b' ' * (-len(header) % 8)
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._file.flush()
+
+    def append(self, *values) -> None:
+        """
+        Append a record, given the values of its fields in order.
+        """
+        self._buffer[self._n_buffered] = values
+        self._n_buffered += 1
+        if self._n_buffered == self.chunk_size:
+            self.flush()
+
+    def reserve(self, n:int) -> np.ndarray:
+        """
+        Append n records, to be filled in place by the caller before the next call.
+
+        Parameters:
+        - n: int representing the number of records
+
+        Returns:
+        - numpy structured array with the n records, a view of the buffer
+        """
+        if self._n_buffered + n > len(self._buffer):
+            self.flush()
+            if n > len(self._buffer):
+                self._buffer = np.zeros(n, dtype=self.dtype)
+        records = self._buffer[self._n_buffered:self._n_buffered + n]
+        self._n_buffered += n
+        return records
+
+    def write_raw(self, data:bytes) -> None:
+        """
+        Append records already packed in the byte layout of the dtype, after the buffered ones.
+
+        Parameters:
+        - data: bytes with the records (a multiple of the itemsize of the dtype)
+        """
+        if self._n_buffered:
+            self.flush()
+        self._file.write(data)
+
+    def flush(self) -> None:
+        """
+        Write the buffered records to disk.
+        """
+        if self._n_buffered:
+            self._buffer[:self._n_buffered].tofile(self._file)
+            self._n_buffered = 0
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+class TelemetryWriter:
+    """
+    Streams the per-second stats and the events of a run to disk while it is in progress.
+
+    Two streams are written in the output directory: telemetry_{mode}_seconds.bin (SECOND_DTYPE records)
+    and telemetry_{mode}_events.bin (EVENT_DTYPE records). Both headers describe the run.
+
+    The buffers are written when a chunk is full, and at least every flush_every simulated seconds.
+
+    Attributes:
+    - seconds: StreamWriter of the per-second records
+    - events: StreamWriter of the events
+    - flush_every: int representing the number of simulated seconds between two writes of the buffers
+    """
+    def __init__(self, output_dir:str, mode:str, metadata:dict, chunk_size:int = 1024, flush_every:int = 30):
+        assert flush_every > 0, "Flush interval must be greater than 0"
+        self.flush_every = flush_every
+        os.makedirs(output_dir, exist_ok=True)
+        metadata = {'mode': mode, **metadata}
+        self.seconds = StreamWriter(os.path.join(output_dir, f'telemetry_{mode}_seconds.bin'), SECOND_DTYPE, metadata, chunk_size)
+        self.events = StreamWriter(os.path.join(output_dir, f'telemetry_{mode}_events.bin'), EVENT_DTYPE, metadata, chunk_size)
+
+        self._n_queues = 0
+        self._colors = None
+
+    def record_tick(self, tick:int, stoplight, car_manager) -> None:
+        """
+        Record the events that happened during a tick.
+
+        Parameters:
+        - tick: int representing the simulated tick
+        - stoplight: Stoplight object
+        - car_manager: CarManager or VectorizedCarManager object
+        """
+        # New queue lengths stored by the car manager
+        queues = car_manager.queues
+        for queue_length in queues[self._n_queues:]:
+            self.events.append(tick, QUEUE_RELEASED, queue_length)
+        self._n_queues = len(queues)
+
+        colors = (COLOR_CODES[stoplight.color_NS], COLOR_CODES[stoplight.color_EW])
+        if self._colors is None or colors[0] != self._colors[0]:
+            self.events.append(tick, NS_COLOR_CHANGED, colors[0])
+        if self._colors is None or colors[1] != self._colors[1]:
+            self.events.append(tick, EW_COLOR_CHANGED, colors[1])
+        self._colors = colors
+
+    def record_second(self, second:int, stoplight, car_manager, cumulative_waiting_time:int) -> None:
+        """
+        Record the stats of the intersection at a simulated second.
+
+        Parameters:
+        - second: int representing the simulated second
+        - stoplight: Stoplight object
+        - car_manager: CarManager or VectorizedCarManager object
+        - cumulative_waiting_time: int representing the cumulative waiting time, in seconds
+        """
+        stats = car_manager.get_stats()
+        # The vectorized car manager counts its cars, without building them
+        n_cars = car_manager.n_cars if hasattr(car_manager, 'n_cars') else len(car_manager.get_cars())
+        self.seconds.append(
+            second,
+            cumulative_waiting_time,
+            car_manager.get_n_stopped_cars(),
+            n_cars,
+            *(stats.n_stopped[direction] for direction in DIRECTIONS),
+            COLOR_CODES[stoplight.color_NS],
+            COLOR_CODES[stoplight.color_EW]
+        )
+        if second > 0 and second % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered records of both streams to disk.
+        """
+        self.seconds.flush()
+        self.events.flush()
+
+    def close(self) -> None:
+        self.seconds.close()
+        self.events.close()
+
+def _read_header(path:str) -> tuple:
+    """
+    Read the header of a telemetry stream.
+
+    Returns:
+    - header: dict with the dtype of the records and the metadata of the run
+    - offset: int representing the position of the first record in the file
+    """
+    with open(path, 'rb') as f:
+        assert f.read(4) == MAGIC, f"{path} is not a telemetry stream"
+        header_length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length))
+    return header, 8 + header_length
+
+def load_stream(path:str) -> tuple:
+    """
+    Load a telemetry stream with a single bulk read.
+
+    Parameters:
+    - path: str representing the path of the stream
+
+    Returns:
+    - metadata: dict describing the run
+    - records: numpy structured array with the records
+    """
+    header, offset = _read_header(path)
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    return header['metadata'], np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+def open_stream(path:str) -> tuple:
+    """
+    Open a telemetry stream with memory mapping: the records are only read from disk when they are accessed.
+
+    Parameters:
+    - path: str representing the path of the stream
+
+    Returns:
+    - metadata: dict describing the run
+    - records: read-only numpy memmap with the records (an empty array if the stream has no records)
+    """
+    header, offset = _read_header(path)
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return header['metadata'], np.zeros(0, dtype=dtype)
+    return header['metadata'], np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
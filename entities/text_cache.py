@@ -0,0 +1,77 @@
+import pygame
+from collections import OrderedDict
+
+class TextCache:
+    """
+    Cache of the fonts and of the rendered text surfaces, shared by everything that draws text.
+
+    Fonts are created once per size. Rendered (and rotated) surfaces are kept in a bounded LRU keyed by
+    (text, size, rotation, color), so a label is only rendered again when its value changes.
+
+    Attributes:
+    - max_size: int representing the maximum number of surfaces kept in the cache
+    - fonts: dict with the fonts, keyed by (size, system)
+    - surfaces: OrderedDict with the rendered surfaces, from the least to the most recently used
+    """
+    def __init__(self, max_size:int = 1024):
+        assert max_size > 0, "Cache size must be greater than 0"
+        self.max_size = max_size
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+
+    def get_font(self, size:int, system:bool = False) -> pygame.font.Font:
+        """
+        Get the default font of the given size, creating it the first time.
+
+        Parameters:
+        - size: int representing the size of the font
+        - system: bool representing if the font should be loaded with pygame.font.SysFont
+
+        Returns:
+        - pygame font
+        """
+        key = (size, system)
+        if key not in self.fonts:
+            self.fonts[key] = pygame.font.SysFont(None, size) if system else pygame.font.Font(None, size)
+        return self.fonts[key]
+
+    def render(self, text:str, size:int, color:tuple = (255, 255, 255), rotation:int = 0, system:bool = False) -> pygame.Surface:
+        """
+        Get the surface of a text, rendering it only if it is not in the cache.
+
+        Parameters:
+        - text: str to render
+        - size: int representing the size of the font
+        - color: tuple representing the RGB color of the text
+        - rotation: int representing the rotation of the text, in degrees
+        - system: bool representing if the font should be loaded with pygame.font.SysFont
+
+        Returns:
+        - pygame surface with the rendered text (shared, it must not be modified)
+        """
+        key = (text, size, rotation, color, system)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+
+        surface = self.get_font(size, system).render(text, True, color)
+        if rotation:
+            surface = pygame.transform.rotate(surface, rotation)
+
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self) -> None:
+        """
+        Drop the fonts and the surfaces (the fonts are no longer valid once pygame has quit).
+        """
+        self.fonts.clear()
+        self.surfaces.clear()
+
+_text_cache = TextCache()
+
+def get_text_cache() -> TextCache:
+    return _text_cache
@@ -0,0 +1,308 @@
+'''
+Recording of the full state of a run, at every tick.
+
+A recording is made of three telemetry streams (see entities.telemetry), written in the output directory:
+- trajectory_{mode}_ticks.bin: one TICK_DTYPE record per tick (row t is tick t), with the stoplight state, the keyframe
+  the cars of the tick are rebuilt from and the position of the changes of the tick in the changes stream
+- trajectory_{mode}_cars.bin: the keyframes, one CAR_DTYPE record per car of the keyframe tick, in spawn order
+- trajectory_{mode}_changes.bin: one CHANGE_DTYPE record per car whose state changed by more than a straight move or
+  a tick of waiting (spawned, stopped, released, turned or exited) at a tick between two keyframes
+
+Between two keyframes, a moving car moves by Car.SPEED in its direction and a stopped car waits one more tick, unless
+it has a change record with its new state. The streams are opened with memory mapping (see Trajectory), so any range
+of ticks is read from the keyframe before it, without loading the whole run.
+'''
+
+import os
+import struct
+import numpy as np
+from entities.telemetry import StreamWriter, open_stream, COLOR_CODES
+from entities.vectorized_car_manager import VectorizedCarManager, DIRECTIONS, DX, DY
+
+# Direction codes of the cars (indices into DIRECTIONS, as in VectorizedCarManager)
+DIRECTION_CODES = {direction: d for d, direction in enumerate(DIRECTIONS)}
+
+TICK_DTYPE = np.dtype([
+    ('keyframe', '<i8'),                    # tick of the keyframe the cars of the tick are rebuilt from
+    ('first_car', '<i8'),                   # index of the first car of the keyframe in the cars stream
+    ('n_cars', '<i4'),
+    ('first_change', '<i8'),                # index of the first change of the tick in the changes stream
+    ('n_changes', '<i4'),
+    ('color_NS', 'i1'),                     # color codes, see telemetry.COLOR_CODES
+    ('color_EW', 'i1'),
+    ('time_green', '<i4'),                  # ticks
+    ('time_yellow', '<i4'),                 # ticks
+    ('cumulative_waiting_time', '<i8'),     # ticks
+])
+
+CAR_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('direction', 'i1'),                    # index into DIRECTIONS
+    ('stopped', '?'),
+    ('turn_right', '?'),
+    ('waiting_time', '<i4'),                # ticks
+    ('color', 'u1', (3,)),
+])
+
+# State of the car at the end of the tick, and if it left the window at the tick
+CHANGE_DTYPE = np.dtype(CAR_DTYPE.descr + [('exited', '?')])
+
+# Byte layouts of the records, to pack them without going through numpy (one tick record and the Car objects)
+TICK_STRUCT = struct.Struct('<qqiqibbiiq')
+CAR_STRUCT = struct.Struct('<ihhb??i3B')
+CHANGE_STRUCT = struct.Struct('<ihhb??i3B?')
+assert TICK_STRUCT.size == TICK_DTYPE.itemsize and CAR_STRUCT.size == CAR_DTYPE.itemsize and CHANGE_STRUCT.size == CHANGE_DTYPE.itemsize
+
+# Number of tick records packed in memory before they are written to the ticks stream
+TICK_BATCH = 1024
+
+def _paths(output_dir:str, mode:str) -> tuple:
+    return tuple(os.path.join(output_dir, f'trajectory_{mode}_{stream}.bin') for stream in ['ticks', 'cars', 'changes'])
+
+class TrajectoryRecorder:
+    """
+    Appends the state of the stoplight and of the cars to the trajectory streams, once per tick.
+
+    With a CarManager, the cars are written as a keyframe every keyframe_interval ticks, and in between only the
+    cars that the car manager reports as changed (see CarManager.track_changes) are packed, so recording costs a
+    tick record and a few change records per tick instead of one record per car (about 2 us per tick at spawn
+    rate 1, 2% of the tick). The tick records are written by batches of TICK_BATCH. With a VectorizedCarManager,
+    every tick is a keyframe, copied from its arrays one column at a time.
+
+    Attributes:
+    - ticks: StreamWriter of the tick records
+    - cars: StreamWriter of the keyframe car records
+    - changes: StreamWriter of the change records
+    - keyframe_interval: int representing the number of ticks between two keyframes of a CarManager
+    - n_ticks: int representing the number of ticks recorded so far
+    - n_records: int representing the number of keyframe car records written so far
+    - n_changes: int representing the number of change records written so far
+    - keyframe: int representing the tick of the last keyframe
+    - keyframe_first_car: int representing the index of the first car of the last keyframe
+    - tracked: CarManager whose changes are tracked (None until the first tick of a CarManager)
+    - changed: dict with the cars changed since the last tick, shared with the tracked car manager
+    - pending: bytearray with the tick records not written yet
+    """
+    def __init__(self, output_dir:str, mode:str, metadata:dict, chunk_size:int = 65536, keyframe_interval:int = 300):
+        os.makedirs(output_dir, exist_ok=True)
+        metadata = {'mode': mode, **metadata}
+        ticks_path, cars_path, changes_path = _paths(output_dir, mode)
+        self.ticks = StreamWriter(ticks_path, TICK_DTYPE, metadata, chunk_size)
+        self.cars = StreamWriter(cars_path, CAR_DTYPE, metadata, chunk_size)
+        self.changes = StreamWriter(changes_path, CHANGE_DTYPE, metadata, chunk_size)
+        self.keyframe_interval = keyframe_interval
+        self.n_ticks = 0
+        self.n_records = 0
+        self.n_changes = 0
+        self.keyframe = 0
+        self.keyframe_first_car = 0
+        self.tracked = None
+        self.changed = None
+        self.pending = bytearray()
+
+    def record(self, stoplight, car_manager) -> None:
+        """
+        Record the state at the end of the current tick.
+
+        Parameters:
+        - stoplight: Stoplight object
+        - car_manager: CarManager or VectorizedCarManager object
+        """
+        n_changes = 0
+        if car_manager is self.tracked and self.n_ticks - self.keyframe < self.keyframe_interval:
+            # Between two keyframes of a CarManager: only the cars that changed
+            n = len(car_manager.cars)
+            changed = self.changed
+            if changed:
+                n_changes = len(changed)
+                pack = CHANGE_STRUCT.pack
+                self.changes.write_raw(b''.join([
+                    pack(car.id, car.x, car.y, DIRECTION_CODES[car.direction], car.isStopped, car.turn_right, car.waiting_time,
+                         car.color[0], car.color[1], car.color[2], car.is_out_of_window())
+                    for car in changed
+                ]))
+                changed.clear()
+        elif isinstance(car_manager, VectorizedCarManager):
+            n = car_manager.n_cars
+            self._keyframe(n)
+            records = self.cars.reserve(n)
+            for name in CAR_DTYPE.names:
+                records[name] = getattr(car_manager, name)[:n]
+        else:
+            cars = car_manager.get_cars()
+            n = len(cars)
+            if car_manager is not self.tracked:
+                self.tracked = car_manager
+                self.changed = car_manager.track_changes()
+            self.changed.clear()
+            self._keyframe(n)
+            # Direction code of each car, from the lanes of the car manager (hashing the cars is cheaper than hashing the directions)
+            codes = {car: d for d, direction in enumerate(DIRECTIONS) for car in car_manager.lanes[direction]}
+            pack = CAR_STRUCT.pack
+            self.cars.write_raw(b''.join([
+                pack(car.id, car.x, car.y, codes[car], car.isStopped, car.turn_right, car.waiting_time, car.color[0], car.color[1], car.color[2])
+                for car in cars
+            ]))
+
+        self.pending += TICK_STRUCT.pack(
+            self.keyframe,
+            self.keyframe_first_car,
+            n,
+            self.n_changes,
+            n_changes,
+            COLOR_CODES[stoplight.color_NS],
+            COLOR_CODES[stoplight.color_EW],
+            stoplight.time_green,
+            stoplight.time_yellow,
+            car_manager.cumulative_waiting_time
+        )
+        self.n_changes += n_changes
+        self.n_ticks += 1
+        if len(self.pending) >= TICK_BATCH * TICK_STRUCT.size:
+            self._write_ticks()
+
+    def _keyframe(self, n:int) -> None:
+        """
+        Make the current tick a keyframe of n cars, written next to the cars stream.
+        """
+        self.keyframe = self.n_ticks
+        self.keyframe_first_car = self.n_records
+        self.n_records += n
+
+    def _write_ticks(self) -> None:
+        self.ticks.write_raw(self.pending)
+        self.pending = bytearray()
+
+    def close(self) -> None:
+        self._write_ticks()
+        self.ticks.close()
+        self.cars.close()
+        self.changes.close()
+
+class Trajectory:
+    """
+    Read access to a recorded run, with memory mapping.
+
+    The cars of a tick are rebuilt from the keyframe before it and the changes since; the last tick rebuilt is
+    kept, so reading the ticks one after the other (as in a replay) only applies the changes of each tick.
+
+    Attributes:
+    - metadata: dict describing the run
+    - ticks: memmap with the tick records (row t is tick t)
+    - cars: memmap with the keyframe car records
+    - changes: memmap with the change records
+    """
+    def __init__(self, output_dir:str, mode:str):
+        ticks_path, cars_path, changes_path = _paths(output_dir, mode)
+        self.metadata, self.ticks = open_stream(ticks_path)
+        _, self.cars = open_stream(cars_path)
+        _, self.changes = open_stream(changes_path)
+        self._last = None
+
+        # The streams are flushed independently: a run interrupted while writing may have ticks whose keyframe or changes were not written
+        keyframes = self.ticks['keyframe']
+        complete = ((self.ticks['first_car'] + self.ticks['n_cars'][keyframes] <= len(self.cars)) &
+                    (self.ticks['first_change'] + self.ticks['n_changes'] <= len(self.changes)))
+        self.ticks = self.ticks[:len(complete) if complete.all() else int(complete.argmin())]
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def get_tick(self, tick:int) -> tuple:
+        """
+        Get the state of a tick.
+
+        Parameters:
+        - tick: int representing the tick
+
+        Returns:
+        - record: TICK_DTYPE record of the tick
+        - cars: CAR_DTYPE records of the cars of the tick, in spawn order
+        """
+        tick = range(len(self))[tick]
+        return self.ticks[tick], self._cars_at(tick)
+
+    def get_range(self, start:int, stop:int) -> tuple:
+        """
+        Get the state of the ticks in [start, stop), reading only their records and the keyframe before them.
+
+        Parameters:
+        - start: int representing the first tick
+        - stop: int representing the tick after the last one
+
+        Returns:
+        - records: TICK_DTYPE records of the ticks
+        - cars: CAR_DTYPE records of the cars of the ticks, the cars of each tick starting at
+          the sum of records['n_cars'] of the ticks before it
+        """
+        ticks = range(len(self))[start:stop]
+        records = self.ticks[ticks.start:ticks.stop]
+        if len(records) == 0:
+            return records, np.empty(0, dtype=CAR_DTYPE)
+        return records, np.concatenate([self._cars_at(tick) for tick in ticks])
+
+    def get_car(self, car_id:int, start:int = 0, stop:int = None) -> tuple:
+        """
+        Get the trajectory of one car in the ticks in [start, stop).
+
+        Parameters:
+        - car_id: int representing the id of the car
+        - start: int representing the first tick
+        - stop: int representing the tick after the last one (None for the end of the run)
+
+        Returns:
+        - ticks: array with the ticks where the car is in the window
+        - cars: CAR_DTYPE records of the car at those ticks
+        """
+        records, cars = self.get_range(start, len(self) if stop is None else stop)
+        mask = cars['id'] == car_id
+        # Tick of each car record of the range
+        ticks = np.repeat(np.arange(start, start + len(records)), records['n_cars'])
+        return ticks[mask], cars[mask]
+
+    def _cars_at(self, tick:int) -> np.ndarray:
+        """
+        Rebuild the cars of a tick, from the last tick rebuilt if it is between the keyframe and the tick, or from the keyframe.
+        """
+        keyframe = int(self.ticks[tick]['keyframe'])
+        if self._last is not None and keyframe <= self._last[0] <= tick:
+            current, cars = self._last
+        else:
+            record = self.ticks[keyframe]
+            first_car = int(record['first_car'])
+            current, cars = keyframe, np.array(self.cars[first_car:first_car + int(record['n_cars'])])
+
+        while current < tick:
+            current += 1
+            cars = self._advance(cars, current)
+        self._last = (current, cars)
+        return cars
+
+    def _advance(self, cars:np.ndarray, tick:int) -> np.ndarray:
+        """
+        Get the cars of a tick between two keyframes from the cars of the tick before.
+        """
+        record = self.ticks[tick]
+        moving = ~cars['stopped']
+        directions = cars['direction']
+        cars = cars.copy()
+        cars['x'] += (DX[directions] * moving).astype(np.int16)
+        cars['y'] += (DY[directions] * moving).astype(np.int16)
+        cars['waiting_time'] += ~moving
+
+        first_change = int(record['first_change'])
+        changes = self.changes[first_change:first_change + int(record['n_changes'])]
+        if len(changes) == 0:
+            return cars
+
+        # Overwrite the cars that changed, append the ones that spawned (in spawn order) and drop the ones that exited
+        changed = changes[list(CAR_DTYPE.names)].astype(CAR_DTYPE)
+        rows = {car_id: row for row, car_id in enumerate(cars['id'].tolist())}
+        positions = np.array([rows.get(car_id, -1) for car_id in changed['id'].tolist()])
+        known = positions >= 0
+        cars[positions[known]] = changed[known]
+        cars = np.concatenate([cars, changed[~known]])
+        exited = changed['id'][changes['exited']]
+        return cars[~np.isin(cars['id'], exited)] if len(exited) else cars
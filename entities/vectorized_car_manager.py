@@ -0,0 +1,563 @@
+import random
+import numpy as np
+from entities.car import Car
+from entities.stoplight import Stoplight
+from entities.car_actions import CarActions
+from entities.colors import TrafficLightColor
+from entities.intersection_stats import IntersectionStats, TICKS_PER_SECOND
+
+# Directions are stored as indices into this list
+DIRECTIONS = [CarActions.UP, CarActions.DOWN, CarActions.LEFT, CarActions.RIGHT]
+UP, DOWN, LEFT, RIGHT = range(4)
+
+# Displacement of a moving car for each direction index
+DX = np.array([0, 0, -Car.SPEED, Car.SPEED], dtype=np.int32)
+DY = np.array([-Car.SPEED, Car.SPEED, 0, 0], dtype=np.int32)
+
+# Sign of the coordinate along the lane when moving forward (UP and LEFT decrease it)
+AHEAD = np.array([-1, 1, -1, 1], dtype=np.int32)
+
+# Offset of the front of the car from its coordinate along the lane (the coordinate is the back of DOWN and RIGHT cars)
+FRONT = np.where(AHEAD > 0, Car.LENGTH, 0).astype(np.int32)
+
+# Distances at which a stopped car blocks the car behind it (see Car.can_move)
+BLOCKING_GAPS = np.arange(Car.LENGTH + 4, Car.LENGTH + 7, dtype=np.int32)
+
+# Margin around the window for the cell index of the positions where blocking cars are looked up
+GRID_PADDING = 64
+
+# Number of cars up to which the blocking cars are found by comparing all the pairs of cars, instead of sorting the cars by cell
+PAIRWISE_LIMIT = 256
+
+# Pairs of cars (i, j) where j comes after i in spawn order, and before i
+LATER = np.triu(np.ones((PAIRWISE_LIMIT, PAIRWISE_LIMIT), dtype=bool), 1)
+EARLIER = np.tril(np.ones((PAIRWISE_LIMIT, PAIRWISE_LIMIT), dtype=bool), -1)
+
+# Distance between the keys of two lanes in the pairwise blocking check, larger than any coordinate
+LANE_SPAN = 1 << 16
+
+class VectorizedCarManager:
+    """
+    Manages the cars in the simulation, storing their state in NumPy arrays instead of Car objects.
+
+    All the cars are advanced by a single vectorized step per tick, with the same semantics as
+    CarManager.update_cars (cars are updated in spawn order, and a car sees the new state of the cars
+    updated before it). Car objects are only built when they are requested, e.g. to draw them.
+    The step costs a fixed number of array operations per tick, so it is faster than CarManager from
+    about 30 cars in the window, and slower with fewer cars.
+
+    Attributes:
+    - window: pygame window
+    - n_cars: int representing the number of cars in the window
+    - x, y: arrays with the coordinates of the cars
+    - direction: array with the direction index of the cars (see DIRECTIONS)
+    - stopped: array with the stopped flag of the cars
+    - turn_right: array with the turn intent of the cars
+    - waiting_time: array with the waiting time of the cars, in ticks
+    - color: array with the RGB color of the cars
+    - id: array with the spawn order of the cars
+    - n_spawned: int representing the number of cars added so far (the id of the next car)
+    - cumulative_waiting_time: int representing the total waiting time of all cars that have stopped at the intersection
+    - n_stopped_cars: int representing the number of cars that have stopped at the intersection
+    - queue_lenghts: dict with the number of cars stopped in each direction
+    - queues: list of the queue lengths for each direction
+    """
+    def __init__(self, window, capacity:int = 256):
+        self.window = window
+        self.window_width = window.get_width()
+        self.window_height = window.get_height()
+
+        self.n_cars = 0
+        self.n_spawned = 0
+        self._allocate(capacity)
+
+        self.cumulative_waiting_time = 0
+        self.n_stopped_cars = 0
+        self.queue_lenghts = {direction: 0 for direction in DIRECTIONS}
+
+        self.queues = []
+
+        self._spawn_coordinates = [Car.spawn_coordinates(direction, self.window_width, self.window_height) for direction in DIRECTIONS]
+
+        # Coordinate along the lane of the middle of the intersection, and of the first front position of the stop line
+        # (the stop line spans 3 pixels, see CarManager.is_at_intersection), for each direction
+        self._middles = np.array([self.window_height // 2] * 2 + [self.window_width // 2] * 2, dtype=np.int32)
+        self._stop_lines = np.where(AHEAD > 0, self._middles - 50 - 3, self._middles + 50).astype(np.int32)
+
+    def _allocate(self, capacity:int) -> None:
+        """
+        Allocate (or grow) the state arrays, keeping the cars already stored.
+
+        Parameters:
+        - capacity: int representing the number of cars the arrays can hold
+        """
+        n = self.n_cars
+        for name, (dtype, shape) in self._fields().items():
+            array = np.zeros((capacity,) + shape, dtype=dtype)
+            if n:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+
+    def _fields(self) -> dict:
+        """
+        Get the per-car state arrays, with their dtype and the shape of one entry.
+        """
+        return {
+            'x': (np.int32, ()),
+            'y': (np.int32, ()),
+            'direction': (np.intp, ()),             # intp, to index the per-direction tables without a cast
+            'stopped': (bool, ()),
+            'turn_right': (bool, ()),
+            'waiting_time': (np.int32, ()),
+            'color': (np.uint8, (3,)),
+            'id': (np.int32, ()),
+        }
+
+    def add_car(self, direction:list = None, turn_right:bool = None) -> None:
+        """
+        Add a car to the simulation.
+
+        The random attributes are drawn in the same order as in Car, so that a seeded run
+        gives the same cars as with CarManager.
+
+        Parameters:
+        - direction: list of directions that the car can take
+        - turn_right: bool representing if the car turns right (drawn at random if None)
+        """
+        car_direction = random.choice(direction) if direction else random.choice(DIRECTIONS)
+        # The turn is drawn even if it is given, so that the next random draws do not change
+        drawn_turn_right = random.choice([False, True])
+        turn_right = drawn_turn_right if turn_right is None else turn_right
+        color = (random.randint(1, 255), random.randint(1, 255), random.randint(1, 255))
+
+        if self.n_cars == len(self.x):
+            self._allocate(2 * len(self.x))
+
+        i = self.n_cars
+        d = DIRECTIONS.index(car_direction)
+        self.x[i], self.y[i] = self._spawn_coordinates[d]
+        self.direction[i] = d
+        self.stopped[i] = False
+        self.turn_right[i] = turn_right
+        self.waiting_time[i] = 0
+        self.color[i] = color
+        self.id[i] = self.n_spawned
+        self.n_spawned += 1
+        self.n_cars += 1
+
+    def get_cars(self) -> list:
+        """
+        Build the Car objects for the cars in the window.
+
+        Returns:
+        - list: list of Car objects, in spawn order
+        """
+        return [self._build_car(i) for i in range(self.n_cars)]
+
+    def get_n_stopped_cars(self) -> int:
+        return self.n_stopped_cars
+
+    def get_stats(self) -> IntersectionStats:
+        """
+        Get the per-direction aggregates of the cars, computed with one vectorized pass over the arrays.
+
+        Returns:
+        - IntersectionStats of the cars in the window
+        """
+        return self._stats()
+
+    def _stats(self, mask:np.ndarray = None) -> IntersectionStats:
+        """
+        Compute the per-direction aggregates of the cars in mask.
+
+        Parameters:
+        - mask: array with True for the cars to aggregate (None for all the cars)
+
+        Returns:
+        - IntersectionStats of the cars in mask
+        """
+        n = self.n_cars
+        x, y = self.x[:n], self.y[:n]
+        direction = self.direction[:n]
+        stopped = self.stopped[:n]
+        waiting_time = self.waiting_time[:n]
+        if mask is not None:
+            x, y, direction, stopped, waiting_time = x[mask], y[mask], direction[mask], stopped[mask], waiting_time[mask]
+
+        # One bin per direction for the moving cars past the middle of the intersection, then for the stopped cars,
+        # then for the incoming cars (the moving cars that have not reached the middle yet)
+        position = np.where(direction <= DOWN, y, x)
+        incoming = AHEAD[direction] * (position - self._middles[direction]) < 0
+        key = direction + np.where(stopped, len(DIRECTIONS), 2 * len(DIRECTIONS) * incoming)
+
+        counts = np.bincount(key, minlength=3 * len(DIRECTIONS)).tolist()
+        waiting_ticks = np.bincount(key, weights=waiting_time, minlength=3 * len(DIRECTIONS)).tolist()
+        waiting_seconds = np.bincount(key, weights=waiting_time // TICKS_PER_SECOND, minlength=3 * len(DIRECTIONS)).tolist()
+
+        stopped_bins = slice(len(DIRECTIONS), 2 * len(DIRECTIONS))
+        stats = IntersectionStats()
+        stats.n_stopped = dict(zip(DIRECTIONS, counts[stopped_bins]))
+        stats.waiting_ticks = dict(zip(DIRECTIONS, map(int, waiting_ticks[stopped_bins])))
+        stats.waiting_seconds = dict(zip(DIRECTIONS, map(int, waiting_seconds[stopped_bins])))
+        stats.n_incoming = dict(zip(DIRECTIONS, counts[2 * len(DIRECTIONS):]))
+        return stats
+
+    def _stopped_in(self, directions:list) -> np.ndarray:
+        """
+        Get the mask of the cars that are stopped and are in the specified directions.
+        """
+        n = self.n_cars
+        selected = np.zeros(len(DIRECTIONS), dtype=bool)
+        selected[[DIRECTIONS.index(direction) for direction in directions]] = True
+        return self.stopped[:n] & selected[self.direction[:n]]
+
+    def get_stopped_cars(self, directions:list) -> list:
+        """
+        Get the cars that are stopped and are in the specified directions.
+
+        Parameters:
+        - directions: list of directions to filter the cars
+
+        Returns:
+        - list: list of Car objects that are stopped and are in the specified directions
+        """
+        return [self._build_car(i) for i in np.flatnonzero(self._stopped_in(directions))]
+
+    def get_max_waiting_time(self, directions:list) -> int:
+        """
+        Get the waiting time of the longest waiting stopped car in the specified directions.
+
+        Parameters:
+        - directions: list of directions to filter the cars
+
+        Returns:
+        - int: waiting time in ticks (0 if no car is stopped)
+        """
+        waiting_time = self.waiting_time[:self.n_cars][self._stopped_in(directions)]
+        return int(waiting_time.max()) if len(waiting_time) else 0
+
+    def _build_car(self, i:int) -> Car:
+        """
+        Build the Car object for the car stored at index i.
+        """
+        return Car.from_state(
+            self.window,
+            DIRECTIONS[self.direction[i]],
+            int(self.x[i]),
+            int(self.y[i]),
+            bool(self.stopped[i]),
+            bool(self.turn_right[i]),
+            int(self.waiting_time[i]),
+            tuple(int(c) for c in self.color[i]),
+            int(self.id[i])
+        )
+
+    def update_cars(self, stoplight:Stoplight) -> None:
+        """
+        Update the cars' positions and states with one vectorized step.
+
+        Parameters:
+        - stoplight: Stoplight object
+        """
+        n = self.n_cars
+        if n == 0:
+            return
+
+        x, y = self.x[:n], self.y[:n]
+        direction = self.direction[:n]
+        stopped = self.stopped[:n]
+        vertical = direction <= DOWN
+
+        # Stoplight seen by each car (the cars have to stop on both red and yellow)
+        green = self._green(stoplight, vertical)
+
+        # Stopped cars wait, and start moving again if their stoplight is green
+        self.waiting_time[:n] += stopped
+        self._add_waiting(stopped)
+        released = stopped & green
+
+        # Moving cars stop at the intersection if their stoplight is not green, or behind a stopped car
+        moving = ~stopped
+        position = np.where(vertical, y, x)
+        front = position + FRONT[direction]
+        at_line = moving & ~green & self._is_at_intersection(direction, front)
+        blocked = self._is_blocked(self._lanes(direction), direction, position, moving & ~at_line, stopped & ~released | at_line, stopped)
+        stop_now = at_line | blocked
+
+        # Move the cars that were released or could keep going (only the latter may turn)
+        going = moving & ~stop_now
+        self._turn(going, front)
+        advancing = going | released
+        direction = self.direction[:n]
+        x += DX[direction] * advancing
+        y += DY[direction] * advancing
+
+        if stop_now.any() or released.any():
+            self._update_queues(direction, stop_now, released)
+            self._add_stops(stop_now)
+            stopped[:] = stopped & ~released | stop_now
+
+        # Remove the cars that are out of the window (as unsigned, the negative coordinates are out of the window too)
+        out = (x.view(np.uint32) > self.window_width) | (y.view(np.uint32) > self.window_height)
+        if out.any():
+            self._compact(~out)
+
+    def _green(self, stoplight:Stoplight, vertical:np.ndarray) -> np.ndarray:
+        """
+        Get the cars whose stoplight is green.
+
+        Parameters:
+        - stoplight: Stoplight object
+        - vertical: array with True for the cars moving up or down
+
+        Returns:
+        - array: True for the cars that see a green light
+        """
+        ns_green = stoplight.color_NS == TrafficLightColor.GREEN.value
+        ew_green = stoplight.color_EW == TrafficLightColor.GREEN.value
+        return np.where(vertical, ns_green, ew_green)
+
+    def _lanes(self, direction:np.ndarray) -> np.ndarray:
+        """
+        Get the lane index of the cars: cars can only block cars of the same lane.
+        """
+        return direction
+
+    def _add_waiting(self, stopped:np.ndarray) -> None:
+        """
+        Add one tick of waiting time for each stopped car to the statistics.
+        """
+        self.cumulative_waiting_time += int(np.count_nonzero(stopped))
+
+    def _add_stops(self, stop_now:np.ndarray) -> None:
+        """
+        Count the cars that stopped this tick in the statistics.
+        """
+        self.n_stopped_cars += int(np.count_nonzero(stop_now))
+
+    def _is_at_intersection(self, direction:np.ndarray, front:np.ndarray) -> np.ndarray:
+        """
+        Vectorized CarManager.is_at_intersection.
+
+        Parameters:
+        - direction: array with the direction index of the cars
+        - front: array with the coordinate of the front of the cars along their lane
+
+        Returns:
+        - array: True for the cars at the intersection
+        """
+        gap = front - self._stop_lines[direction]
+        return (gap >= 0) & (gap <= 3)
+
+    def _is_blocked(self, lane:np.ndarray, direction:np.ndarray, position:np.ndarray, candidates:np.ndarray, stopped_before:np.ndarray, stopped_after:np.ndarray) -> np.ndarray:
+        """
+        Vectorized CarManager.is_blocked for the cars updated in spawn order.
+
+        A car i is blocked by a stopped car j of its lane at a blocking distance. If j comes before i,
+        i sees the state of j after this tick's update, otherwise the state it had at the start of the tick.
+        Since a car only depends on the cars before it, the blocked set is found by growing it until it
+        does not change (usually one or two passes).
+
+        Parameters:
+        - lane: array with the lane index of the cars
+        - direction: array with the direction index of the cars
+        - position: array with the coordinate of the cars along their lane
+        - candidates: array with True for the cars that may get blocked
+        - stopped_before: array with the cars known to be stopped after this tick (before the blocked ones)
+        - stopped_after: array with the cars stopped at the start of the tick
+
+        Returns:
+        - array: True for the cars that are blocked
+        """
+        if not candidates.any() or not (stopped_before.any() or stopped_after.any()):
+            return np.zeros_like(candidates)
+        if len(candidates) <= PAIRWISE_LIMIT:
+            return self._is_blocked_pairwise(lane, direction, position, candidates, stopped_before, stopped_after)
+
+        size = max(self.window_width, self.window_height) + 1 + 2 * GRID_PADDING
+        lane = lane.astype(np.int64) * size
+        cell = lane + position + GRID_PADDING
+
+        # Cells where a stopped car would block each candidate
+        index = np.flatnonzero(candidates)
+        blocking_cells = lane[index, None] + np.clip(
+            position[index, None] + AHEAD[direction[index], None] * BLOCKING_GAPS[None, :] + GRID_PADDING, 0, size - 1
+        )
+
+        # Last stopped car (in spawn order) at each position: blocks the cars that come before it
+        blocked_by_later = (_lookup_index(cell, stopped_after, blocking_cells, last=True) > index[:, None]).any(axis=1)
+
+        blocked = np.zeros_like(candidates)
+        blocked[index] = blocked_by_later
+        while True:
+            # First stopped car (in spawn order) at each position: blocks the cars that come after it
+            first = _lookup_index(cell, stopped_before | blocked, blocking_cells, last=False)
+            new_blocked = blocked_by_later | (first < index[:, None]).any(axis=1)
+            if np.array_equal(new_blocked, blocked[index]):
+                return blocked
+            blocked[index] = new_blocked
+
+    def _is_blocked_pairwise(self, lane:np.ndarray, direction:np.ndarray, position:np.ndarray, candidates:np.ndarray, stopped_before:np.ndarray, stopped_after:np.ndarray) -> np.ndarray:
+        """
+        _is_blocked for a few cars, comparing the position of every car with the position of every other car.
+
+        Parameters: see _is_blocked
+
+        Returns:
+        - array: True for the cars that are blocked
+        """
+        n = len(candidates)
+        # The cars of a lane move in the same direction: along the lane, in the direction of motion, the cars
+        # ahead of a car have a higher key, and the cars of other lanes are further than any blocking distance
+        key = lane.astype(np.int64) * LANE_SPAN + AHEAD[direction] * position
+        # blocking[i, j]: car j is at a blocking distance ahead of car i, in its lane
+        blocking = np.abs(key[None, :] - key[:, None] - BLOCKING_GAPS[1]) <= 1
+        later, earlier = LATER[:n, :n], EARLIER[:n, :n]
+
+        # A boolean matrix product is True where any of the blocking cars is in the vector
+        blocked_by_later = candidates & ((blocking & later) @ stopped_after)
+        blocking_before = blocking & earlier
+        blocked = blocked_by_later
+        while True:
+            new_blocked = blocked_by_later | candidates & (blocking_before @ (stopped_before | blocked))
+            if not (new_blocked != blocked).any():
+                return blocked
+            blocked = new_blocked
+
+    def _turn(self, going:np.ndarray, front:np.ndarray) -> None:
+        """
+        Vectorized Car.turn_or_straight for the cars that keep moving.
+
+        Parameters:
+        - going: array with True for the cars that keep moving this tick
+        - front: array with the coordinate of the front of the cars along their lane
+        """
+        n = self.n_cars
+        x, y = self.x[:n], self.y[:n]
+        direction = self.direction[:n]
+        # The cars turn once their front has reached the middle of the intersection
+        turning = going & self.turn_right[:n] & (AHEAD[direction] * (front - self._middles[direction]) >= 0)
+        if not turning.any():
+            return
+
+        mid_x, mid_y = self.window_width // 2, self.window_height // 2
+        up = turning & (direction == UP)
+        down = turning & (direction == DOWN)
+        left = turning & (direction == LEFT)
+        right = turning & (direction == RIGHT)
+
+        direction[up], x[up], y[up] = RIGHT, x[up] + Car.LENGTH // 2, mid_y + 5
+        direction[down], x[down], y[down] = LEFT, x[down] - Car.LENGTH // 2, mid_y - 20 - 4
+        direction[left], x[left], y[left] = UP, mid_x + 5, y[left] - Car.LENGTH // 2
+        direction[right], x[right], y[right] = DOWN, mid_x - 20 - 4, y[right] + Car.LENGTH // 2
+        self.turn_right[:n][up | down | left | right] = False
+
+    def _update_queues(self, direction:np.ndarray, stop_now:np.ndarray, released:np.ndarray) -> None:
+        """
+        Update the queue lengths as if the cars were processed one at a time in spawn order:
+        a stopping car adds one to the queue of its direction, and the first released car of a
+        direction stores the queue length and resets it.
+
+        Parameters:
+        - direction: array with the direction index of the cars
+        - stop_now: array with True for the cars that stopped this tick
+        - released: array with True for the cars that started moving this tick
+        """
+        queue_lengths = np.array([self.queue_lenghts[car_direction] for car_direction in DIRECTIONS])
+        release_index, lengths = replay_queues(direction, stop_now, released, queue_lengths)
+        self.queue_lenghts = {car_direction: int(queue_lengths[d]) for d, car_direction in enumerate(DIRECTIONS)}
+        self.queues.extend(int(length) for length in lengths)
+
+    def _compact(self, keep:np.ndarray) -> None:
+        """
+        Remove the cars not in keep, preserving the spawn order of the others.
+
+        Parameters:
+        - keep: array with True for the cars to keep
+        """
+        n = self.n_cars
+        m = int(np.count_nonzero(keep))
+        for name in self._fields():
+            array = getattr(self, name)
+            array[:m] = array[:n][keep]
+        self.n_cars = m
+
+
+def _lookup_index(cell:np.ndarray, mask:np.ndarray, queries:np.ndarray, last:bool) -> np.ndarray:
+    """
+    Find, for each queried cell, the first or last car (in spawn order) of mask occupying it.
+
+    Parameters:
+    - cell: array with the cell of each car
+    - mask: array with True for the cars to consider
+    - queries: array of cells to look up
+    - last: bool representing if the last car should be returned instead of the first one
+
+    Returns:
+    - array shaped like queries, with the index of the car found, or -1 (last) / len(cell) (first) if none
+    """
+    missing = -1 if last else len(cell)
+    index = np.flatnonzero(mask)
+    if len(index) == 0:
+        return np.full(queries.shape, missing, dtype=np.intp)
+
+    # Cars sorted by cell, then by spawn order
+    order = np.lexsort((index, cell[index]))
+    cells, index = cell[index][order], index[order]
+
+    found = np.searchsorted(cells, queries, side='right' if last else 'left')
+    if last:
+        found -= 1
+    found_ok = (found >= 0) & (found < len(cells))
+    found = np.clip(found, 0, len(cells) - 1)
+    return np.where(found_ok & (cells[found] == queries), index[found], missing)
+
+
+def replay_queues(lane:np.ndarray, stop_now:np.ndarray, released:np.ndarray, queue_lengths:np.ndarray) -> tuple:
+    """
+    Replay the queue bookkeeping of CarManager.update_car for one tick, in spawn order.
+
+    Each car that stops adds one to the queue of its lane. Each released car stores the queue
+    length of its lane (if it is not empty) and resets it.
+
+    Parameters:
+    - lane: array with the lane index of the cars
+    - stop_now: array with True for the cars that stopped this tick
+    - released: array with True for the cars that started moving this tick
+    - queue_lengths: array with the queue length of each lane, updated in place
+
+    Returns:
+    - tuple: the index of the released cars that stored a queue length and the stored lengths, in spawn order
+    """
+    stop_lane = lane[stop_now]
+    if not released.any():
+        np.add.at(queue_lengths, stop_lane, 1)
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=queue_lengths.dtype)
+
+    stops = np.flatnonzero(stop_now)
+    releases = np.flatnonzero(released)
+    release_lane = lane[releases]
+
+    # Sort the events by lane, then by spawn order, to count the stops before each release of the same lane
+    release_order = np.lexsort((releases, release_lane))
+    releases, release_lane = releases[release_order], release_lane[release_order]
+    release_key = release_lane.astype(np.int64) * (len(lane) + 1) + releases
+    stop_key = stop_lane.astype(np.int64) * (len(lane) + 1) + stops
+    segment = np.searchsorted(release_key, stop_key)
+
+    # A stop belongs to the segment of the next release of its lane, or to the queue carried to the next tick
+    next_same_lane = (segment < len(releases)) & (release_lane[np.minimum(segment, len(releases) - 1)] == stop_lane)
+    counts = np.bincount(segment[next_same_lane], minlength=len(releases))
+
+    # The first release of each lane also stores the queue carried from the previous ticks
+    first = np.ones(len(releases), dtype=bool)
+    first[1:] = release_lane[1:] != release_lane[:-1]
+    counts[first] += queue_lengths[release_lane[first]]
+    queue_lengths[release_lane[first]] = 0
+
+    # The stops that are not followed by a release of their lane are carried to the next tick
+    np.add.at(queue_lengths, stop_lane[~next_same_lane], 1)
+
+    stored = counts > 0
+    order = np.argsort(releases[stored], kind='stable')
+    return releases[stored][order], counts[stored][order]
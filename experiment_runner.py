@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""
+Runs a grid of simulations (modes x seeds x car spawn rates x spawning rules) on a process pool.
+
+Each run is headless and saves its stats in its own directory, together with a summary.json file
+that marks the run as completed. Completed runs are skipped when the grid is run again, so a crashed
+or interrupted experiment can be resumed. At the end, the summaries are merged into summary.csv.
+
+The exit status is 1 if any run failed.
+
+Example:
+    python experiment_runner.py --modes ft pi vi --seeds 0 1 2 3 --spawn-rates 1.5 1 --workers 8
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+import itertools
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# Spawning rules used in main.ipynb
+DEFAULT_SPAWNING_RULES = {
+    'default': [
+        ('all_directions', 300),
+        ('no_cars', 60),
+        ('up_down', 120),
+        ('left_right', 120),
+        ('all_directions', 300)
+    ]
+}
+
+SUMMARY_FILE = 'summary.json'
+SUMMARY_FIELDS = [
+    'run', 'mode', 'seed', 'car_spawn_rate', 'spawning_rules', 'status',
+    'cumulative_waiting_time', 'n_stopped_cars', 'average_waiting_time',
+    'n_queues', 'mean_queue_length', 'max_queue_length', 'error'
+]
+
+def build_grid(modes:list, seeds:list, spawn_rates:list, spawning_rules:dict) -> list:
+    """
+    Build the list of runs of the grid.
+
+    Parameters:
+    - modes: list of str with the modes of the simulation (pi, vi, ft, lt)
+    - seeds: list of int with the seeds
+    - spawn_rates: list of float with the car spawn rates, in seconds
+    - spawning_rules: dict with the spawning rules, by name
+
+    Returns:
+    - list of dict, one per run
+    """
+    return [
+        {
+            'run': f'{mode}_seed{seed}_rate{rate}_{rules_name}',
+            'mode': mode,
+            'seed': seed,
+            'car_spawn_rate': rate,
+            'spawning_rules': rules_name,
+            'rules': [list(rule) for rule in spawning_rules[rules_name]],
+        }
+        for mode, seed, rate, rules_name in itertools.product(modes, seeds, spawn_rates, spawning_rules)
+    ]
+
+def run_config(config:dict, output_root:str, vectorized:bool = False, cache_dir:str = None) -> dict:
+    """
+    Run one simulation of the grid and save its stats and summary in its own directory.
+
+    Parameters:
+    - config: dict describing the run (see build_grid)
+    - output_root: str representing the directory of the experiment
+    - vectorized: bool representing if the vectorized car manager should be used
+    - cache_dir: str representing the directory of the result cache shared by the workers (no cache if None)
+
+    Returns:
+    - dict with the summary of the run
+    """
+    from entities.simulation import Simulation
+    from entities.result_cache import ResultCache
+
+    run_dir = os.path.join(output_root, config['run'])
+    simulation = Simulation(
+        spawning_rules=[tuple(rule) for rule in config['rules']],
+        car_spawn_rate=config['car_spawn_rate']
+    )
+    simulation.run(config['mode'], save_stats=True, headless=True, seed=config['seed'], vectorized=vectorized, output_dir=run_dir,
+                   cache=ResultCache(cache_dir) if cache_dir else None)
+
+    queues = simulation.car_manager.queues
+    cumulative_waiting_time = simulation.cumulative_waiting_times[-1]
+    n_stopped_cars = simulation.n_stopped_cars
+    summary = {
+        **{key: config[key] for key in ['run', 'mode', 'seed', 'car_spawn_rate', 'spawning_rules']},
+        'status': 'completed',
+        'cumulative_waiting_time': cumulative_waiting_time,
+        'n_stopped_cars': n_stopped_cars,
+        'average_waiting_time': cumulative_waiting_time / n_stopped_cars if n_stopped_cars else 0,
+        'n_queues': len(queues),
+        'mean_queue_length': sum(queues) / len(queues) if queues else 0,
+        'max_queue_length': max(queues, default=0),
+    }
+    _write_json(summary, os.path.join(run_dir, SUMMARY_FILE))
+    return summary
+
+def run_experiments(configs:list, output_root:str, workers:int = None, vectorized:bool = False, cache_dir:str = None) -> list:
+    """
+    Run the grid on a process pool and merge the summaries.
+
+    Runs that already have a summary are skipped. If a worker process dies, the pool becomes unusable
+    and every run it had not completed is interrupted: these runs are then retried once, each in its
+    own process (still at most 'workers' at a time), so that a crash can only fail the run that caused it.
+    Runs that raise an exception are not retried. Failed runs are reported in the merged table.
+
+    Parameters:
+    - configs: list of dict describing the runs (see build_grid)
+    - output_root: str representing the directory of the experiment
+    - workers: int representing the number of worker processes (all the cores if None)
+    - vectorized: bool representing if the vectorized car manager should be used
+    - cache_dir: str representing the directory of the result cache shared by the workers (no cache if None)
+
+    Returns:
+    - list of dict with the summaries of all the runs
+    """
+    os.makedirs(output_root, exist_ok=True)
+    workers = workers or os.cpu_count()
+    pending = [config for config in configs if not _is_completed(config, output_root)]
+    failures = {}
+
+    interrupted = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_config, config, output_root, vectorized, cache_dir): config for config in pending}
+        for future in as_completed(futures):
+            config = futures[future]
+            try:
+                summary = future.result()
+                print(f"Completed {summary['run']}")
+            except BrokenProcessPool:
+                interrupted.append(config)
+            except Exception as error:
+                failures[config['run']] = _failure(config, repr(error))
+                print(f"Failed {config['run']}: {error!r}")
+
+    interrupted = [config for config in interrupted if not _is_completed(config, output_root)]
+    if interrupted:
+        print(f"A worker process died, retrying {len(interrupted)} runs in separate processes")
+        failures.update(_run_isolated(interrupted, output_root, workers, vectorized, cache_dir))
+
+    return merge_summaries(configs, output_root, failures)
+
+def _run_isolated(configs:list, output_root:str, workers:int, vectorized:bool, cache_dir:str = None) -> dict:
+    """
+    Run each configuration in its own process, at most 'workers' at a time.
+
+    Parameters:
+    - configs: list of dict describing the runs (see build_grid)
+    - output_root: str representing the directory of the experiment
+    - workers: int representing the number of concurrent processes
+    - vectorized: bool representing if the vectorized car manager should be used
+    - cache_dir: str representing the directory of the result cache shared by the workers (no cache if None)
+
+    Returns:
+    - dict with the summary of the failed runs, by run name
+    """
+    failures = {}
+    queue = list(configs)
+    running = {}
+    while queue or running:
+        while queue and len(running) < workers:
+            config = queue.pop(0)
+            process = multiprocessing.Process(target=run_config, args=(config, output_root, vectorized, cache_dir))
+            process.start()
+            running[process.sentinel] = (process, config)
+
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            process, config = running.pop(sentinel)
+            process.join()
+            if _is_completed(config, output_root):
+                print(f"Completed {config['run']}")
+            else:
+                failures[config['run']] = _failure(config, f'worker process exited with code {process.exitcode}')
+                print(f"Failed {config['run']}: worker process exited with code {process.exitcode}")
+
+    return failures
+
+def _is_completed(config:dict, output_root:str) -> bool:
+    """
+    Check if a run has already been completed (its summary has been written).
+    """
+    return os.path.exists(os.path.join(output_root, config['run'], SUMMARY_FILE))
+
+def merge_summaries(configs:list, output_root:str, failures:dict = None) -> list:
+    """
+    Merge the summaries of the runs into a single summary.csv table.
+
+    Parameters:
+    - configs: list of dict describing the runs (see build_grid)
+    - output_root: str representing the directory of the experiment
+    - failures: dict with the summary of the failed runs, by run name
+
+    Returns:
+    - list of dict with the summaries of all the runs
+    """
+    failures = failures or {}
+    summaries = []
+    for config in configs:
+        path = os.path.join(output_root, config['run'], SUMMARY_FILE)
+        if _is_completed(config, output_root):
+            with open(path) as f:
+                summaries.append(json.load(f))
+        else:
+            summaries.append(failures.get(config['run'], _failure(config, 'not run')))
+
+    with open(os.path.join(output_root, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow({field: summary.get(field, '') for field in SUMMARY_FIELDS})
+
+    return summaries
+
+def _failure(config:dict, error:str) -> dict:
+    """
+    Build the summary of a run that did not complete.
+    """
+    return {
+        **{key: config[key] for key in ['run', 'mode', 'seed', 'car_spawn_rate', 'spawning_rules']},
+        'status': 'failed',
+        'error': error,
+    }
+
+def _write_json(data:dict, path:str) -> None:
+    """
+    Write a JSON file atomically, so that a crash never leaves a partial file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a grid of traffic light simulations on a process pool.')
+    parser.add_argument('--modes', nargs='+', default=['ft', 'pi', 'vi'], choices=['ft', 'pi', 'vi', 'lt'])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--spawn-rates', nargs='+', type=float, default=[1.5])
+    parser.add_argument('--rules', help='JSON file with the spawning rules by name, e.g. {"default": [["all_directions", 300]]}')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all the cores)')
+    parser.add_argument('--output', default='./data/experiments', help='directory of the experiment')
+    parser.add_argument('--vectorized', action='store_true', help='use the vectorized car manager')
+    parser.add_argument('--cache', default=None, help='directory of a result cache shared by the runs (see entities.result_cache)')
+    args = parser.parse_args()
+
+    spawning_rules = DEFAULT_SPAWNING_RULES
+    if args.rules:
+        with open(args.rules) as f:
+            spawning_rules = json.load(f)
+
+    configs = build_grid(args.modes, args.seeds, args.spawn_rates, spawning_rules)
+    summaries = run_experiments(configs, args.output, workers=args.workers, vectorized=args.vectorized, cache_dir=args.cache)
+
+    n_failed = sum(summary['status'] != 'completed' for summary in summaries)
+    print(f"{len(summaries) - n_failed}/{len(summaries)} runs completed, summary in {os.path.join(args.output, 'summary.csv')}")
+    # A non-zero exit status lets the scripts that launch the experiment detect the failed runs
+    sys.exit(1) if n_failed else None
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 import random
+import numpy as np
+from model import matrix_solver
 from entities.car_actions import CarActions
+from entities.intersection_stats import IntersectionStats
 
 WINDOW_WIDTH = 1000
 WINDOW_HEIGHT = 1000
@@ -15,8 +18,14 @@ class TrafficMDP:
     - theta: threshold for the policy evaluation
     - values: dictionary of state values (V)
     - policy: dictionary of state-action pairs (pi)
+    - rng: random number generator used to sample the actions from the policy
+    - solver: 'loop' to solve the MDP with the iterative dict-based algorithms, 'matrix' to solve it with arrays (see model.matrix_solver)
+    - n_sweeps: int representing the number of sweeps over the states made by the solvers so far
+    - n_rewards: int representing the number of calls to get_reward so far
     '''
-    def __init__(self):
+    def __init__(self, rng:random.Random = None, solver:str = 'loop'):
+        assert solver in ['loop', 'matrix'], "Solver must be either 'loop' or 'matrix'"
+
         self.states = ['EW', 'NS']
         self.actions = ['maintain', 'change']
         self.discount_factor = 0.95
@@ -26,13 +35,31 @@ class TrafficMDP:
             'EW': {'maintain': 0.5, 'change': 0.5},
             'NS': {'maintain': 0.5, 'change': 0.5}
         }
+        self.rng = rng if rng is not None else random
+        self.solver = solver
+        self.n_sweeps = 0
+        self.n_rewards = 0
+
+    def observe(self, cars) -> IntersectionStats:
+        '''
+        Get the observation of the intersection used by the rewards.
+
+        Parameters:
+        - cars: IntersectionStats of the cars, or list of Car objects
+
+        Returns:
+        - IntersectionStats of the cars (computed in a single pass if a list of cars is given)
+        '''
+        if isinstance(cars, IntersectionStats):
+            return cars
+        return IntersectionStats.from_cars(cars, WINDOW_WIDTH, WINDOW_HEIGHT)
 
-    def get_reward(self, cars:list, action:CarActions, state:str):
+    def get_reward(self, cars, action:CarActions, state:str):
         '''
         Get the reward R(s, a) for a given state-action pair.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars (see CarManager.get_stats), or list of Car objects
         - action: action to take
         - state: actual state
 
@@ -43,35 +70,31 @@ class TrafficMDP:
         If the action is 'maintain', the reward is the number of incoming cars where the stoplight is green divided by the average waiting time of stopped cars.
         In this way, the reward is high when there are many incoming cars where the stoplight is green, and also when the the stopped cars have been waiting for a long time.
         '''
+        self.n_rewards += 1
+        stats = self.observe(cars)
+
+        # The incoming cars have always included the stopped LEFT and UP cars (the 'not stopped' condition only applied to RIGHT and DOWN)
         if state == 'EW':
-            stopped_cars = [car for car in cars if 
-                            car.direction in [CarActions.UP, CarActions.DOWN]
-                            and car.is_stopped()]
-            incoming_cars = len([car for car in cars if 
-                                 (car.x > WINDOW_WIDTH//2 and car.direction == CarActions.LEFT) 
-                                 or (car.x < WINDOW_WIDTH//2 and car.direction == CarActions.RIGHT) 
-                                 and not car.is_stopped()])
+            stopped_directions = [CarActions.UP, CarActions.DOWN]
+            incoming_cars = stats.n_incoming[CarActions.LEFT] + stats.n_stopped[CarActions.LEFT] + stats.n_incoming[CarActions.RIGHT]
         else:
-            stopped_cars = [car for car in cars if
-                            car.direction in [CarActions.LEFT, CarActions.RIGHT]
-                            and car.is_stopped()]
-            incoming_cars = len([car for car in cars if (car.y > WINDOW_HEIGHT//2 and car.direction == CarActions.UP)
-                                 or (car.y < WINDOW_HEIGHT//2 and car.direction == CarActions.DOWN)
-                                 and not car.is_stopped()])
+            stopped_directions = [CarActions.LEFT, CarActions.RIGHT]
+            incoming_cars = stats.n_incoming[CarActions.UP] + stats.n_stopped[CarActions.UP] + stats.n_incoming[CarActions.DOWN]
 
-        avg_wait_time = sum(car.waiting_time//30 for car in stopped_cars) / len(stopped_cars) if stopped_cars else 0
+        n_stopped_cars = sum(stats.n_stopped[direction] for direction in stopped_directions)
+        avg_wait_time = sum(stats.waiting_seconds[direction] for direction in stopped_directions) / n_stopped_cars if n_stopped_cars else 0
 
         if action == 'change':
             return avg_wait_time / incoming_cars if incoming_cars > 0 else avg_wait_time
         else:
             return incoming_cars / avg_wait_time if avg_wait_time > 0 else incoming_cars
         
-    def get_transition_probability(self, cars:list, action:CarActions, state:str, next_state:str):
+    def get_transition_probability(self, cars, action:CarActions, state:str, next_state:str):
         '''
         Get the transition probability P(s', r| s, a) for a given state-action pair.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars, or list of Car objects
         - action: action to take (a)
         - state: current state (s)
         - next_state: next state (s')
@@ -99,16 +122,64 @@ class TrafficMDP:
         else:
             return 0
 
-    def policy_evaluation(self, cars:list):
+    def build_tables(self, cars) -> tuple:
+        '''
+        Build the reward table R(s, a) and the transition table P(s'| s, a) for the current cars.
+
+        Parameters:
+        - cars: IntersectionStats of the cars, or list of Car objects
+
+        Returns:
+        - rewards: dictionary of rewards, keyed by (state, action)
+        - transitions: dictionary of transition probabilities, keyed by (state, action, next_state)
+
+        The cars are aggregated once, so the solvers can run as many sweeps as they need on the tables without looking at the cars again.
+        '''
+        stats = self.observe(cars)
+        rewards = {(state, action): self.get_reward(stats, action, state) for state in self.states for action in self.actions}
+        transitions = {
+            (state, action, state_): self.get_transition_probability(stats, action, state, state_)
+            for state in self.states for action in self.actions for state_ in self.states
+        }
+        return rewards, transitions
+
+    def build_arrays(self, cars) -> tuple:
+        '''
+        Build the transition tensor and the reward matrix, with the states and actions as indices.
+
+        Parameters:
+        - cars: IntersectionStats of the cars, or list of Car objects
+
+        Returns:
+        - P: transition tensor (|S|x|A|x|S|)
+        - R: reward matrix (|S|x|A|)
+        '''
+        rewards, transitions = self.build_tables(cars)
+        P = np.array([[[transitions[state, action, state_] for state_ in self.states] for action in self.actions] for state in self.states], dtype=np.float64)
+        R = np.array([[rewards[state, action] for action in self.actions] for state in self.states], dtype=np.float64)
+        return P, R
+
+    def _store_solution(self, values:np.ndarray, policy:np.ndarray = None) -> None:
+        '''
+        Store the values (and the policy) found by the matrix solver in the dicts used by the other methods.
+        '''
+        self.values = {state: float(values[s]) for s, state in enumerate(self.states)}
+        if policy is not None:
+            self.policy = {state: {action: float(policy[s, a]) for a, action in enumerate(self.actions)} for s, state in enumerate(self.states)}
+
+    def policy_evaluation(self, cars, tables:tuple = None):
         '''
         Evaluate the policy using iterative policy evaluation.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars, or list of Car objects
+        - tables: reward and transition tables (see build_tables), built from the cars if not given
 
         This implementation follows the iterative policy evaluation algorithm on the Reinforcement Learning (Sutton, Barto) book.
         '''
+        rewards, transitions = tables or self.build_tables(cars)
         while True:
+            self.n_sweeps += 1
             delta = 0
             for state in self.states:
                 v = self.values[state]
@@ -116,7 +187,7 @@ class TrafficMDP:
                 new_value = 0
                 for action in self.actions:
                     for state_ in self.states:
-                        new_value += self.policy[state][action] * self.get_transition_probability(cars, action, state, state_) * (self.get_reward(cars, action, state) + self.discount_factor * self.values[state_])
+                        new_value += self.policy[state][action] * transitions[state, action, state_] * (rewards[state, action] + self.discount_factor * self.values[state_])
 
                 self.values[state] = new_value
 
@@ -124,49 +195,66 @@ class TrafficMDP:
             if delta < self.theta:
                 return
 
-    def policy_improvement(self, cars:list):
+    def policy_improvement(self, cars, tables:tuple = None):
         '''
         Improve the policy using policy improvement.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars, or list of Car objects
+        - tables: reward and transition tables (see build_tables), built from the cars if not given
 
         Returns:
-        - policy_stable: boolean indicating if the policy is stable
+        - policy_stable: boolean indicating if the policy is stable (unchanged by the improvement)
 
-        This implementation follows the policy improvement algorithm on the Reinforcement Learning (Sutton, Barto) book.
+        This implementation follows the policy improvement algorithm on the Reinforcement Learning (Sutton, Barto) book,
+        with the backup q(s, a) = sum_s' P(s'| s, a) * (R(s, a) + gamma * v(s')) of the other algorithms.
         '''
+        rewards, transitions = tables or self.build_tables(cars)
+        self.n_sweeps += 1
         policy_stable = True
         for state in self.states:
-            old_action = self.get_action(state)
+            old_policy = self.policy[state]
 
             action_values = {action: 0 for action in self.actions}
             for state_ in self.states:
-                action_values = {action: action_values[action] + (self.get_transition_probability(cars, action, state, state_) * (self.get_reward(cars, action, state_) + self.discount_factor * self.values[state_])) for action in self.actions}
+                action_values = {action: action_values[action] + (transitions[state, action, state_] * (rewards[state, action] + self.discount_factor * self.values[state_])) for action in self.actions}
 
             best_action = max(action_values, key=action_values.get)
             self.policy[state] = {action: 1 if action == best_action else 0 for action in self.actions}
 
-            if old_action != best_action:
+            if self.policy[state] != old_policy:
                 policy_stable = False
 
         return policy_stable
 
-    def policy_iteration(self, cars:list):
+    def policy_iteration(self, cars):
         '''
         Perform policy iteration.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars, or list of Car objects
 
         This implementation follows the policy iteration algorithm on the Reinforcement Learning (Sutton, Barto) book.
+        Both solvers improve the policy with the Bellman update q(s, a) = sum_s' P(s'| s, a) * (R(s, a) + gamma * v(s'))
+        and stop when the policy is unchanged; the loop solver evaluates each policy iteratively up to theta, the matrix
+        solver exactly by solving (I - gamma * P_pi) v = r_pi. The rng is only used by get_action.
         '''
+        if self.solver == 'matrix':
+            P, R = self.build_arrays(cars)
+            policy = np.array([[self.policy[state][action] for action in self.actions] for state in self.states], dtype=np.float64)
+            self._store_solution(*matrix_solver.policy_iteration(P, R, self.discount_factor, policy, on_sweep=self._count_sweep))
+            return
+
+        tables = self.build_tables(cars)
         while True:
-            self.policy_evaluation(cars)
+            self.policy_evaluation(cars, tables)
 
-            if self.policy_improvement(cars):
+            if self.policy_improvement(cars, tables):
                 return
 
+    def _count_sweep(self) -> None:
+        self.n_sweeps += 1
+
     def get_action(self, state:str):
         '''
         Get the action to take in a given state.
@@ -179,22 +267,33 @@ class TrafficMDP:
 
         This method returns the action to take in a given state according to the policy (pi*(s)).
         '''
-        return random.choices(self.actions, weights=[self.policy[state]['maintain'], self.policy[state]['change']])[0]
+        return self.rng.choices(self.actions, weights=[self.policy[state]['maintain'], self.policy[state]['change']])[0]
     
-    def value_iteration(self, cars:list, current_state:str):
+    def value_iteration(self, cars, current_state:str):
         '''
         Perform value iteration.
 
         Parameters:
-        - cars: list of Car objects
+        - cars: IntersectionStats of the cars, or list of Car objects
         - current_state: current state
 
         Returns:
         - action: action to take
 
         This implementation follows the value iteration algorithm seen on the Reinforcement Learning (Sutton, Barto) book.
+        With the matrix solver, each sweep is a single vectorized Bellman backup over all the states.
         '''
+        if self.solver == 'matrix':
+            P, R = self.build_arrays(cars)
+            values = np.array([self.values[state] for state in self.states], dtype=np.float64)
+            values = matrix_solver.value_iteration(P, R, self.discount_factor, self.theta, values, on_sweep=self._count_sweep)
+            self._store_solution(values)
+            action_values = matrix_solver.q_values(P, R, values, self.discount_factor)[self.states.index(current_state)]
+            return self.actions[int(action_values.argmax())]
+
+        rewards, transitions = self.build_tables(cars)
         while True:
+            self.n_sweeps += 1
             delta = 0
             new_values = {}
             for state in self.states:
@@ -203,7 +302,7 @@ class TrafficMDP:
                 for action in self.actions:
                     value_sum = 0
                     for state_ in self.states:
-                        value_sum += self.get_transition_probability(cars, action, state, state_) * (self.get_reward(cars, action, state) + self.discount_factor * self.values[state_])
+                        value_sum += transitions[state, action, state_] * (rewards[state, action] + self.discount_factor * self.values[state_])
                     action_values.append(value_sum)
 
                 new_values[state] = max(action_values)
@@ -218,7 +317,7 @@ class TrafficMDP:
         for action in self.actions:
             value_sum = 0
             for state_ in self.states:
-                value_sum += self.get_transition_probability(cars, action, current_state, state_) * (self.get_reward(cars, action, current_state) + self.discount_factor * self.values[state_])
+                value_sum += transitions[current_state, action, state_] * (rewards[current_state, action] + self.discount_factor * self.values[state_])
             action_values.append(value_sum)
                 
         return self.actions[action_values.index(max(action_values))]
\ No newline at end of file
@@ -0,0 +1,99 @@
+import os
+import bisect
+import numpy as np
+
+# Policy solved by model.offline_policy, shipped with the repository (independent of the working directory)
+DEFAULT_LOOKUP_TABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'policies', 'lookup_table.npz')
+
+# Bucket edges of the discretized state (a value falls in bucket i if edges[i] <= value < edges[i + 1])
+QUEUE_EDGES = [0, 1, 3, 6, 10]          # stopped cars of each approach
+GREEN_EDGES = [0, 5, 10, 15, 20, 30]    # seconds of green of the current phase
+WAIT_EDGES = [0, 5, 15, 30, 60]         # seconds waited by the longest waiting car on red
+
+# Phases of the stoplight: the direction that is green
+PHASES = ['NS', 'EW']
+ACTIONS = ['maintain', 'change']
+
+class LookupTablePolicy:
+    '''
+    Stoplight controller that decides with a single lookup into a policy solved offline (see model.offline_policy).
+
+    The discretized state is the phase, the bucketed number of stopped cars of each approach (up, down, left, right),
+    the bucketed green time and the bucketed waiting time of the longest waiting car on red.
+
+    Attributes:
+    - policy: array with the action index of each discretized state, indexed by (phase, q_up, q_down, q_left, q_right, green, wait)
+    - queue_edges: list of the bucket edges of the queue lengths
+    - green_edges: list of the bucket edges of the green time, in seconds
+    - wait_edges: list of the bucket edges of the waiting time, in seconds
+    '''
+    def __init__(self, policy:np.ndarray, queue_edges:list = QUEUE_EDGES, green_edges:list = GREEN_EDGES, wait_edges:list = WAIT_EDGES):
+        self.policy = policy
+        self.queue_edges = list(queue_edges)
+        self.green_edges = list(green_edges)
+        self.wait_edges = list(wait_edges)
+
+    @classmethod
+    def load(cls, path:str):
+        '''
+        Load a policy saved by model.offline_policy.
+
+        Parameters:
+        - path: str representing the path of the .npz file
+
+        Returns:
+        - LookupTablePolicy with the policy of the file
+        '''
+        with np.load(path) as data:
+            return cls(data['policy'], data['queue_edges'].tolist(), data['green_edges'].tolist(), data['wait_edges'].tolist())
+
+    def save(self, path:str, **metadata) -> None:
+        '''
+        Save the policy and its bucket edges to a compressed .npz file.
+
+        Parameters:
+        - path: str representing the path of the .npz file
+        - metadata: arrays saved along with the policy (e.g. the parameters of the model it was solved for)
+        '''
+        np.savez_compressed(
+            path,
+            policy=self.policy.astype(np.uint8),
+            queue_edges=np.array(self.queue_edges),
+            green_edges=np.array(self.green_edges),
+            wait_edges=np.array(self.wait_edges),
+            **metadata
+        )
+
+    def get_action(self, phase:str, queue_lengths:list, green_seconds:int, wait_seconds:int) -> str:
+        '''
+        Get the action to take in the current state.
+
+        Parameters:
+        - phase: str representing the direction that is green ('NS' or 'EW')
+        - queue_lengths: list with the number of stopped cars of each approach (up, down, left, right)
+        - green_seconds: int representing the time the stoplight has been green, in seconds
+        - wait_seconds: int representing the waiting time of the longest waiting car on red, in seconds
+
+        Returns:
+        - action: action to take ('maintain' or 'change')
+        '''
+        index = (
+            PHASES.index(phase),
+            *(bucket(queue_length, self.queue_edges) for queue_length in queue_lengths),
+            bucket(green_seconds, self.green_edges),
+            bucket(wait_seconds, self.wait_edges),
+        )
+        return ACTIONS[self.policy[index]]
+
+def bucket(value:int, edges:list) -> int:
+    '''
+    Get the bucket of a value.
+
+    Parameters:
+    - value: value to discretize
+    - edges: list of the increasing bucket edges, starting with the lowest possible value
+
+    Returns:
+    - int representing the index of the bucket (values above the last edge fall in the last bucket)
+    '''
+    return bisect.bisect_right(edges, value) - 1
@@ -0,0 +1,111 @@
+'''
+Array-backed solvers for finite MDPs.
+
+States and actions are indices: P is the |S|x|A|x|S| tensor of the transition probabilities P(s'| s, a),
+R is the |S|x|A| matrix of the rewards R(s, a), and a policy is the |S|x|A| matrix of the probabilities pi(a| s).
+The reward of a transition is weighted by its probability, so the rows of P may sum to less than 1
+(in TrafficMDP, both actions lead nowhere when their rewards are equal).
+'''
+
+import numpy as np
+
+def q_values(P:np.ndarray, R:np.ndarray, values:np.ndarray, discount_factor:float) -> np.ndarray:
+    '''
+    Compute the action values q(s, a) = sum_s' P(s'| s, a) * (R(s, a) + gamma * v(s')).
+
+    Parameters:
+    - P: transition tensor (|S|x|A|x|S|)
+    - R: reward matrix (|S|x|A|)
+    - values: state values (|S|)
+    - discount_factor: discount factor (gamma)
+
+    Returns:
+    - q: action values (|S|x|A|)
+    '''
+    return P.sum(axis=2) * R + discount_factor * (P @ values)
+
+def policy_evaluation(P:np.ndarray, R:np.ndarray, policy:np.ndarray, discount_factor:float) -> np.ndarray:
+    '''
+    Evaluate a policy exactly, by solving the linear system (I - gamma * P_pi) v = r_pi.
+
+    Parameters:
+    - P: transition tensor (|S|x|A|x|S|)
+    - R: reward matrix (|S|x|A|)
+    - policy: policy matrix (|S|x|A|)
+    - discount_factor: discount factor (gamma), lower than 1
+
+    Returns:
+    - values: state values of the policy (|S|)
+    '''
+    P_pi = np.einsum('sa,sat->st', policy, P)
+    r_pi = np.einsum('sa,sa->s', policy, P.sum(axis=2) * R)
+    return np.linalg.solve(np.eye(len(P)) - discount_factor * P_pi, r_pi)
+
+def greedy_policy(q:np.ndarray) -> np.ndarray:
+    '''
+    Get the deterministic policy that takes the best action of each state (the first one on ties).
+
+    Parameters:
+    - q: action values (|S|x|A|)
+
+    Returns:
+    - policy: policy matrix (|S|x|A|)
+    '''
+    policy = np.zeros_like(q)
+    policy[np.arange(len(q)), q.argmax(axis=1)] = 1
+    return policy
+
+def policy_iteration(P:np.ndarray, R:np.ndarray, discount_factor:float, policy:np.ndarray = None, max_iterations:int = 1000, on_sweep = None) -> tuple:
+    '''
+    Perform policy iteration with exact policy evaluation.
+
+    Parameters:
+    - P: transition tensor (|S|x|A|x|S|)
+    - R: reward matrix (|S|x|A|)
+    - discount_factor: discount factor (gamma), lower than 1
+    - policy: initial policy matrix (|S|x|A|), uniform if not given
+    - max_iterations: maximum number of improvement steps
+    - on_sweep: function called after each evaluation and improvement step (e.g. to count them)
+
+    Returns:
+    - values: state values of the final policy (|S|)
+    - policy: final deterministic policy matrix (|S|x|A|)
+    '''
+    if policy is None:
+        policy = np.full(R.shape, 1 / R.shape[1])
+
+    for _ in range(max_iterations):
+        values = policy_evaluation(P, R, policy, discount_factor)
+        new_policy = greedy_policy(q_values(P, R, values, discount_factor))
+        on_sweep() if on_sweep else None
+        if np.array_equal(new_policy, policy):
+            break
+        policy = new_policy
+
+    return values, policy
+
+def value_iteration(P:np.ndarray, R:np.ndarray, discount_factor:float, theta:float, values:np.ndarray = None, max_iterations:int = 100000, on_sweep = None) -> np.ndarray:
+    '''
+    Perform value iteration with vectorized Bellman backups, until the values change by less than theta.
+
+    Parameters:
+    - P: transition tensor (|S|x|A|x|S|)
+    - R: reward matrix (|S|x|A|)
+    - discount_factor: discount factor (gamma)
+    - theta: convergence threshold
+    - values: initial state values (|S|), zeros if not given
+    - max_iterations: maximum number of backups
+    - on_sweep: function called after each backup (e.g. to count them)
+
+    Returns:
+    - values: state values (|S|)
+    '''
+    values = np.zeros(len(P)) if values is None else np.asarray(values, dtype=np.float64)
+    for _ in range(max_iterations):
+        new_values = q_values(P, R, values, discount_factor).max(axis=1)
+        on_sweep() if on_sweep else None
+        delta = np.abs(new_values - values).max()
+        values = new_values
+        if delta < theta:
+            break
+    return values
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+'''
+Offline solver of the discretized stoplight MDP, whose policy is used by the 'lt' (lookup table) mode of the simulation.
+
+The state is the phase (which direction is green), the bucketed number of stopped cars of each approach,
+the bucketed green time and the bucketed waiting time of the longest waiting car on red (see model.lookup_policy).
+One step of the model is one second:
+- 'maintain' keeps the phase: the queues of the green approaches are released, each red approach gets a new
+  car with probability equal to its arrival rate, and the green and waiting times grow by one second.
+- 'change' switches to the other phase, after the yellow light: the new green approaches are released and the
+  new red approaches hold the cars that arrived during the yellow light. The yellow seconds are discounted too.
+Within a bucket, the values are assumed to be uniformly distributed, so a bucket of width k is left with
+probability 1/k of the increase of the value. The reward is minus the car-seconds waited during the step,
+the quantity accumulated by the cumulative waiting time of the simulation.
+A released queue needs some time to leave the intersection (the cars behind the first ones stop again if the
+light turns yellow), so 'change' is not allowed in the first green time bucket: the minimum green time.
+
+The transition matrices are built as Kronecker products of the (independent) transitions of each component,
+stored as scipy.sparse matrices, and the model is solved with policy iteration.
+
+Example:
+    python -m model.offline_policy --spawn-rate 1 --output policies/lookup_table.npz
+'''
+
+import os
+import argparse
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg
+from math import comb
+from model.lookup_policy import LookupTablePolicy, DEFAULT_LOOKUP_TABLE, bucket, QUEUE_EDGES, GREEN_EDGES, WAIT_EDGES, PHASES, ACTIONS
+
+YELLOW_SECONDS = 3      # Stoplight.YELLOW_DURATION in seconds
+APPROACHES = ['up', 'down', 'left', 'right']
+GREEN_APPROACHES = {'NS': ['up', 'down'], 'EW': ['left', 'right']}
+
+def _widths(edges:list) -> np.ndarray:
+    '''
+    Get the width of each bucket (the last bucket is open, its width is the one of the bucket before it).
+    '''
+    widths = np.diff(edges).astype(np.float64)
+    return np.append(widths, widths[-1] if len(widths) else 1)
+
+def _representatives(edges:list) -> np.ndarray:
+    '''
+    Get the value used to represent each bucket: the mean of the integer values it contains.
+    '''
+    return np.array(edges, dtype=np.float64) + (_widths(edges) - 1) / 2
+
+def _step_matrix(edges:list, probability:float) -> sparse.csr_matrix:
+    '''
+    Transitions of a bucketed value that increases by one with the given probability.
+
+    Parameters:
+    - edges: list of the bucket edges
+    - probability: probability that the value increases during the step
+
+    Returns:
+    - sparse matrix with the probability of going from bucket i to bucket j
+    '''
+    n = len(edges)
+    up = np.minimum(1.0, probability / _widths(edges))
+    up[-1] = 0
+    return sparse.csr_matrix(sparse.diags([1 - up, up[:-1]], [0, 1], shape=(n, n)))
+
+def _reset_matrix(edges:list, distribution:np.ndarray = None) -> sparse.csr_matrix:
+    '''
+    Transitions of a bucketed value that is reset, to bucket 0 or to the given distribution over the buckets.
+    '''
+    n = len(edges)
+    if distribution is None:
+        distribution = np.eye(n)[0]
+    return sparse.csr_matrix(np.tile(distribution, (n, 1)))
+
+def _arrivals_distribution(edges:list, probability:float, seconds:int) -> np.ndarray:
+    '''
+    Distribution over the buckets of the number of cars arriving in some seconds, with one Bernoulli arrival per second.
+    '''
+    distribution = np.zeros(len(edges))
+    for n_cars in range(seconds + 1):
+        distribution[bucket(n_cars, edges)] += comb(seconds, n_cars) * probability ** n_cars * (1 - probability) ** (seconds - n_cars)
+    return distribution
+
+def _kron(matrices:list) -> sparse.csr_matrix:
+    '''
+    Kronecker product of the transitions of independent components (the first component varies slowest).
+    '''
+    result = matrices[0]
+    for matrix in matrices[1:]:
+        result = sparse.kron(result, matrix, format='csr')
+    return result
+
+def build_model(arrival_rates:dict, discount_factor:float = 0.95, queue_edges:list = QUEUE_EDGES, green_edges:list = GREEN_EDGES, wait_edges:list = WAIT_EDGES) -> tuple:
+    '''
+    Build the sparse transition matrices and the rewards of the discretized model.
+
+    Parameters:
+    - arrival_rates: dict with the probability that a car arrives at each approach in one second
+    - discount_factor: discount factor of one second (gamma)
+    - queue_edges: list of the bucket edges of the queue lengths
+    - green_edges: list of the bucket edges of the green time, in seconds
+    - wait_edges: list of the bucket edges of the waiting time, in seconds
+
+    Returns:
+    - P: list with, for each action, the sparse |S|x|S| transition matrix (the extra discount of the yellow seconds is folded in)
+    - R: reward matrix (|S|x|A|)
+    - shape: tuple with the shape of the discretized state
+    '''
+    n_queue = len(queue_edges)
+    shape = (len(PHASES),) + (n_queue,) * len(APPROACHES) + (len(green_edges), len(wait_edges))
+    representatives = _representatives(queue_edges)
+
+    P = {action: [[None] * len(PHASES) for _ in PHASES] for action in ACTIONS}
+    rewards = {action: [] for action in ACTIONS}
+    for p, phase in enumerate(PHASES):
+        green = GREEN_APPROACHES[phase]
+        red = [approach for approach in APPROACHES if approach not in green]
+
+        # Maintain: the green approaches are released, the red ones get new cars, the times grow by one second
+        P['maintain'][p][p] = _kron(
+            [_reset_matrix(queue_edges) if approach in green else _step_matrix(queue_edges, arrival_rates[approach]) for approach in APPROACHES] +
+            [_step_matrix(green_edges, 1), _step_matrix(wait_edges, 1)]
+        )
+
+        # Change: after the yellow light, the red approaches are released and the green ones hold the cars that arrived meanwhile
+        seconds = YELLOW_SECONDS + 1
+        wait_after_change = np.eye(len(wait_edges))[bucket(seconds, wait_edges)]
+        P['change'][p][1 - p] = discount_factor ** YELLOW_SECONDS * _kron(
+            [_reset_matrix(queue_edges, _arrivals_distribution(queue_edges, arrival_rates[approach], seconds)) if approach in green else _reset_matrix(queue_edges) for approach in APPROACHES] +
+            [_reset_matrix(green_edges), _reset_matrix(wait_edges, wait_after_change)]
+        )
+
+        # Car-seconds waited during the step by the cars already stopped and by the cars that arrive (half a second on average)
+        queues = np.meshgrid(*[representatives] * len(APPROACHES), indexing='ij')
+        waiting = sum(queues[APPROACHES.index(approach)] + arrival_rates[approach] / 2 for approach in red)
+        yellow_waiting = YELLOW_SECONDS * sum(queues) + sum(arrival_rates.values()) * YELLOW_SECONDS ** 2 / 2
+        times = np.ones(shape[-2:])
+        change_rewards = -np.multiply.outer(yellow_waiting, times)
+        change_rewards[..., 0, :] = -np.inf     # minimum green time
+        rewards['maintain'].append(-np.multiply.outer(waiting, times).ravel())
+        rewards['change'].append(change_rewards.ravel())
+
+    P = [sparse.bmat(P[action], format='csr') for action in ACTIONS]
+    R = np.stack([np.concatenate(rewards[action]) for action in ACTIONS], axis=1)
+    return P, R, shape
+
+def solve(P:list, R:np.ndarray, discount_factor:float = 0.95, max_iterations:int = 100) -> tuple:
+    '''
+    Solve the model with policy iteration, evaluating each policy exactly with a sparse linear solve.
+
+    Parameters:
+    - P: list with the sparse |S|x|S| transition matrix of each action
+    - R: reward matrix (|S|x|A|)
+    - discount_factor: discount factor (gamma)
+    - max_iterations: maximum number of improvement steps
+
+    Returns:
+    - values: state values of the final policy (|S|)
+    - actions: array with the action index of each state (|S|)
+    '''
+    n_states = R.shape[0]
+    identity = sparse.identity(n_states, format='csr')
+    actions = np.zeros(n_states, dtype=np.intp)
+    for _ in range(max_iterations):
+        # (I - gamma * P_pi) v = r_pi, with the rows of P_pi taken from the action of each state
+        P_pi = sum(sparse.diags((actions == a).astype(np.float64)) @ P[a] for a in range(len(P)))
+        r_pi = R[np.arange(n_states), actions]
+        values = scipy.sparse.linalg.spsolve((identity - discount_factor * P_pi).tocsc(), r_pi)
+
+        q = np.stack([R[:, a] + discount_factor * (P[a] @ values) for a in range(len(P))], axis=1)
+        # Keep the current action on ties, so the iteration stops
+        new_actions = np.where(q[np.arange(n_states), actions] >= q.max(axis=1), actions, q.argmax(axis=1))
+        if np.array_equal(new_actions, actions):
+            break
+        actions = new_actions
+
+    return values, actions
+
+def solve_policy(arrival_rates:dict, discount_factor:float = 0.95) -> LookupTablePolicy:
+    '''
+    Build and solve the discretized model.
+
+    Parameters:
+    - arrival_rates: dict with the probability that a car arrives at each approach in one second
+    - discount_factor: discount factor of one second (gamma)
+
+    Returns:
+    - LookupTablePolicy with the optimal action of each discretized state
+    '''
+    P, R, shape = build_model(arrival_rates, discount_factor)
+    _, actions = solve(P, R, discount_factor)
+    return LookupTablePolicy(actions.reshape(shape).astype(np.uint8))
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve the discretized stoplight MDP offline and save its policy as a lookup table.')
+    parser.add_argument('--spawn-rate', type=float, default=1, help='time between two spawns, in seconds (cars spawn in all the directions)')
+    parser.add_argument('--arrival-rates', nargs=4, type=float, metavar=('UP', 'DOWN', 'LEFT', 'RIGHT'), help='arrival probability of each approach per second (overrides --spawn-rate)')
+    parser.add_argument('--discount-factor', type=float, default=0.95)
+    parser.add_argument('--output', default=DEFAULT_LOOKUP_TABLE, help='.npz file where the policy is saved')
+    args = parser.parse_args()
+
+    rates = args.arrival_rates or [min(1.0, 1 / (len(APPROACHES) * args.spawn_rate))] * len(APPROACHES)
+    arrival_rates = dict(zip(APPROACHES, rates))
+
+    policy = solve_policy(arrival_rates, args.discount_factor)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    policy.save(args.output, arrival_rates=np.array(rates), discount_factor=args.discount_factor)
+
+    print(f"Solved {policy.policy.size} states, 'change' in {np.count_nonzero(policy.policy)} of them, policy saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+Replays a run recorded with Simulation.run(trajectory=True), without running any simulation logic.
+
+The recorded state of each tick is drawn with the same Environment, Car and StoplightManager drawing code
+as the live run. The tick records are indexed by tick, so seeking only reads the records of the tick shown.
+
+Controls:
+- SPACE: pause / resume
+- LEFT / RIGHT: seek 10 seconds backward / forward (60 seconds with SHIFT)
+- , / .: step one tick backward / forward
+- DOWN / UP: halve / double the speed (from 0.25x to 64x)
+- HOME / END: seek to the start / end of the run
+- click on the progress bar: seek to that time
+
+Example:
+    python replay.py --output-dir ./data --mode lt --start 660 --speed 4
+"""
+
+import argparse
+import pygame
+from entities.environment import Environment
+from entities.car import Car
+from entities.stoplight import Stoplight
+from entities.stoplight_manager import StoplightManager
+from entities.simulation import Simulation
+from entities.telemetry import COLOR_CODES
+from entities.trajectory import Trajectory
+from entities.vectorized_car_manager import DIRECTIONS
+
+SPEEDS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+SEEK_SECONDS = 10
+LONG_SEEK_SECONDS = 60
+
+PROGRESS_BAR_HEIGHT = 8
+PROGRESS_BAR_COLOR = (255, 255, 255)
+PROGRESS_BAR_BACKGROUND = (30, 30, 30)
+
+# Stoplight colors, by color code
+COLORS = {code: color for color, code in COLOR_CODES.items()}
+
+class ReplayViewer:
+    """
+    Draws the ticks of a recorded run, at a variable speed.
+
+    Attributes:
+    - trajectory: Trajectory object with the recorded run
+    - fps: int representing the simulated ticks per second of the run
+    - mode: str representing the mode of the recorded run
+    - spawning_rules: list with the spawning rules of the recorded run
+    - position: float representing the tick shown (the fractional part accumulates the ticks played between frames)
+    - speed: float representing the simulated seconds played per real second
+    - paused: bool representing if the replay is paused
+    """
+    def __init__(self, trajectory:Trajectory, speed:float = 1, start:float = 0):
+        assert len(trajectory) > 0, "The recording has no ticks"
+        assert speed in SPEEDS, f"Speed must be one of {SPEEDS}"
+
+        self.trajectory = trajectory
+        self.fps = trajectory.metadata['fps']
+        self.mode = trajectory.metadata['mode']
+        self.spawning_rules = trajectory.metadata['spawning_rules']
+        self.speed = speed
+        self.paused = False
+        self.position = 0.0
+        self.seek(start)
+
+        self.environment = Environment(
+            window_size=tuple(trajectory.metadata['window_size']),
+            name=f'Replay of the {self.mode} run'
+        )
+        self.window = self.environment.get_window()
+        self.clock = pygame.time.Clock()
+
+    def get_tick(self) -> int:
+        return int(self.position)
+
+    def seek(self, seconds:float) -> None:
+        """
+        Show the tick at the given simulated time, clamped to the recorded ticks.
+
+        Parameters:
+        - seconds: float representing the simulated time, in seconds
+        """
+        self.position = float(min(max(0, round(seconds * self.fps)), len(self.trajectory) - 1))
+
+    def step(self, ticks:int) -> None:
+        """
+        Move the replay by some ticks (negative to go backward).
+        """
+        self.seek((self.get_tick() + ticks) / self.fps)
+
+    def change_speed(self, steps:int) -> None:
+        """
+        Move the speed up or down the list of SPEEDS.
+        """
+        index = min(max(0, SPEEDS.index(self.speed) + steps), len(SPEEDS) - 1)
+        self.speed = SPEEDS[index]
+
+    def advance(self, real_seconds:float) -> None:
+        """
+        Play the ticks of some real seconds at the current speed, pausing at the end of the run.
+
+        Parameters:
+        - real_seconds: float representing the real time elapsed since the last frame
+        """
+        if self.paused:
+            return
+        self.position += real_seconds * self.speed * self.fps
+        if self.position >= len(self.trajectory) - 1:
+            self.position = float(len(self.trajectory) - 1)
+            self.paused = True
+
+    def handle_event(self, event) -> bool:
+        """
+        Apply the controls of a window event.
+
+        Parameters:
+        - event: pygame event
+
+        Returns:
+        - boolean: False if the user closed the window, True otherwise
+        """
+        if event.type == pygame.QUIT:
+            return False
+
+        if event.type == pygame.KEYDOWN:
+            seek_seconds = LONG_SEEK_SECONDS if event.mod & pygame.KMOD_SHIFT else SEEK_SECONDS
+            if event.key == pygame.K_SPACE:
+                self.paused = not self.paused
+            elif event.key == pygame.K_RIGHT:
+                self.seek(self.get_tick() / self.fps + seek_seconds)
+            elif event.key == pygame.K_LEFT:
+                self.seek(self.get_tick() / self.fps - seek_seconds)
+            elif event.key == pygame.K_PERIOD:
+                self.step(1)
+            elif event.key == pygame.K_COMMA:
+                self.step(-1)
+            elif event.key == pygame.K_UP:
+                self.change_speed(1)
+            elif event.key == pygame.K_DOWN:
+                self.change_speed(-1)
+            elif event.key == pygame.K_HOME:
+                self.seek(0)
+            elif event.key == pygame.K_END:
+                self.seek(len(self.trajectory) / self.fps)
+
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and event.pos[1] >= self.window.get_height() - PROGRESS_BAR_HEIGHT:
+            self.seek(event.pos[0] / self.window.get_width() * len(self.trajectory) / self.fps)
+
+        return True
+
+    def draw(self) -> None:
+        """
+        Draw the tick shown and push it to the display.
+        """
+        tick = self.get_tick()
+        record, cars = self.trajectory.get_tick(tick)
+        total_seconds = tick // self.fps
+
+        stoplight = Stoplight.from_state(COLORS[int(record['color_NS'])], COLORS[int(record['color_EW'])], int(record['time_green']), int(record['time_yellow']))
+
+        self.environment.draw()
+        self.environment.add_dirty_rects(StoplightManager(stoplight).draw_stoplight(self.window))
+        self.environment.draw_cars([
+            Car.from_state(self.window, DIRECTIONS[direction], x, y, stopped, turn_right, waiting_time, tuple(color), car_id)
+            for car_id, x, y, direction, stopped, turn_right, waiting_time, color in cars.tolist()
+        ])
+        self.environment.draw_info_panel(
+            total_seconds,
+            Simulation.determine_current_interval(total_seconds, self.spawning_rules),
+            # The cumulative waiting time shown by the simulation is sampled at the start of each second
+            int(self.trajectory.ticks[total_seconds * self.fps]['cumulative_waiting_time']) // self.fps,
+            self.mode,
+            f"{self.speed:g}x" + (" (paused)" if self.paused else "")
+        )
+        self._draw_progress_bar(tick)
+        self.environment.update()
+
+    def _draw_progress_bar(self, tick:int) -> None:
+        """
+        Draw the progress bar at the bottom of the window.
+        """
+        width, height = self.window.get_size()
+        bar = pygame.Rect(0, height - PROGRESS_BAR_HEIGHT, width, PROGRESS_BAR_HEIGHT)
+        pygame.draw.rect(self.window, PROGRESS_BAR_BACKGROUND, bar)
+        pygame.draw.rect(self.window, PROGRESS_BAR_COLOR, (0, bar.y, width * (tick + 1) // len(self.trajectory), PROGRESS_BAR_HEIGHT))
+        self.environment.add_dirty_rects([bar])
+
+    def run(self) -> None:
+        """
+        Play the recording until the window is closed.
+        """
+        while True:
+            real_seconds = self.clock.tick(self.fps) / 1000
+
+            for event in pygame.event.get():
+                if not self.handle_event(event):
+                    self.environment.close()
+                    return
+
+            self.advance(real_seconds)
+            self.draw()
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a run recorded with Simulation.run(trajectory=True).')
+    parser.add_argument('--output-dir', default='./data', help='directory where the run was recorded')
+    parser.add_argument('--mode', required=True, choices=['ft', 'pi', 'vi', 'lt'], help='mode of the recorded run')
+    parser.add_argument('--start', type=float, default=0, help='simulated time where the replay starts, in seconds')
+    parser.add_argument('--speed', type=float, default=1, choices=SPEEDS, help='simulated seconds played per real second')
+    args = parser.parse_args()
+
+    ReplayViewer(Trajectory(args.output_dir, args.mode), speed=args.speed, start=args.start).run()
+
+if __name__ == '__main__':
+    main()